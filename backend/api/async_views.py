@@ -0,0 +1,291 @@
+"""
+ASGI-native versions of the read endpoints.
+
+They serve the same JSON as the DRF views in api/views.py (same serializers,
+pagination, search, query plans, response cache and ETags) but talk to the
+database through the async ORM, so under an ASGI server a slow query parks a
+coroutine instead of a worker thread. They are mounted under /api/async/ next
+to the sync routes; writes stay on the sync views.
+"""
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from django.views import View
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from . import view_counts
+from .authentication import CachedJWTAuthentication
+from .cache import aget_versions, get_cache, response_cache_key
+from .conditional import make_etag
+from .fast_serializers import FastCommentSerializer, FastPostListSerializer
+from .filters import FullTextSearchFilter, HotOrderingFilter
+from .models import Post, Category, Comment
+from .pagination import KeysetPagination
+from .query_planner import plan_for_request
+from .serializers import UserSerializer, PostSerializer, PostListSerializer, CategorySerializer, CommentSerializer
+
+
+MEDIA_TYPE = 'application/json'
+
+
+class JSONResponse(HttpResponse):
+    """Rendered exactly like DRF's JSONRenderer; keeps `data` for the response cache."""
+
+    def __init__(self, data, status=200, **kwargs):
+        super().__init__(JSONRenderer().render(data), content_type=MEDIA_TYPE, status=status, **kwargs)
+        self.data = data
+
+
+async def authenticate(request):
+    """
+    CachedJWTAuthentication with the user lookup on the async cache and ORM,
+    falling back to the session like the DRF views do.
+    """
+    auth = CachedJWTAuthentication()
+    header = auth.get_header(request)
+    raw_token = auth.get_raw_token(header) if header is not None else None
+    if raw_token is None:
+        user = await request.auser()
+        return user if user.is_active else AnonymousUser()
+
+    return await auth.aget_user(auth.get_validated_token(raw_token))
+
+
+class AsyncAPIView(View):
+    """
+    The slice of APIView the read endpoints need: JWT/session authentication,
+    an authentication requirement, DRF-shaped error bodies and JSON rendering.
+    """
+    http_method_names = ['get', 'head', 'options']
+    authentication_required = False
+
+    async def dispatch(self, request, *args, **kwargs):
+        # query_params, build_absolute_uri() etc. for the pagination and filters.
+        self.request = request = Request(request)
+        try:
+            request.user = await authenticate(request._request)
+            if self.authentication_required and not request.user.is_authenticated:
+                raise exceptions.NotAuthenticated()
+            if request.method.lower() not in self.http_method_names:
+                raise exceptions.MethodNotAllowed(request.method)
+            response = await getattr(self, request.method.lower())(request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            response = self.handle_exception(exc)
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+    def handle_exception(self, exc):
+        if isinstance(exc.detail, (list, dict)):
+            data = exc.detail
+        else:
+            data = {'detail': exc.detail}
+        response = JSONResponse(data, status=exc.status_code)
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            response['WWW-Authenticate'] = CachedJWTAuthentication().authenticate_header(self.request)
+        return response
+
+    async def options(self, request, *args, **kwargs):
+        response = JSONResponse({})
+        response['Allow'] = ', '.join(method.upper() for method in self.http_method_names)
+        return response
+
+    async def head(self, request, *args, **kwargs):
+        return await self.get(request, *args, **kwargs)
+
+    async def get(self, request, *args, **kwargs):
+        return JSONResponse(await self.get_data())
+
+    async def get_data(self):
+        raise NotImplementedError
+
+
+class AsyncCachedResponseMixin:
+    """CachedResponseMixin on the async cache API."""
+    cache_timeout = None
+
+    def get_cache_resources(self):
+        raise NotImplementedError
+
+    async def get(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return await super().get(request, *args, **kwargs)
+
+        cache = get_cache()
+        versions = await aget_versions(self.get_cache_resources())
+        key = response_cache_key(request, type(self).__name__, versions, MEDIA_TYPE)
+        data = await cache.aget(key)
+        if data is not None:
+            response = JSONResponse(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response = await super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            timeout = self.cache_timeout if self.cache_timeout is not None else settings.API_CACHE_TIMEOUT
+            await cache.aset(key, response.data, timeout)
+        response['X-Cache'] = 'MISS'
+        return response
+
+
+class AsyncConditionalGetMixin:
+    """ConditionalGetMixin with get_validators() awaited."""
+
+    async def get_validators(self):
+        raise NotImplementedError
+
+    async def get(self, request, *args, **kwargs):
+        validators = await self.get_validators()
+        if validators is None:
+            return await super().get(request, *args, **kwargs)
+
+        parts, last_modified = validators
+        etag = make_etag(type(self).__name__, request.get_full_path(), MEDIA_TYPE, *parts)
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+
+        response = get_conditional_response(request._request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = await super().get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        return response
+
+
+class AsyncListView(AsyncAPIView):
+    serializer_class = None
+    # Read-only .values() serializer (api/fast_serializers.py) used instead when enabled.
+    fast_serializer_class = None
+    pagination_class = None
+    filter_backends = []
+
+    def get_queryset(self):
+        raise NotImplementedError
+
+    def filter_queryset(self, queryset):
+        for backend in self.filter_backends:
+            queryset = backend().filter_queryset(self.request, queryset, self)
+        return plan_for_request(self.serializer_class, queryset.model, self.request).apply(queryset)
+
+    async def get_data(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        paginator = self.pagination_class() if self.pagination_class is not None else None
+        if self.fast_serializer_class is not None and settings.API_FAST_SERIALIZERS:
+            fast = self.fast_serializer_class(self.request)
+            keys = paginator.get_ordering(self.request, queryset, self) if paginator is not None else ()
+            queryset = fast.values(queryset, [key.lstrip('-') for key in keys])
+            serialize = fast.serialize
+        else:
+            context = {'request': self.request, 'view': self}
+            def serialize(rows):
+                return self.serializer_class(rows, many=True, context=context).data
+
+        if paginator is None:
+            return serialize([row async for row in queryset])
+        page = paginator.set_page([row async for row in paginator.page_queryset(queryset, self.request, self)])
+        return {
+            'next': paginator.get_next_link(),
+            'previous': paginator.get_previous_link(),
+            'results': serialize(page),
+        }
+
+
+class AsyncMeView(AsyncAPIView):
+    authentication_required = True
+
+    async def get_data(self):
+        return UserSerializer(self.request.user).data
+
+
+class AsyncPostListView(AsyncCachedResponseMixin, AsyncListView):
+    serializer_class = PostListSerializer
+    fast_serializer_class = FastPostListSerializer
+    pagination_class = KeysetPagination
+    filter_backends = [FullTextSearchFilter, HotOrderingFilter]
+
+    def get_queryset(self):
+        return Post.objects.all().order_by('-created_at')
+
+    def get_cache_resources(self):
+        return ['posts']
+
+
+class AsyncPostDetailView(AsyncConditionalGetMixin, AsyncCachedResponseMixin, AsyncAPIView):
+
+    async def get(self, request, *args, **kwargs):
+        response = await super().get(request, *args, **kwargs)
+        if request.method == 'GET' and response.status_code in (200, 304):
+            view_counts.hit(self.kwargs['slug'])
+        return response
+
+    def get_cache_resources(self):
+        # The detail shows the category's name.
+        return [f"post:{self.kwargs['slug']}", 'categories']
+
+    async def get_validators(self):
+        row = await Post.objects.filter(slug=self.kwargs['slug']).values_list(
+            'id', 'updated_at', 'comment_count', 'category__name'
+        ).afirst()
+        if row is None:
+            return None
+        return row, row[1]
+
+    async def get_data(self):
+        plan = plan_for_request(PostSerializer, Post, self.request)
+        queryset = plan.apply(Post.objects.filter(slug=self.kwargs['slug']))
+        post = await queryset.afirst()
+        if post is None:
+            raise exceptions.NotFound("No Post matches the given query.")
+        return PostSerializer(post, context={'request': self.request, 'view': self}).data
+
+
+class AsyncPostsByCategoryView(AsyncCachedResponseMixin, AsyncListView):
+    serializer_class = PostListSerializer
+    fast_serializer_class = FastPostListSerializer
+    pagination_class = KeysetPagination
+    filter_backends = [HotOrderingFilter]
+
+    def get_queryset(self):
+        return Post.objects.filter(category__name=self.kwargs['category_name']).order_by('-created_at')
+
+    def get_cache_resources(self):
+        return ['posts']
+
+
+class AsyncCategoryListView(AsyncConditionalGetMixin, AsyncCachedResponseMixin, AsyncListView):
+    serializer_class = CategorySerializer
+
+    def get_queryset(self):
+        return Category.objects.all()
+
+    def get_cache_resources(self):
+        return ['categories']
+
+    async def get_validators(self):
+        stats = await Category.objects.aaggregate(count=Count('id'), last=Max('id'))
+        return (stats['count'], stats['last']), None
+
+
+class AsyncPostCommentListView(AsyncConditionalGetMixin, AsyncCachedResponseMixin, AsyncListView):
+    serializer_class = CommentSerializer
+    fast_serializer_class = FastCommentSerializer
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        return Comment.objects.filter(post__id=self.kwargs['post_id']).order_by('-created_at')
+
+    def get_cache_resources(self):
+        return [f"comments:{self.kwargs['post_id']}"]
+
+    async def get_validators(self):
+        row = await Post.objects.filter(id=self.kwargs['post_id']).values_list('updated_at', 'comment_count').afirst()
+        if row is None:
+            return None
+        return row, row[0]
@@ -0,0 +1,124 @@
+"""
+JWT authentication without a users query per request.
+
+simplejwt's JWTAuthentication loads the whole User row for every request that
+carries a token. The token already names the user, and what the API reads
+from request.user (id, username, is_staff, is_superuser, is_active) fits in a
+small cache entry. CachedJWTAuthentication keeps those fields in the `api`
+cache (bounded by its MAX_ENTRIES, expiring after AUTH_USER_CACHE_TIMEOUT)
+and builds the user from the token's id plus that entry. The entry is dropped
+whenever the user is saved or deleted, see api/signals.py. A per-process cache
+would only drop it in the worker that saved the user and leave a deactivated
+or demoted user their access in the others, so the user cache is only used
+when the `api` cache is shared by all workers, and not when that cache is a
+database table: reading the entry would cost the query it is meant to save.
+With Redis or the file backend an authenticated request reads no user row.
+"""
+from django.conf import settings
+from django.core.cache.backends.db import BaseDatabaseCache
+from django.db import router, transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from . import db_router
+from .cache import get_cache, is_shared
+
+
+USER_PREFIX = 'api:u:'
+# Everything else on the user is deferred and loaded on first access.
+USER_FIELDS = ('username', 'is_active', 'is_staff', 'is_superuser')
+
+
+def user_cache_key(user_id):
+    return f'{USER_PREFIX}{user_id}'
+
+
+def forget_user_on_commit(user_id):
+    """Drop the cached fields once the change is visible to other requests."""
+    key = user_cache_key(user_id)
+    transaction.on_commit(lambda: get_cache().delete(key))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Only pk-addressed users can be rebuilt from a cache entry; the
+        # password-hash revocation check needs the real row.
+        self.cacheable = (
+            jwt_settings.USER_ID_FIELD in ('id', 'pk', self.user_model._meta.pk.attname)
+            and not jwt_settings.CHECK_REVOKE_TOKEN
+            and is_shared()
+            and not isinstance(get_cache(), BaseDatabaseCache)
+        )
+
+    def get_user(self, validated_token):
+        user_id = self.get_user_id(validated_token)
+        key = user_cache_key(user_id)
+        cache = get_cache()
+        # One cache round trip for the user's fields and replica pin (see
+        # api/db_router.py); the pin has to be known before the first query.
+        keys = ([key] if self.cacheable else []) + db_router.identify(user_id)
+        found = cache.get_many(keys) if keys else {}
+        db_router.apply_pin(user_id, found)
+        if not self.cacheable:
+            return super().get_user(validated_token)
+        fields = found.get(key)
+        if fields is None:
+            user = super().get_user(validated_token)
+            cache.set(key, self.dump(user), settings.AUTH_USER_CACHE_TIMEOUT)
+            return user
+        return self.build(user_id, fields)
+
+    async def aget_user(self, validated_token):
+        """get_user on the async cache and ORM."""
+        user_id = self.get_user_id(validated_token)
+        key = user_cache_key(user_id)
+        cache = get_cache()
+        keys = ([key] if self.cacheable else []) + db_router.identify(user_id)
+        found = await cache.aget_many(keys) if keys else {}
+        db_router.apply_pin(user_id, found)
+        if not self.cacheable:
+            return self.check_active(await self.aget_row(user_id))
+        fields = found.get(key)
+        if fields is None:
+            user = self.check_active(await self.aget_row(user_id))
+            await cache.aset(key, self.dump(user), settings.AUTH_USER_CACHE_TIMEOUT)
+            return user
+        return self.build(user_id, fields)
+
+    @staticmethod
+    def get_user_id(validated_token):
+        try:
+            return validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+    async def aget_row(self, user_id):
+        user = await self.user_model.objects.filter(**{jwt_settings.USER_ID_FIELD: user_id}).afirst()
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        return user
+
+    @staticmethod
+    def check_active(user):
+        if jwt_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
+
+    @staticmethod
+    def dump(user):
+        return [getattr(user, name) for name in USER_FIELDS]
+
+    def build(self, user_id, fields):
+        opts = self.user_model._meta
+        loaded = dict(zip(USER_FIELDS, fields), **{opts.pk.attname: opts.pk.to_python(user_id)})
+        names = [field.attname for field in opts.concrete_fields if field.attname in loaded]
+        # A regular model instance (FK assignment, ==, permissions), only
+        # with the other columns deferred, so a save() cannot blank them.
+        user = self.user_model.from_db(
+            router.db_for_read(self.user_model), names, [loaded[name] for name in names]
+        )
+        return self.check_active(user)
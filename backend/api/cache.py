@@ -0,0 +1,123 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from rest_framework.response import Response
+
+
+CACHE_ALIAS = 'api'
+VERSION_PREFIX = 'api:v:'
+RESPONSE_PREFIX = 'api:r:'
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def is_shared():
+    """Whether an entry set by one worker process is seen by the others."""
+    return not isinstance(get_cache(), (LocMemCache, DummyCache))
+
+
+def _version_key(resource):
+    return f'{VERSION_PREFIX}{resource}'
+
+
+def _new_version():
+    # A fresh version never repeats an old one, so an evicted counter cannot
+    # bring responses cached under a previous number back to life.
+    return time.time_ns()
+
+
+def get_versions(resources):
+    cache = get_cache()
+    keys = [_version_key(resource) for resource in resources]
+    found = cache.get_many(keys)
+    versions = []
+    for key in keys:
+        if key not in found:
+            cache.add(key, _new_version(), timeout=None)
+            found[key] = cache.get(key)
+        versions.append(found[key])
+    return versions
+
+
+async def aget_versions(resources):
+    cache = get_cache()
+    keys = [_version_key(resource) for resource in resources]
+    found = await cache.aget_many(keys)
+    versions = []
+    for key in keys:
+        if key not in found:
+            await cache.aadd(key, _new_version(), timeout=None)
+            found[key] = await cache.aget(key)
+        versions.append(found[key])
+    return versions
+
+
+def bump(*resources):
+    """Invalidate every cached response that depends on `resources`."""
+    cache = get_cache()
+    for resource in resources:
+        key = _version_key(resource)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_version(), timeout=None)
+
+
+def bump_on_commit(*resources):
+    """
+    Bump once the surrounding transaction commits; bumping earlier would let a
+    concurrent reader cache the pre-commit rows under the new version.
+    """
+    transaction.on_commit(lambda: bump(*resources))
+
+
+def response_cache_key(request, view_name, versions, media_type=None):
+    # The accepted media type is part of the key so the browsable API and
+    # JSON clients never get each other's negotiated response.
+    target = f'{request.get_full_path()}|{media_type or request.accepted_media_type}'
+    digest = hashlib.sha1(target.encode('utf-8')).hexdigest()
+    version = '.'.join(str(number) for number in versions)
+    return f'{RESPONSE_PREFIX}{view_name}:{digest}:{version}'
+
+
+class CachedResponseMixin:
+    """
+    Cache the serialized data of anonymous GETs.
+
+    Views list the resources their response is built from in
+    get_cache_resources(); writes bump those resources' versions (see
+    api/signals.py), which changes the key, so invalidation is exact (as long
+    as all workers share the cache, see is_shared) and stale entries simply
+    age out of the cache.
+    """
+    cache_timeout = None
+
+    def get_cache_resources(self):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().get(request, *args, **kwargs)
+
+        cache = get_cache()
+        versions = get_versions(self.get_cache_resources())
+        key = response_cache_key(request, type(self).__name__, versions)
+        data = cache.get(key)
+        if data is not None:
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            timeout = self.cache_timeout if self.cache_timeout is not None else settings.API_CACHE_TIMEOUT
+            cache.set(key, response.data, timeout)
+        response['X-Cache'] = 'MISS'
+        return response
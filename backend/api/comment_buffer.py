@@ -0,0 +1,238 @@
+"""
+Write-behind batching of new comments (COMMENT_WRITE_MODE = 'buffered').
+
+A comment normally costs its own transaction: INSERT, the comment_count
+UPDATE in Comment.save and a round of cache bumps. Under a burst on one hot
+thread those serialize on the post's row. In buffered mode the view still
+validates every comment in the request, then queues it here; a batch is
+written when COMMENT_BUFFER_SIZE comments are waiting (by the request that
+fills it) or COMMENT_BUFFER_WINDOW seconds after the first one (by a
+background thread), with one bulk_create, one UPDATE of the counters (and
+hot scores) of all posts in the batch and one set of cache bumps.
+
+COMMENT_BUFFER_DURABILITY decides when the client gets its answer:
+
+    'commit'   201 once the batch holding the comment has committed, with its
+               id, like the direct mode (group commit: latency grows by at most
+               the window, nothing acknowledged is ever lost).
+    'enqueue'  202 as soon as the comment is queued; whatever is still queued
+               when the process dies without shutting down is lost.
+
+A request that waits longer than COMMIT_TIMEOUT takes its comment back out
+of the queue and answers 503; if the comment is already being written it
+answers 202 instead. With no window (0), a 'commit' request writes the queue
+itself rather than waiting for a batch to fill.
+
+Queued comments are flushed on a clean shutdown (atexit, which also runs for
+a worker stopped with SIGTERM by gunicorn) and when the settings change.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import hot
+from .cache import bump_on_commit
+from .models import Comment, Post
+
+
+logger = logging.getLogger(__name__)
+
+COMMIT = 'commit'
+ENQUEUE = 'enqueue'
+# How long a request waits for its batch in 'commit' mode before giving up.
+COMMIT_TIMEOUT = 30
+
+
+class CommentBuffer:
+
+    def __init__(self, size, window, durability=COMMIT):
+        if durability not in (COMMIT, ENQUEUE):
+            raise ValueError(f"Unknown comment buffer durability: {durability!r}")
+        self.size = size
+        self.window = window
+        self.durability = durability
+        self.pending = []
+        self.lock = threading.Condition()
+        self.thread = None
+        self.stopped = False
+
+    def add(self, comment):
+        """Queue an unsaved comment; the future resolves to it once it is written."""
+        future = Future()
+        with self.lock:
+            if self.stopped:
+                raise RuntimeError("The comment buffer has been shut down.")
+            self.pending.append((comment, future))
+            # Without a window nothing else would write a 'commit' request's batch.
+            flush = len(self.pending) >= self.size or (not self.window and self.durability == COMMIT)
+            if not flush and self.window:
+                self.start()
+                self.lock.notify()
+        if flush:
+            self.flush()
+        return future
+
+    def withdraw(self, future):
+        """Take a comment back out of the queue; False once its batch is being written."""
+        with self.lock:
+            for index, (_, queued) in enumerate(self.pending):
+                if queued is future:
+                    del self.pending[index]
+                    return True
+        return False
+
+    def submit(self, comment):
+        """
+        add() and, in 'commit' mode, wait until the comment is in the database.
+        Raises TimeoutError when it was taken back out of the queue after
+        COMMIT_TIMEOUT; returns it unsaved when it is still to be written.
+        """
+        future = self.add(comment)
+        if self.durability == COMMIT:
+            try:
+                return future.result(timeout=COMMIT_TIMEOUT)
+            except TimeoutError:
+                if self.withdraw(future):
+                    raise
+        return comment
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if batch:
+            write_batch(batch)
+        return len(batch)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='comment-buffer', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            with self.lock:
+                while not self.pending and not self.stopped:
+                    self.lock.wait()
+                if self.stopped:
+                    return
+            # The window starts with the first queued comment.
+            time.sleep(self.window)
+            try:
+                self.flush()
+            finally:
+                # Worker threads get their own connections; do not leak them.
+                close_old_connections()
+
+    def shutdown(self):
+        """Stop the background thread and write whatever is still queued."""
+        with self.lock:
+            self.stopped = True
+            self.lock.notify()
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            thread.join()
+        return self.flush()
+
+
+def write_batch(batch):
+    """Insert `batch` ([(comment, future)]) and settle every future."""
+    try:
+        with transaction.atomic():
+            written = insert(batch)
+    except IntegrityError:
+        # A post deleted after the existence check; write the rest one by one.
+        logger.warning("Comment batch of %s failed, retrying row by row", len(batch))
+        for comment, future in batch:
+            # bulk_create may have assigned ids before the rollback.
+            comment.pk = None
+            write_batch_of_one(comment, future)
+        return
+    except Exception as exc:
+        logger.exception("Comment batch of %s failed", len(batch))
+        for _, future in batch:
+            future.set_exception(exc)
+        return
+    written = {id(comment) for comment in written}
+    for comment, future in batch:
+        if id(comment) in written:
+            future.set_result(comment)
+        else:
+            future.set_exception(Post.DoesNotExist(f"Post {comment.post_id} does not exist."))
+
+
+def write_batch_of_one(comment, future):
+    try:
+        with transaction.atomic():
+            written = insert([(comment, future)])
+    except Exception as exc:
+        future.set_exception(exc)
+        return
+    if written:
+        future.set_result(comment)
+    else:
+        future.set_exception(Post.DoesNotExist(f"Post {comment.post_id} does not exist."))
+
+
+def insert(batch):
+    """One bulk_create, one counter UPDATE and one cache bump for the whole batch."""
+    slugs = dict(Post.objects.filter(pk__in={comment.post_id for comment, _ in batch}).values_list('pk', 'slug'))
+    comments = [comment for comment, _ in batch if comment.post_id in slugs]
+    if not comments:
+        return []
+    Comment.objects.bulk_create(comments)
+    counts = Counter(comment.post_id for comment in comments)
+    hot.add_activity(
+        {post_id: settings.HOT_COMMENT_WEIGHT * count for post_id, count in counts.items()},
+        comment_count=F('comment_count') + Case(
+            *[When(pk=post_id, then=Value(count)) for post_id, count in counts.items()],
+            output_field=IntegerField(),
+        ),
+        updated_at=timezone.now(),
+    )
+    # bulk_create sends no post_save, so this replaces invalidate_comment.
+    bump_on_commit(
+        'posts',
+        *[f'comments:{post_id}' for post_id in counts],
+        *[f'post:{slugs[post_id]}' for post_id in counts if slugs[post_id]],
+    )
+    return comments
+
+
+def is_enabled():
+    return settings.COMMENT_WRITE_MODE == 'buffered'
+
+
+@lru_cache(maxsize=None)
+def get_buffer():
+    buffer = CommentBuffer(
+        settings.COMMENT_BUFFER_SIZE, settings.COMMENT_BUFFER_WINDOW, settings.COMMENT_BUFFER_DURABILITY,
+    )
+    atexit.register(buffer.shutdown)
+    return buffer
+
+
+def shutdown():
+    """Flush and stop the current buffer, if one was started."""
+    if get_buffer.cache_info().currsize:
+        buffer = get_buffer()
+        get_buffer.cache_clear()
+        atexit.unregister(buffer.shutdown)
+        return buffer.shutdown()
+    return 0
+
+
+@receiver(setting_changed)
+def reset_buffer(setting, **kwargs):
+    if setting.startswith('COMMENT_'):
+        shutdown()
@@ -0,0 +1,46 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def make_etag(*parts):
+    raw = '|'.join(str(part) for part in parts)
+    return quote_etag(hashlib.sha1(raw.encode('utf-8')).hexdigest()[:20])
+
+
+class ConditionalGetMixin:
+    """
+    ETag / Last-Modified validators for GET, answered with 304 before any
+    serialization happens.
+
+    Views implement get_validators(), which returns the small set of values
+    the response is derived from (fetched with one cheap query), or None when
+    there is nothing to validate (e.g. the object does not exist), plus an
+    optional last-modified datetime.
+    """
+
+    def get_validators(self):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        validators = self.get_validators()
+        if validators is None:
+            return super().get(request, *args, **kwargs)
+
+        parts, last_modified = validators
+        # Same data, different URL (cursor, page size) or media type is a
+        # different representation.
+        etag = make_etag(type(self).__name__, request.get_full_path(), request.accepted_media_type, *parts)
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        return response
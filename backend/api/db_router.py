@@ -0,0 +1,127 @@
+"""
+Read replicas for the API's read requests, with read-your-writes stickiness.
+
+DATABASE_REPLICA_URLS adds one `replica_<n>` connection per URL and lists
+their aliases in settings.DATABASE_REPLICAS. ReplicaMiddleware
+(api/middleware.py) opens a Route for every request; ReplicaRouter only
+sends a query to a replica when that route allows it:
+
+- the request is a GET/HEAD/OPTIONS under /api/,
+- nothing in it has written yet and it is not inside a transaction,
+- its user has not written anything in the last REPLICA_PIN_SECONDS.
+
+Everything else (writes, reads of a write request, admin pages, management
+commands) uses the primary. The
+pin is an entry in the `api` cache, set when a request by an identified user
+wrote something; CachedJWTAuthentication identifies the user and reads the
+pin together with its cached user fields, before the view runs its queries.
+The user's next request usually reaches another worker, so replicas are only
+used when that cache is shared by all workers (see cache.is_shared).
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .cache import get_cache, is_shared
+
+
+PIN_PREFIX = 'api:pin:'
+API_PREFIX = '/api/'
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_route = ContextVar('api_db_route', default=None)
+
+
+def pin_cache_key(user_id):
+    return f'{PIN_PREFIX}{user_id}'
+
+
+class Route:
+    """Where the current request reads from; `replica` is None once it is pinned to the primary."""
+    __slots__ = ('replica', 'user_id', 'wrote')
+
+    def __init__(self, replica=None):
+        self.replica = replica
+        self.user_id = None
+        self.wrote = False
+
+
+def open_route(request):
+    # A pin in a per-process cache would not reach the user's next request.
+    replicas = settings.DATABASE_REPLICAS if is_shared() else []
+    readonly = request.method in READ_METHODS and request.path_info.startswith(API_PREFIX)
+    # One replica per request, so its queries see one consistent snapshot.
+    return _route.set(Route(random.choice(replicas) if replicas and readonly else None))
+
+
+def close_route(token):
+    route = _route.get()
+    _route.reset(token)
+    if route is not None and route.wrote and route.user_id is not None:
+        get_cache().set(pin_cache_key(route.user_id), True, settings.REPLICA_PIN_SECONDS)
+
+
+async def aclose_route(token):
+    """close_route on the async cache."""
+    route = _route.get()
+    _route.reset(token)
+    if route is not None and route.wrote and route.user_id is not None:
+        await get_cache().aset(pin_cache_key(route.user_id), True, settings.REPLICA_PIN_SECONDS)
+
+
+def identify(user_id):
+    """
+    Record who the current request is for; returns the cache keys to fetch
+    for apply_pin() (none when the request reads from the primary anyway).
+    """
+    route = _route.get()
+    if route is None:
+        return []
+    route.user_id = user_id
+    return [pin_cache_key(user_id)] if route.replica is not None else []
+
+
+def apply_pin(user_id, found):
+    """Keep the current request on the primary when `found` (a cache get_many result) holds the user's pin."""
+    route = _route.get()
+    if route is not None and found.get(pin_cache_key(user_id)):
+        route.replica = None
+
+
+def mark_written():
+    """Pin the current request and its user to the primary, e.g. for a write another thread does for it."""
+    route = _route.get()
+    if route is not None:
+        route.wrote = True
+        route.replica = None
+
+
+class ReplicaRouter:
+    """Primary for writes, migrations and anything the current Route does not send to a replica."""
+
+    def db_for_read(self, model, **hints):
+        route = _route.get()
+        if route is None or route.replica is None:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return route.replica
+
+    def db_for_write(self, model, **hints):
+        # Read your own write for the rest of this request, and pin the user for the next ones.
+        mark_written()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary through replication.
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
@@ -0,0 +1,146 @@
+"""
+Read-only serializers for the hot list endpoints that work on .values() rows.
+
+A ModelSerializer builds model instances, walks a field tree and calls
+get_attribute/to_representation on every field of every row. The classes
+below pick the columns their output needs, fetch them with .values() and
+turn each row into the same dict with one plain function per field. The
+field selection (including ?fields= / ?omit= and its errors) and the field
+order still come from the model serializer they mirror, built once per
+request, so both always agree on the shape; the parity tests in
+api/tests.py check the bytes.
+"""
+from operator import itemgetter
+
+from django.conf import settings
+from rest_framework import ISO_8601, serializers
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .images import THUMBNAIL, variant_sizes
+from .models import POST_IMAGE_PLACEHOLDER
+from .media_urls import absolute_media_urls
+from .serializers import CommentSerializer, PostListSerializer
+
+
+def column(name):
+    """A field that is just the value of one column."""
+    return [name], itemgetter(name)
+
+
+class FastSerializer:
+    model_serializer = None
+
+    def __init__(self, request=None):
+        self.request = request
+        context = {'request': request} if request is not None else {}
+        # Validates the sparse fieldset exactly like the model serializer does.
+        names = list(self.model_serializer(context=context).fields)
+        writers = self.get_writers()
+        self.writers = [(name, writers[name][1]) for name in names]
+        self.columns = list(dict.fromkeys(
+            path for name in names for path in writers[name][0]
+        ))
+
+    def get_writers(self):
+        """{field name: ([columns], function(row) -> JSON value)}"""
+        raise NotImplementedError
+
+    def values(self, queryset, extra=()):
+        """`queryset` as the rows serialize() reads; `extra` are columns kept for the paginator."""
+        extra = [name for name in extra if name not in queryset.query.annotations]
+        return queryset.values(*dict.fromkeys([*self.columns, *extra]), *queryset.query.annotations)
+
+    def serialize(self, rows):
+        writers = self.writers
+        return [{name: write(row) for name, write in writers} for row in rows]
+
+    def datetime(self, name):
+        field = serializers.DateTimeField()
+        tz = field.default_timezone()
+        iso = (api_settings.DATETIME_FORMAT or '').lower() == ISO_8601
+
+        def write(row):
+            value = row[name]
+            # DateTimeField.to_representation, with the timezone looked up once.
+            if iso and tz is not None and value is not None and value.tzinfo is not None:
+                value = value.astimezone(tz).isoformat()
+                return value[:-6] + 'Z' if value.endswith('+00:00') else value
+            return field.to_representation(value)
+
+        return [name], write
+
+
+class FastPostListSerializer(FastSerializer):
+    model_serializer = PostListSerializer
+
+    def get_writers(self):
+        self.media_url = absolute_media_urls(self.request)
+        return {
+            'id': column('id'),
+            'user': column('user_id'),
+            'title': column('title'),
+            'content': column('content'),
+            'created_at': self.datetime('created_at'),
+            'category': column('category__name'),
+            'image': (['image', 'image_variants'], self.image),
+            'comment_count': column('comment_count'),
+            'slug': column('slug'),
+            'excerpt': column('excerpt'),
+            'word_count': column('word_count'),
+            'reading_time': column('reading_time'),
+            'view_count': column('view_count'),
+        }
+
+    def image(self, row):
+        # MediaFileField + PostSerializer.image_map
+        source = row['image'] or ''
+        original = self.media_url(source or POST_IMAGE_PLACEHOLDER)
+        urls = {
+            size: self.media_url(name)
+            for size, name in variant_sizes(source, row['image_variants']).items()
+        }
+        thumbnail = urls.pop(THUMBNAIL, original)
+        return {'original': original, 'thumbnail': thumbnail, 'srcset': urls}
+
+
+class FastCommentSerializer(FastSerializer):
+    model_serializer = CommentSerializer
+
+    def get_writers(self):
+        return {
+            'id': column('id'),
+            'post': column('post_id'),
+            'user': column('user__username'),
+            'content': column('content'),
+            'created_at': self.datetime('created_at'),
+        }
+
+
+class FastListMixin:
+    """
+    Serve list GETs through `fast_serializer_class` when API_FAST_SERIALIZERS
+    is on; everything else (writes, filters, pagination, caching) is unchanged.
+    """
+    fast_serializer_class = None
+
+    def get_fast_serializer(self):
+        if self.fast_serializer_class is None or not settings.API_FAST_SERIALIZERS:
+            return None
+        return self.fast_serializer_class(self.request)
+
+    def fast_rows(self, serializer, queryset):
+        paginator = self.paginator
+        keys = paginator.get_ordering(self.request, queryset, self) if hasattr(paginator, 'get_ordering') else ()
+        return serializer.values(queryset, [key.lstrip('-') for key in keys])
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_fast_serializer()
+        if serializer is None:
+            return super().list(request, *args, **kwargs)
+        queryset = self.fast_rows(serializer, self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer.serialize(page))
+        return Response(serializer.serialize(queryset))
+
@@ -0,0 +1,75 @@
+from django.db import connections
+from django.db.models import OuterRef, Q, Subquery, Sum
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.settings import api_settings
+
+from .models import SearchTerm
+from .search import query_terms
+
+
+class FullTextSearchFilter(BaseFilterBackend):
+    """
+    ?search= over the SearchTerm index instead of OR'ed LIKE '%term%' scans.
+
+    Every query term has to match (as a prefix of an indexed term, so partial
+    words still find posts), and results are ranked by the summed weight of
+    the matching terms, then newest first.
+    """
+    search_param = api_settings.SEARCH_PARAM
+
+    def get_search_terms(self, request):
+        return query_terms(request.query_params.get(self.search_param, ''))
+
+    def prefix(self, term, using):
+        # SQLite cannot use an index for LIKE, but its BINARY collation makes a
+        # range scan equivalent; '{' sorts right after 'z'.
+        if connections[using].vendor == 'sqlite':
+            return Q(term__gte=term, term__lt=term + '{')
+        return Q(term__startswith=term)
+
+    def filter_queryset(self, request, queryset, view):
+        raw = request.query_params.get(self.search_param, '').strip()
+        if not raw:
+            return queryset
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset.none()
+
+        conditions = [self.prefix(term, queryset.db) for term in terms]
+        for condition in conditions:
+            queryset = queryset.filter(id__in=SearchTerm.objects.filter(condition).values('post'))
+
+        any_term = Q()
+        for condition in conditions:
+            any_term |= condition
+        rank = (
+            SearchTerm.objects.filter(any_term, post=OuterRef('pk'))
+            .order_by()
+            .values('post')
+            .annotate(total=Sum('weight'))
+            .values('total')
+        )
+        return queryset.annotate(search_rank=Subquery(rank))
+
+    def get_keyset_ordering(self, request, queryset, view):
+        if self.get_search_terms(request):
+            return ('-search_rank', '-created_at', '-id')
+        return None
+
+
+class HotOrderingFilter(BaseFilterBackend):
+    """
+    ?ordering=hot: the hot feed, by the scores api/hot.py keeps on every post.
+    Only changes the ordering, which the keyset paginator applies; ?search=
+    keeps its relevance ranking.
+    """
+    ordering_param = api_settings.ORDERING_PARAM
+    ordering = ('-hot_epoch', '-hot_score', '-id')
+
+    def filter_queryset(self, request, queryset, view):
+        return queryset
+
+    def get_keyset_ordering(self, request, queryset, view):
+        if request.query_params.get(self.ordering_param) == 'hot':
+            return self.ordering
+        return None
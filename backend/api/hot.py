@@ -0,0 +1,184 @@
+"""
+Scores of the hot feed (?ordering=hot), kept up to date by the writes.
+
+A post is as hot as the events on it: the post itself (HOT_POST_WEIGHT) and
+each of its comments (HOT_COMMENT_WEIGHT), every one losing half its weight
+per HOT_HALF_LIFE_HOURS. At time t that is
+
+    sum(weight_i * 2 ** ((t_i - t) / half_life))
+
+All terms share the factor 2 ** (-t / half_life), so posts rank the same by
+
+    sum(weight_i * 2 ** ((t_i - epoch) / half_life))
+
+for any fixed epoch, and that sum never changes once an event has happened:
+a new comment only adds its own term to Post.hot_score, in the UPDATE that
+already bumps comment_count, and nothing is recomputed as posts age. The
+terms grow twofold per half-life after the epoch; `rebase_hot_scores`,
+run daily, moves the epoch to now and scales every score by the same factor,
+which keeps them small without changing the order.
+
+Post.hot_epoch is the epoch a row's score is relative to. The feed orders by
+(hot_epoch, hot_score, id), so a row that missed a rebase (created with an
+epoch cached from before it) sinks instead of jumping to the top, and
+increments only apply to rows on the epoch they were computed for (see
+add_activity). Processes see a new epoch within HOT_EPOCH_CACHE_SECONDS;
+`rebase_hot_scores` then sweeps the rows written in between onto it.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Max, Value, When
+from django.dispatch import receiver
+
+from .cache import bump_on_commit
+
+
+# The newest epoch seen by this process, and when it was read from the database.
+_epoch = {'value': None, 'loaded_at': 0.0}
+
+
+def decay_rate():
+    return math.log(2) / (settings.HOT_HALF_LIFE_HOURS * 3600)
+
+
+def score(weight, at, epoch):
+    """`weight` of an event at unix time `at`, relative to `epoch`."""
+    # Capped far below float overflow; a rebase brings real values back down.
+    return weight * math.exp(min(decay_rate() * (at - epoch), 700))
+
+
+def current_epoch():
+    if _epoch['value'] is None or time.monotonic() - _epoch['loaded_at'] > settings.HOT_EPOCH_CACHE_SECONDS:
+        # models.py imports this module.
+        from .models import Post
+
+        latest = Post.objects.aggregate(epoch=Max('hot_epoch'))['epoch']
+        remember_epoch(latest or int(time.time()))
+    return _epoch['value']
+
+
+def remember_epoch(epoch):
+    if _epoch['value'] is None or epoch >= _epoch['value']:
+        _epoch.update(value=epoch, loaded_at=time.monotonic())
+
+
+@receiver(setting_changed)
+def forget_epoch(setting=None, **kwargs):
+    if setting is None or setting.startswith('HOT_'):
+        _epoch.update(value=None, loaded_at=0.0)
+
+
+def initialize(post, at=None):
+    """Score a new post by its own weight."""
+    epoch = current_epoch()
+    post.hot_epoch = epoch
+    post.hot_score = score(settings.HOT_POST_WEIGHT, at or time.time(), epoch)
+
+
+def increments(weights, epoch, at):
+    values = {pk: score(weight, at, epoch) for pk, weight in weights.items()}
+    if len(values) == 1:
+        return Value(next(iter(values.values())), output_field=FloatField())
+    return Case(*[When(pk=pk, then=Value(value)) for pk, value in values.items()], output_field=FloatField())
+
+
+def add_activity(weights, at=None, **updates):
+    """
+    Add `weights` ({post id: event weight}, happening at unix time `at`, now
+    by default) to the posts' hot scores in one UPDATE together with
+    `updates` (other columns of the same rows, e.g. comment_count). A negative
+    weight takes an event back out. Returns the number of posts updated. Call
+    it inside a transaction.
+
+    The UPDATE only matches rows on the epoch the increments were computed
+    for. Rows it missed are on another one (a rebase ran after the epoch was
+    cached, or they missed a rebase) and are retried on their own epoch.
+    """
+    from .models import Post
+
+    at = time.time() if at is None else at
+    pending = {current_epoch(): dict(weights)}
+    updated = 0
+    for _ in range(3):
+        tried = {}
+        for epoch, group in pending.items():
+            rows = Post.objects.filter(pk__in=group, hot_epoch=epoch).update(
+                hot_score=F('hot_score') + increments(group, epoch, at), **updates,
+            )
+            updated += rows
+            if rows < len(group):
+                tried.update(dict.fromkeys(group, epoch))
+        if not tried:
+            break
+        # The rows updated above stay locked until commit, so any row that is
+        # now on another epoch than it was tried with is one that was missed.
+        pending = {}
+        for pk, epoch in Post.objects.filter(pk__in=tried).values_list('pk', 'hot_epoch'):
+            if epoch != tried[pk]:
+                pending.setdefault(epoch, {})[pk] = weights[pk]
+        if not pending:
+            # The rest have been deleted.
+            break
+        remember_epoch(max(pending))
+    return updated
+
+
+def rebase(at=None):
+    """Move every score to a new epoch (now); returns the number of posts moved."""
+    from .models import Post
+
+    epoch = int(at or time.time())
+    return move(Post.objects.exclude(hot_epoch=epoch), epoch)
+
+
+def sweep(epoch):
+    """
+    Move the posts still on an epoch older than `epoch` onto it: those created
+    by processes that had not seen the rebase to `epoch` yet. Run it once
+    HOT_EPOCH_CACHE_SECONDS have passed since the rebase.
+    """
+    from .models import Post
+
+    return move(Post.objects.filter(hot_epoch__lt=epoch), epoch)
+
+
+def move(posts, epoch):
+    rate = decay_rate()
+    moved = 0
+    with transaction.atomic():
+        for old in list(posts.order_by().values_list('hot_epoch', flat=True).distinct()):
+            moved += posts.filter(hot_epoch=old).update(
+                hot_score=F('hot_score') * math.exp(max(rate * (old - epoch), -700)),
+                hot_epoch=epoch,
+            )
+        if moved:
+            # Cursors of cached feed pages hold the old epoch.
+            bump_on_commit('posts')
+    remember_epoch(epoch)
+    return moved
+
+
+def recompute(at=None, batch_size=500):
+    """Score every post from scratch, from its creation and comments (after changing the weights)."""
+    from .models import Comment, Post
+
+    epoch = int(at or time.time())
+    scores = {
+        pk: score(settings.HOT_POST_WEIGHT, created_at.timestamp(), epoch)
+        for pk, created_at in Post.objects.values_list('pk', 'created_at').iterator()
+    }
+    for post_id, created_at in Comment.objects.values_list('post_id', 'created_at').iterator():
+        if post_id in scores:
+            scores[post_id] += score(settings.HOT_COMMENT_WEIGHT, created_at.timestamp(), epoch)
+    with transaction.atomic():
+        Post.objects.bulk_update(
+            [Post(pk=pk, hot_score=value, hot_epoch=epoch) for pk, value in scores.items()],
+            ['hot_score', 'hot_epoch'], batch_size=batch_size,
+        )
+        bump_on_commit('posts')
+    remember_epoch(epoch)
+    return len(scores)
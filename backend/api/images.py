@@ -0,0 +1,138 @@
+"""
+WebP variants and thumbnails for post images.
+
+Uploads are stored untouched; saving a post with a new image queues a
+background task (api/tasks.py) which writes one WebP per width in
+IMAGE_VARIANT_WIDTHS that is smaller than the original, plus a cropped
+thumbnail, and records their storage names in Post.image_variants. Until then
+the serializer falls back to the original file.
+"""
+import io
+import logging
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .cache import bump_on_commit
+from .models import POST_IMAGE_PLACEHOLDER, Post
+from .tasks import task
+
+
+logger = logging.getLogger(__name__)
+
+VARIANT_DIR = 'post/variants/'
+THUMBNAIL = 'thumb'
+
+
+def needs_variants(post):
+    name = post.image.name if post.image else ''
+    if not name or name == POST_IMAGE_PLACEHOLDER:
+        return False
+    return (post.image_variants or {}).get('source') != name
+
+
+def schedule(post):
+    """Queue processing of the post's image; it runs once the current transaction commits."""
+    if needs_variants(post):
+        # Saving the post again before the task ran does not queue it twice.
+        process_post_image.enqueue(post.pk, key=f'post-image:{post.pk}:{post.image.name}')
+
+
+def variant_stem(source):
+    return os.path.splitext(os.path.basename(source))[0]
+
+
+def encode(image, quality=None):
+    buffer = io.BytesIO()
+    image.save(buffer, 'WEBP', quality=quality or settings.IMAGE_WEBP_QUALITY, method=4)
+    return buffer.getvalue()
+
+
+def render_variants(source):
+    """
+    Decode `source` (a file object) and return {size_name: webp_bytes}.
+
+    Widths at or above the original are skipped, except that the original
+    width is always emitted when no configured width is smaller, so every
+    image has at least one variant.
+    """
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+
+    variants = {}
+    for width in sorted(settings.IMAGE_VARIANT_WIDTHS):
+        if width >= image.width:
+            continue
+        height = max(1, round(image.height * width / image.width))
+        variants[f'{width}w'] = encode(image.resize((width, height), Image.LANCZOS))
+    if not variants:
+        variants[f'{image.width}w'] = encode(image)
+
+    thumbnail = ImageOps.fit(image, tuple(settings.IMAGE_THUMBNAIL_SIZE), Image.LANCZOS)
+    variants[THUMBNAIL] = encode(thumbnail)
+    return variants
+
+
+@task()
+def process_post_image(post_id):
+    post = Post.objects.filter(pk=post_id).only('id', 'slug', 'image', 'image_variants').first()
+    if post is None or not needs_variants(post):
+        return None
+
+    source = post.image.name
+    storage = post.image.storage
+    # Content-addressed uploads are shared between posts; so are their variants.
+    variants = (
+        Post.objects.filter(image=source, image_variants__source=source)
+        .exclude(pk=post_id)
+        .values_list('image_variants', flat=True)
+        .first()
+    )
+    sizes = {}
+    if variants is None:
+        try:
+            with post.image.open('rb') as handle:
+                rendered = render_variants(handle)
+        except (UnidentifiedImageError, OSError, ValueError, Image.DecompressionBombError) as error:
+            # Record the attempt so the same broken upload is not retried forever.
+            logger.warning("Cannot build variants for %s: %s", source, error)
+            rendered = {}
+
+        stem = variant_stem(source)
+        sizes = {
+            size: storage.save(f'{VARIANT_DIR}{stem}-{size}.webp', ContentFile(data))
+            for size, data in rendered.items()
+        }
+        variants = {'source': source, 'sizes': sizes}
+
+    with transaction.atomic():
+        # The image may have been replaced while we were working on it.
+        updated = Post.objects.filter(pk=post_id, image=source).update(
+            image_variants=variants, updated_at=timezone.now()
+        )
+        if updated:
+            bump_on_commit('posts', f'post:{post.slug}')
+    if not updated:
+        for name in sizes.values():
+            storage.delete(name)
+        return None
+    return variants
+
+
+def variant_sizes(source, variants):
+    """Storage names of the variants in `variants` that belong to `source`, by size name."""
+    if not variants or variants.get('source') != source:
+        return {}
+    return dict(variants.get('sizes', {}))
+
+
+def variant_names(post):
+    """Storage names of the post's current variants, by size name."""
+    return variant_sizes(post.image.name if post.image else '', post.image_variants)
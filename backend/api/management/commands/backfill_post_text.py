@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from api.cache import bump_on_commit
+from api.models import Post
+
+
+class Command(BaseCommand):
+    help = "Compute the excerpt, word count, reading time and search text of existing posts in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--all', action='store_true',
+            help="Recompute every post, not only those without derived text yet.",
+        )
+
+    def handle(self, *args, **options):
+        queryset = Post.objects.only('id', 'slug', 'content', *Post.DERIVED_FIELDS).order_by('id')
+        if not options['all']:
+            queryset = queryset.filter(word_count=0).exclude(content='')
+        last_id = 0
+        total = 0
+        while True:
+            batch = list(queryset.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            now = timezone.now()
+            for post in batch:
+                post.derive_from_content()
+                post.updated_at = now
+            # bulk_update skips save() and its signals; the responses show the
+            # new fields, so move the validators and the cache versions here.
+            with transaction.atomic():
+                Post.objects.bulk_update(batch, [*Post.DERIVED_FIELDS, 'updated_at'])
+                bump_on_commit('posts', *(f'post:{post.slug}' for post in batch))
+            last_id = batch[-1].id
+            total += len(batch)
+            self.stdout.write(f"Updated {total} posts")
+        self.stdout.write(self.style.SUCCESS(f"Derived text stored for {total} posts."))
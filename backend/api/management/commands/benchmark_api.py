@@ -0,0 +1,158 @@
+import json
+import math
+import platform
+import time
+from datetime import datetime, timezone
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.authentication import user_cache_key
+from api.cache import bump, get_cache
+from api.middleware import QueryRecorder
+from api.models import Category, Comment, Post
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values), math.ceil(fraction * len(sorted_values))) - 1)
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure latency percentiles and queries per request for every API read view "
+        "through the Django test client, against the configured database and `api` cache. "
+        "Cold requests run with the endpoint's cached responses invalidated (a version bump) "
+        "and the user's cached fields dropped; warm ones after --warmup requests filled the cache."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Timed warm requests per endpoint.")
+        parser.add_argument('--cold-requests', type=int, default=None, help="Timed cold requests per endpoint (--requests).")
+        parser.add_argument('--warmup', type=int, default=10, help="Untimed requests per endpoint.")
+        parser.add_argument('--deep-page', type=int, default=10, help="Cursor page used for the deep list endpoint.")
+        parser.add_argument('--only', nargs='*', default=None, help="Only run these endpoint names.")
+        parser.add_argument('--output', default=None, help="Write the JSON report here instead of stdout.")
+
+    def handle(self, *args, **options):
+        post = Post.objects.order_by('-comment_count', '-id').only('id', 'slug', 'category').first()
+        user = User.objects.order_by('id').first()
+        if post is None or user is None:
+            raise CommandError("No posts or users to benchmark, run seed_data first.")
+
+        self.client = Client()
+        endpoints = self.endpoints(post, user, options['deep_page'])
+        if options['only']:
+            endpoints = [endpoint for endpoint in endpoints if endpoint[0] in options['only']]
+
+        cold_requests = options['requests'] if options['cold_requests'] is None else options['cold_requests']
+        self.user = user
+        results = {}
+        for name, url, headers, resources in endpoints:
+            results[name] = self.measure(url, headers, resources, cold_requests, options['requests'], options['warmup'])
+            for phase in ('cold', 'warm'):
+                stats = results[name][phase]
+                if stats['p50_ms'] is not None:
+                    self.stderr.write(
+                        f"{name:<22} {phase} p50={stats['p50_ms']:.2f}ms "
+                        f"p95={stats['p95_ms']:.2f}ms queries={stats['queries_per_request']}"
+                    )
+
+        report = {
+            'meta': {
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'requests': options['requests'],
+                'cold_requests': cold_requests,
+                'warmup': options['warmup'],
+                'api_cache': get_cache().__class__.__name__,
+                'rows': {
+                    'users': User.objects.count(),
+                    'categories': Category.objects.count(),
+                    'posts': Post.objects.count(),
+                    'comments': Comment.objects.count(),
+                },
+            },
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as handle:
+                handle.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def endpoints(self, post, user, deep_page):
+        token = RefreshToken.for_user(user).access_token
+        auth = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+        category = Category.objects.filter(id=post.category_id).values_list('name', flat=True).first()
+
+        # Each with the cache resources its responses depend on (get_cache_resources of the view).
+        endpoints = [
+            ('post-list', reverse('post-list-create'), {}, ['posts']),
+            ('post-list-deep', self.deep_page_url(reverse('post-list-create'), deep_page), {}, ['posts']),
+            ('post-search', reverse('post-list-create') + '?search=rower', {}, ['posts']),
+            ('post-detail', reverse('post-detail', kwargs={'slug': post.slug}), {}, [f'post:{post.slug}', 'categories']),
+            ('post-comments', reverse('post-comments', kwargs={'post_id': post.id}), {}, [f'comments:{post.id}']),
+            ('category-list', reverse('category-list-create'), {}, ['categories']),
+            ('me', reverse('me'), auth, []),
+        ]
+        if category:
+            endpoints.insert(3, (
+                'posts-by-category', reverse('posts-by-category', kwargs={'category_name': category}), {}, ['posts'],
+            ))
+        return endpoints
+
+    def deep_page_url(self, url, pages):
+        """Follow `next` cursors to reach page N (or the last page there is)."""
+        for _ in range(pages - 1):
+            next_url = self.client.get(url).json().get('next')
+            if not next_url:
+                break
+            url = next_url
+        return url
+
+    def measure(self, url, headers, resources, cold_requests, requests, warmup):
+        statuses = set()
+        cold = self.timed(url, headers, cold_requests, statuses, resources)
+        for _ in range(warmup):
+            self.client.get(url, **headers)
+        warm = self.timed(url, headers, requests, statuses)
+        return {'url': url, 'status': sorted(statuses), 'cold': cold, 'warm': warm}
+
+    def evict(self, resources):
+        """Make the next request miss the cache, the way a write would."""
+        bump(*resources)
+        get_cache().delete(user_cache_key(self.user.id))
+
+    def timed(self, url, headers, requests, statuses, resources=None):
+        timings = []
+        queries = []
+        for _ in range(requests):
+            if resources is not None:
+                self.evict(resources)
+            with QueryRecorder() as recorder:
+                start = time.perf_counter()
+                response = self.client.get(url, **headers)
+                timings.append((time.perf_counter() - start) * 1000)
+            queries.append(recorder.count)
+            statuses.add(response.status_code)
+
+        timings = sorted(round(timing, 3) for timing in timings)
+        return {
+            'p50_ms': percentile(timings, 0.50),
+            'p95_ms': percentile(timings, 0.95),
+            'p99_ms': percentile(timings, 0.99),
+            'mean_ms': round(sum(timings) / len(timings), 3) if timings else None,
+            'queries_per_request': max(queries) if queries else None,
+        }
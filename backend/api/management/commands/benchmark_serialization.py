@@ -0,0 +1,157 @@
+import json
+import platform
+import time
+import uuid
+from datetime import datetime, timezone
+
+import django
+from django.contrib.auth.models import User
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models.fields.files import FieldFile
+from rest_framework.test import APIRequestFactory
+
+from api.media_urls import PublicURLs, SignedURLCache, StorageURLs, override_resolver
+from api.models import Category, Post
+from api.fast_serializers import FastPostListSerializer
+from api.serializers import PostListSerializer, PostSerializer
+
+from .benchmark_api import percentile
+
+
+# A well-formed but unusable account key: Azure SAS tokens are signed locally,
+# so nothing here ever talks to the network.
+OFFLINE_ACCOUNT_KEY = 'YmVuY2htYXJrLW9ubHktbm90LWEtcmVhbC1rZXktMDEyMzQ1Njc4OWFiY2RlZg=='
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the serialization of in-memory posts with image variants. --compare media-urls "
+        "resolves media URLs through the storage backend (before) and through api.media_urls "
+        "(after); --compare serializers runs PostListSerializer (before) against "
+        "FastPostListSerializer on the equivalent .values() rows (after)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--compare', choices=['media-urls', 'serializers'], default='media-urls')
+        parser.add_argument('--rows', type=int, default=1000, help="Posts serialized per run.")
+        parser.add_argument('--repeat', type=int, default=20, help="Timed runs per resolver.")
+        parser.add_argument('--backend', choices=['local', 'azure'], default='local')
+        parser.add_argument(
+            '--signed-ttl', type=int, default=None,
+            help="Benchmark SAS-signed URLs valid for this many seconds (azure only).",
+        )
+        parser.add_argument('--output', default=None, help="Write the JSON report here instead of stdout.")
+
+    def handle(self, *args, **options):
+        if options['signed_ttl'] and options['backend'] != 'azure':
+            raise CommandError("--signed-ttl needs --backend azure.")
+        storage, base_url = self.storage(options['backend'], options['signed_ttl'])
+        if options['signed_ttl']:
+            after = SignedURLCache(storage, options['signed_ttl'])
+        else:
+            after = PublicURLs(base_url)
+
+        posts = self.posts(options['rows'])
+        request = APIRequestFactory().get('/api/posts/')
+        context = {'request': request}
+        if options['compare'] == 'serializers':
+            rows = self.rows(posts, FastPostListSerializer(request).columns)
+            runs = [
+                ('before', after, lambda: PostListSerializer(posts, many=True, context=context).data),
+                ('after', after, lambda: FastPostListSerializer(request).serialize(rows)),
+            ]
+        else:
+            serialize = lambda: PostSerializer(posts, many=True, context=context).data  # noqa: E731
+            runs = [('before', StorageURLs(storage), serialize), ('after', after, serialize)]
+
+        results = {}
+        outputs = {}
+        for label, resolver, serialize in runs:
+            with override_resolver(resolver):
+                results[label], outputs[label] = self.measure(serialize, options['repeat'])
+            self.stderr.write(f"{label:<7} p50={results[label]['p50_ms']:.2f}ms mean={results[label]['mean_ms']:.2f}ms")
+
+        report = {
+            'meta': {
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'compare': options['compare'],
+                'backend': options['backend'],
+                'signed_ttl': options['signed_ttl'],
+                'rows': options['rows'],
+                'repeat': options['repeat'],
+                'urls_per_run': sum(1 + len(post.image_variants['sizes']) for post in posts),
+            },
+            'results': results,
+            'speedup': round(results['before']['mean_ms'] / results['after']['mean_ms'], 2),
+            # Signed URLs differ by their signature, public ones must not differ at all.
+            'identical_output': (
+                None if options['signed_ttl'] and options['compare'] == 'media-urls'
+                else outputs['before'] == outputs['after']
+            ),
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as handle:
+                handle.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def storage(self, backend, signed_ttl):
+        if backend == 'local':
+            storage = FileSystemStorage(location='/nonexistent', base_url='/media/')
+            return storage, storage.base_url
+        from storages.backends.azure_storage import AzureStorage
+
+        storage = AzureStorage(
+            account_name='benchmark', account_key=OFFLINE_ACCOUNT_KEY,
+            azure_container='media', expiration_secs=signed_ttl,
+        )
+        return storage, f'{storage.client.url}/'
+
+    @staticmethod
+    def posts(rows):
+        """Unsaved posts shaped like the list endpoint's rows; no database needed."""
+        user = User(id=1, username='benchmark')
+        categories = [Category(id=index, name=f'Kategoria {index}') for index in range(1, 9)]
+        posts = []
+        for index in range(1, rows + 1):
+            digest = uuid.uuid4().hex * 2
+            source = f'post/{digest[:2]}/{digest}.jpg'
+            sizes = {size: f'post/variants/{digest}-{size}.webp' for size in ['320w', '640w', '1280w', 'thumb']}
+            post = Post(
+                id=index, user=user, category=categories[index % len(categories)],
+                title=f'Post {index}', content='Lorem ipsum dolor sit amet. ' * 20,
+                slug=f'post-{index}', image=source, comment_count=index % 7,
+                image_variants={'source': source, 'sizes': sizes},
+            )
+            post.created_at = datetime(2025, 1, 1, tzinfo=timezone.utc)
+            posts.append(post)
+        return posts
+
+    @staticmethod
+    def rows(posts, columns):
+        """The .values() rows of `posts`, as the fast serializer would fetch them."""
+        def value(post, path):
+            for attr in path.split('__'):
+                post = getattr(post, attr)
+            # .values() returns file fields as their name.
+            return post.name if isinstance(post, FieldFile) else post
+        return [{path: value(post, path) for path in columns} for post in posts]
+
+    @staticmethod
+    def measure(serialize, repeat):
+        timings = []
+        data = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            data = serialize()
+            timings.append((time.perf_counter() - start) * 1000)
+        timings = sorted(round(timing, 3) for timing in timings)
+        return {
+            'p50_ms': percentile(timings, 0.50),
+            'p95_ms': percentile(timings, 0.95),
+            'mean_ms': round(sum(timings) / len(timings), 3) if timings else None,
+        }, json.dumps(data)
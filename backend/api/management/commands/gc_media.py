@@ -0,0 +1,128 @@
+import posixpath
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from api.images import VARIANT_DIR, variant_stem
+from api.models import MediaBlob, Post
+from api.uploads import STAGING_DIR
+
+
+class Command(BaseCommand):
+    help = "Delete content-addressed post media that no post references any more."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace', type=int, default=3600,
+            help="Seconds a blob must have been unused for, so in-flight uploads are kept.",
+        )
+        parser.add_argument('--recount', action='store_true', help="Recount every blob's references first.")
+        parser.add_argument('--dry-run', action='store_true', help="Only report, do not delete anything.")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        self.storage = Post._meta.get_field('image').storage
+        self.dry_run = options['dry_run']
+        self.variants = None
+        cutoff = timezone.now() - timedelta(seconds=options['grace'])
+
+        if options['recount']:
+            self.recount()
+
+        deleted = 0
+        last = ''
+        while True:
+            batch = list(
+                MediaBlob.objects.filter(ref_count=0, last_seen_at__lt=cutoff, name__gt=last)
+                .order_by('name')
+                .values_list('name', flat=True)[:options['batch_size']]
+            )
+            if not batch:
+                break
+            last = batch[-1]
+            deleted += self.collect(batch, cutoff)
+
+        stale = self.clean_staging(cutoff)
+        verb = "Would delete" if self.dry_run else "Deleted"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {deleted} unreferenced blob(s) and {stale} stale upload(s)."
+        ))
+
+    @staticmethod
+    def references():
+        refs = (
+            Post.objects.filter(image=OuterRef('name'))
+            .order_by()
+            .values('image')
+            .annotate(total=Count('id'))
+            .values('total')
+        )
+        return Coalesce(Subquery(refs), 0)
+
+    def recount(self):
+        if self.dry_run:
+            return
+        updated = MediaBlob.objects.update(ref_count=self.references())
+        self.stdout.write(f"Recounted references of {updated} blob(s)")
+
+    def collect(self, names, cutoff):
+        # The counter is only an index; the posts table has the last word.
+        referenced = set(Post.objects.filter(image__in=names).values_list('image', flat=True))
+        if referenced and not self.dry_run:
+            MediaBlob.objects.filter(name__in=referenced).update(ref_count=self.references())
+            self.stdout.write(self.style.WARNING(f"Repaired the counter of {len(referenced)} referenced blob(s)"))
+        names = [name for name in names if name not in referenced]
+        for name in names:
+            self.stdout.write(f"Unreferenced: {name}")
+        if self.dry_run or not names:
+            return len(names)
+
+        with transaction.atomic():
+            # A concurrent upload of the same content moves last_seen_at.
+            gone = list(
+                MediaBlob.objects.select_for_update()
+                .filter(name__in=names, ref_count=0, last_seen_at__lt=cutoff)
+                .values_list('name', flat=True)
+            )
+            MediaBlob.objects.filter(name__in=gone).delete()
+        for name in gone:
+            self.storage.delete(name)
+            self.delete_variants(name)
+        return len(gone)
+
+    def variant_files(self):
+        """Variant file names by the stem of their source; listed once per run (one listing of the whole prefix on Azure)."""
+        if self.variants is None:
+            try:
+                _, files = self.storage.listdir(VARIANT_DIR)
+            except FileNotFoundError:
+                files = []
+            self.variants = defaultdict(list)
+            for filename in files:
+                # <stem>-<size>.webp
+                self.variants[filename.rpartition('-')[0]].append(filename)
+        return self.variants
+
+    def delete_variants(self, name):
+        for filename in self.variant_files().pop(variant_stem(name), []):
+            self.storage.delete(posixpath.join(VARIANT_DIR, filename))
+
+    def clean_staging(self, cutoff):
+        """Staging files of uploads that died before committing."""
+        try:
+            _, files = self.storage.listdir(STAGING_DIR)
+        except FileNotFoundError:
+            return 0
+        stale = 0
+        for filename in files:
+            name = posixpath.join(STAGING_DIR, filename)
+            if self.storage.get_modified_time(name) < cutoff:
+                stale += 1
+                if not self.dry_run:
+                    self.storage.delete(name)
+        return stale
@@ -0,0 +1,289 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from .benchmark_api import percentile
+
+
+# Relative weights of the requests the React frontend sends: PostGrid list
+# fetches, PostDetail slug lookups, PostComments, the Footer categories,
+# AuthContext's /api/me/ on every page load and the token refresh.
+TRAFFIC_MIX = {
+    'post-list': 30,
+    'post-detail': 20,
+    'post-comments': 20,
+    'categories': 12,
+    'me': 13,
+    'token-refresh': 5,
+}
+
+
+class HTTPError(Exception):
+    pass
+
+
+class Connection:
+    """A minimal keep-alive HTTP/1.1 client on top of asyncio streams."""
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+        self.reader = self.writer = None
+
+    async def request(self, method, path, headers=None, body=None):
+        for attempt in range(2):
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), self.timeout
+                )
+            try:
+                return await asyncio.wait_for(self._send(method, path, headers or {}, body), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # The server may drop an idle keep-alive connection; retry once on a fresh one.
+                await self.close()
+                if attempt:
+                    raise
+            except BaseException:
+                await self.close()
+                raise
+
+    async def _send(self, method, path, headers, body):
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}', 'Accept: application/json']
+        lines += [f'{name}: {value}' for name, value in headers.items()]
+        if body is not None:
+            lines += ['Content-Type: application/json', f'Content-Length: {len(body)}']
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body or b''))
+        await self.writer.drain()
+
+        status_line = await self.reader.readuntil(b'\r\n')
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await self.reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            payload = b''
+            while True:
+                size = int((await self.reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                payload += chunk[:-2]
+        elif 'content-length' in response_headers:
+            payload = await self.reader.readexactly(int(response_headers['content-length']))
+        else:
+            payload = await self.reader.read()
+            await self.close()
+
+        if response_headers.get('connection', '').lower() == 'close':
+            await self.close()
+        return status, payload
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay the frontend request mix against a running server at increasing "
+        "concurrency and report throughput, latency and error rates per level. "
+        "Compare the sync and async read paths with --prefix /api vs /api/async "
+        "against the same server, e.g. uvicorn backend.asgi:application --workers N."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="Base URL of the running server.")
+        parser.add_argument('--concurrency', default='1,4,16,64', help="Comma separated client counts.")
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds per concurrency level.")
+        parser.add_argument('--timeout', type=float, default=10.0, help="Per request timeout in seconds.")
+        parser.add_argument('--username', default=None, help="Account used for /api/me/ and token refresh.")
+        parser.add_argument('--password', default=None)
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--prefix', default='/api', help="Read endpoints prefix; /api/async for the async views.")
+        parser.add_argument('--workers', type=int, default=1, help="Server worker processes, for rps per worker.")
+        parser.add_argument('--output', default=None, help="Also write the JSON report here.")
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http' or not url.hostname:
+            raise CommandError("--url must be a plain http:// URL.")
+        try:
+            levels = [int(level) for level in options['concurrency'].split(',') if level.strip()]
+        except ValueError:
+            raise CommandError("--concurrency must be a comma separated list of integers.")
+        if options['workers'] < 1:
+            raise CommandError("--workers must be at least 1.")
+        self.prefix = '/' + options['prefix'].strip('/')
+
+        report = asyncio.run(self.run(url.hostname, url.port or 80, levels, options))
+
+        for level in report['levels']:
+            self.stdout.write(
+                f"c={level['concurrency']:<4} rps={level['throughput_rps']:>8.1f} "
+                f"rps/worker={level['rps_per_worker']:>8.1f} "
+                f"p50={level['p50_ms']}ms p95={level['p95_ms']}ms p99={level['p99_ms']}ms "
+                f"errors={level['error_rate']:.2%}"
+            )
+        self.stdout.write(f"saturation at concurrency: {report['saturation_concurrency']}")
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as handle:
+                json.dump(report, handle, indent=2)
+                handle.write('\n')
+
+    async def run(self, host, port, levels, options):
+        self.host, self.port, self.timeout = host, port, options['timeout']
+        self.random = random.Random(options['seed'])
+        self.targets = await self.discover(options['username'], options['password'])
+
+        mix = {name: weight for name, weight in TRAFFIC_MIX.items() if self.can_send(name)}
+        self.names = list(mix)
+        self.weights = list(mix.values())
+
+        results = []
+        for concurrency in levels:
+            level = await self.run_level(concurrency, options['duration'])
+            level['rps_per_worker'] = round(level['throughput_rps'] / options['workers'], 2)
+            results.append(level)
+
+        return {
+            'url': f'http://{host}:{port}',
+            'prefix': self.prefix,
+            'workers': options['workers'],
+            'mix': mix,
+            'duration_s': options['duration'],
+            'levels': results,
+            'saturation_concurrency': self.saturation(results),
+        }
+
+    def can_send(self, name):
+        if name == 'post-detail':
+            return bool(self.targets['slugs'])
+        if name == 'post-comments':
+            return bool(self.targets['post_ids'])
+        if name in ('me', 'token-refresh'):
+            return self.targets['access'] is not None
+        return True
+
+    async def discover(self, username, password):
+        """Pick real slugs, post ids and tokens from the server, like the frontend would."""
+        connection = Connection(self.host, self.port, self.timeout)
+        try:
+            status, body = await connection.request('GET', f'{self.prefix}/posts/?page_size=100')
+            if status != 200:
+                raise CommandError(f"GET {self.prefix}/posts/ returned {status}.")
+            posts = json.loads(body)['results']
+
+            access = refresh = None
+            if username:
+                payload = json.dumps({'username': username, 'password': password}).encode('utf-8')
+                status, body = await connection.request('POST', '/api/token/', body=payload)
+                if status != 200:
+                    raise CommandError(f"Could not obtain a token for {username} ({status}).")
+                tokens = json.loads(body)
+                access, refresh = tokens['access'], tokens['refresh']
+        except OSError as error:
+            raise CommandError(f"Cannot reach http://{self.host}:{self.port}: {error}")
+        finally:
+            await connection.close()
+
+        return {
+            'slugs': [post['slug'] for post in posts],
+            'post_ids': [post['id'] for post in posts],
+            'access': access,
+            'refresh': refresh,
+        }
+
+    def next_request(self):
+        name = self.random.choices(self.names, self.weights)[0]
+        auth = {'Authorization': f"Bearer {self.targets['access']}"} if self.targets['access'] else {}
+        if name == 'post-list':
+            return name, 'GET', f'{self.prefix}/posts/', auth, None
+        if name == 'post-detail':
+            return name, 'GET', f"{self.prefix}/posts/{self.random.choice(self.targets['slugs'])}/", auth, None
+        if name == 'post-comments':
+            return name, 'GET', f"{self.prefix}/posts/{self.random.choice(self.targets['post_ids'])}/comments/", auth, None
+        if name == 'categories':
+            return name, 'GET', f'{self.prefix}/categories/', auth, None
+        if name == 'me':
+            return name, 'GET', f'{self.prefix}/me/', auth, None
+        body = json.dumps({'refresh': self.targets['refresh']}).encode('utf-8')
+        return name, 'POST', '/api/token/refresh/', {}, body
+
+    async def run_level(self, concurrency, duration):
+        timings = []
+        per_endpoint = defaultdict(Counter)
+        errors = Counter()
+        deadline = time.perf_counter() + duration
+
+        async def client():
+            connection = Connection(self.host, self.port, self.timeout)
+            try:
+                while time.perf_counter() < deadline:
+                    name, method, path, headers, body = self.next_request()
+                    start = time.perf_counter()
+                    try:
+                        status, _ = await connection.request(method, path, headers, body)
+                    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as error:
+                        errors[type(error).__name__] += 1
+                        per_endpoint[name]['errors'] += 1
+                        continue
+                    timings.append((time.perf_counter() - start) * 1000)
+                    per_endpoint[name]['requests'] += 1
+                    if status >= 400:
+                        errors[f'HTTP {status}'] += 1
+                        per_endpoint[name]['errors'] += 1
+            finally:
+                await connection.close()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+        timings.sort()
+        total = len(timings) + sum(count for key, count in errors.items() if not key.startswith('HTTP'))
+        error_count = sum(errors.values())
+        return {
+            'concurrency': concurrency,
+            'requests': total,
+            'throughput_rps': round(len(timings) / elapsed, 2) if elapsed else 0.0,
+            'p50_ms': self.rounded(percentile(timings, 0.50)),
+            'p95_ms': self.rounded(percentile(timings, 0.95)),
+            'p99_ms': self.rounded(percentile(timings, 0.99)),
+            'error_rate': error_count / total if total else 0.0,
+            'errors': dict(errors),
+            'endpoints': {name: dict(counts) for name, counts in per_endpoint.items()},
+        }
+
+    @staticmethod
+    def rounded(value):
+        return round(value, 2) if value is not None else None
+
+    @staticmethod
+    def saturation(levels):
+        """
+        First concurrency level after which more clients stop buying throughput
+        (under 10% more requests per second) or start failing (over 1% errors).
+        """
+        for previous, current in zip(levels, levels[1:]):
+            if current['error_rate'] > 0.01:
+                return previous['concurrency']
+            if current['throughput_rps'] < previous['throughput_rps'] * 1.10:
+                return previous['concurrency']
+        return None
@@ -0,0 +1,45 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.images import needs_variants, process_post_image
+from api.models import Post
+
+
+class Command(BaseCommand):
+    help = "Build the WebP variants and thumbnails of post images that do not have them yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help="Images processed in parallel.")
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        queryset = Post.objects.only('id', 'image', 'image_variants').order_by('id')
+        last_id = 0
+        done = 0
+        pool = ThreadPoolExecutor(max_workers=options['workers']) if options['workers'] > 1 else None
+        run = pool.map if pool is not None else map
+        try:
+            while True:
+                batch = list(queryset.filter(id__gt=last_id)[:options['batch_size']])
+                if not batch:
+                    break
+                last_id = batch[-1].id
+                pending = [post.id for post in batch if needs_variants(post)]
+                done += sum(1 for result in run(self.process, pending) if result is not None)
+                self.stdout.write(f"Processed {done} images")
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        self.stdout.write(self.style.SUCCESS(f"Built variants for {done} post image(s)."))
+
+    @staticmethod
+    def process(post_id):
+        try:
+            return process_post_image(post_id)
+        finally:
+            # Pool threads open their own connections.
+            if threading.current_thread() is not threading.main_thread():
+                close_old_connections()
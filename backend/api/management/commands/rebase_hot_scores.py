@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import hot
+
+
+# Slack for requests that read the old epoch just before it expired.
+SWEEP_GRACE_SECONDS = 5
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the hot feed scores to a new epoch (now), keeping their order. Run daily, "
+        "e.g. from cron; --recompute rebuilds every score from the posts and comments instead. "
+        "Once every process has seen the new epoch (HOT_EPOCH_CACHE_SECONDS), the posts "
+        "created on the old one in the meantime are moved too."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recompute',
+            action='store_true',
+            help="Score every post from scratch, e.g. after changing HOT_* settings.",
+        )
+
+    def handle(self, *args, **options):
+        epoch = int(time.time())
+        if options['recompute']:
+            count = hot.recompute(epoch)
+            self.stdout.write(self.style.SUCCESS(f"Recomputed the hot score of {count} post(s)."))
+        else:
+            count = hot.rebase(epoch)
+            self.stdout.write(self.style.SUCCESS(f"Rebased the hot score of {count} post(s)."))
+        time.sleep(settings.HOT_EPOCH_CACHE_SECONDS + SWEEP_GRACE_SECONDS)
+        late = hot.sweep(epoch)
+        self.stdout.write(self.style.SUCCESS(f"Moved {late} post(s) created during the rebase."))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Post, SearchTerm
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the post full-text search index in chunks. Indexes Post.search_text, "
+        "so run backfill_post_text first on posts saved before it existed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = Post.objects.select_related('user', 'category').defer('content').order_by('id')
+        last_id = 0
+        total = 0
+        while True:
+            batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                SearchTerm.objects.reindex(batch)
+            last_id = batch[-1].id
+            total += len(batch)
+            self.stdout.write(f"Indexed {total} posts")
+        self.stdout.write(self.style.SUCCESS(f"Search index rebuilt for {total} posts."))
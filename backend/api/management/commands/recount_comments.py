@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from api.models import Comment, Post
+
+
+class Command(BaseCommand):
+    help = "Recount Post.comment_count from the comments table and repair any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help="Only report drifted posts, do not write anything.",
+        )
+
+    def handle(self, *args, **options):
+        counts = (
+            Comment.objects.filter(post=OuterRef('pk'))
+            .order_by()
+            .values('post')
+            .annotate(total=Count('id'))
+            .values('total')
+        )
+        actual = Coalesce(Subquery(counts), 0)
+        drifted = (
+            Post.objects.annotate(actual=actual)
+            .exclude(comment_count=F('actual'))
+            .values_list('id', 'comment_count', 'actual')
+        )
+
+        ids = []
+        for post_id, stored, real in drifted.iterator():
+            ids.append(post_id)
+            self.stdout.write(f"Post {post_id}: stored {stored}, actual {real}")
+
+        if not ids:
+            self.stdout.write(self.style.SUCCESS("All comment counters are correct."))
+            return
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f"{len(ids)} post(s) drifted (dry run, nothing written)."))
+            return
+
+        updated = Post.objects.filter(id__in=ids).update(comment_count=actual)
+        self.stdout.write(self.style.SUCCESS(f"Repaired {updated} post(s)."))
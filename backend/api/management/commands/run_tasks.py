@@ -0,0 +1,69 @@
+import signal
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import tasks
+
+
+# How often a worker deletes old finished tasks.
+PURGE_INTERVAL = 600
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued background tasks with a pool of threads until stopped (SIGINT/SIGTERM "
+        "finish the running tasks first). Start as many processes as needed; they share the queue."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help="Tasks run in parallel (TASKS_WORKERS).")
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help="Exit once no task is due instead of waiting for more, e.g. from cron.",
+        )
+
+    def handle(self, *args, **options):
+        workers = options['workers'] or settings.TASKS_WORKERS
+        self.stopping = threading.Event()
+        handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                handlers[signum] = signal.signal(signum, self.stop)
+        try:
+            done, failed = self.work(workers, options['once'])
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+        self.stdout.write(self.style.SUCCESS(f"Ran {done + failed} task(s), {failed} failed."))
+
+    def work(self, workers, once):
+        outcomes = Counter()
+        running = set()
+        purged_at = None
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='task-worker') as pool:
+            while not self.stopping.is_set():
+                if purged_at is None or time.monotonic() - purged_at > PURGE_INTERVAL:
+                    tasks.purge()
+                    purged_at = time.monotonic()
+                # Only claim what a free thread can start on; the rest stays for other workers.
+                claimed = tasks.claim(workers - len(running)) if len(running) < workers else []
+                running.update(pool.submit(tasks.run_in_worker, task) for task in claimed)
+                if not running:
+                    if once:
+                        break
+                    self.stopping.wait(settings.TASKS_POLL_INTERVAL)
+                    continue
+                finished, running = wait(running, timeout=settings.TASKS_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                outcomes.update(future.result() for future in finished)
+            # Let the running tasks finish; their leases would otherwise have to run out.
+            outcomes.update(future.result() for future in running)
+        return outcomes[True], outcomes[False]
+
+    def stop(self, signum, frame):
+        self.stopping.set()
@@ -0,0 +1,162 @@
+import random
+import uuid
+from collections import Counter
+
+from django.contrib.auth.hashers import make_password
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from api import hot
+from api.models import Category, Comment, Post, SearchTerm
+
+
+CATEGORY_NAMES = [
+    'Technologia', 'Sport', 'Polityka', 'Nauka', 'Gry', 'Motoryzacja',
+    'Ciekawostki', 'Historia', 'Humor', 'Gospodarka', 'Zdrowie', 'Podróże',
+]
+SUBJECTS = [
+    'Żółw', 'Łoś', 'Ślimak', 'Prezes spółdzielni', 'Sąsiad z Łodzi', 'Kierowca tira',
+    'Naukowcy z Krakowa', 'Gość z Gdańska', 'Pszczelarz', 'Student informatyki',
+    'Radny z Wrocławia', 'Babcia z Poznania', 'Mirek', 'Programista',
+]
+VERBS = [
+    'zbudował', 'odkrył', 'sprzedał', 'naprawił', 'pobił rekord', 'zgubił',
+    'wygrał', 'przejechał', 'ugotował', 'zaprojektował', 'zepsuł', 'uratował',
+]
+OBJECTS = [
+    'żółty rower', 'gęślą jaźń', 'pociąg do Zakopanego', 'starą żabkę',
+    'łódź podwodną', 'źródło w lesie', 'kiełbasę z grilla', 'nowy procesor',
+    'dźwig na budowie', 'pączki z różą', 'ślub w stodole', 'kółko graniaste',
+]
+ENDINGS = [
+    '', '', '— zobacz zdjęcia', 'i nikt nie wie dlaczego', 'w środę rano',
+    '(wideo)', '— internauci oszaleli', 'po 20 latach',
+]
+SENTENCES = [
+    'Mieszkańcy nie mogą uwierzyć w to, co się stało.',
+    'Sprawą zajęła się już lokalna prasa.',
+    'Według świadków wszystko trwało kilka minut.',
+    'Eksperci są zgodni, że to dopiero początek.',
+    'Źródło informacji poprosiło o zachowanie anonimowości.',
+    'Wkrótce więcej szczegółów, śledźcie wątek.',
+    'Gdzie jest żółta kaczka? Nikt nie wie.',
+]
+
+
+class Command(BaseCommand):
+    help = "Seed users, categories, posts and comments with bulk_create for benchmarking."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--categories', type=int, default=len(CATEGORY_NAMES))
+        parser.add_argument('--posts', type=int, default=1000)
+        parser.add_argument('--comments', type=int, default=5000, help="Total number of comments.")
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=None, help="Random seed for repeatable data.")
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        # Every run gets its own tag so repeated seeding never collides on
+        # unique usernames or category names.
+        self.tag = uuid.UUID(int=self.random.getrandbits(128)).hex[:6]
+
+        users = self.create_users(options['users'])
+        categories = self.create_categories(options['categories'])
+        posts = self.create_posts(options['posts'], users, categories)
+        self.create_comments(options['comments'], users, posts)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(users)} users, {len(categories)} categories, "
+            f"{len(posts)} posts and {options['comments'] if posts else 0} comments."
+        ))
+
+    def batches(self, count):
+        for start in range(0, count, self.batch_size):
+            yield range(start, min(start + self.batch_size, count))
+
+    def create_users(self, count):
+        password = make_password('seedpassword123')
+        created = []
+        for batch in self.batches(count):
+            created += User.objects.bulk_create(
+                [User(username=f'seed_{self.tag}_{i}', password=password) for i in batch]
+            )
+        return [user.id for user in created]
+
+    def create_categories(self, count):
+        names = []
+        for i in range(count):
+            name = CATEGORY_NAMES[i % len(CATEGORY_NAMES)]
+            names.append(f'{name} {self.tag}' if i < len(CATEGORY_NAMES) else f'{name} {self.tag}-{i}')
+        return [category.id for category in Category.objects.bulk_create([Category(name=name) for name in names])]
+
+    def title(self):
+        parts = [
+            self.random.choice(SUBJECTS),
+            self.random.choice(VERBS),
+            self.random.choice(OBJECTS),
+            self.random.choice(ENDINGS),
+        ]
+        return ' '.join(part for part in parts if part)
+
+    def content(self):
+        count = self.random.randint(2, 12)
+        return ' '.join(self.random.choice(SENTENCES) for _ in range(count))
+
+    def create_posts(self, count, users, categories):
+        if not users:
+            return []
+        created = []
+        for batch in self.batches(count):
+            # Post.objects.bulk_create reserves the slugs (unidecode + slugify
+            # of the title) for the whole batch.
+            posts = [
+                Post(
+                    title=self.title(),
+                    content=self.content(),
+                    user_id=self.random.choice(users),
+                    category_id=self.random.choice(categories) if categories else None,
+                )
+                for _ in batch
+            ]
+            for post in posts:
+                hot.initialize(post)
+            with transaction.atomic():
+                posts = Post.objects.bulk_create(posts)
+                # bulk_create skips Post.save, so the search index is built per batch too.
+                SearchTerm.objects.reindex(
+                    Post.objects.filter(id__in=[post.id for post in posts]).select_related('user', 'category')
+                )
+            created += posts
+        return [post.id for post in created]
+
+    def create_comments(self, count, users, posts):
+        if not posts:
+            return
+        for batch in self.batches(count):
+            comments = [
+                Comment(
+                    post_id=self.random.choice(posts),
+                    user_id=self.random.choice(users),
+                    content=self.random.choice(SENTENCES),
+                )
+                for _ in batch
+            ]
+            per_post = Counter(comment.post_id for comment in comments)
+            with transaction.atomic():
+                Comment.objects.bulk_create(comments)
+                # bulk_create skips Comment.save, so the counters, hot scores
+                # and updated_at are bumped per batch (as comment_buffer.insert does).
+                hot.add_activity(
+                    {post_id: settings.HOT_COMMENT_WEIGHT * added for post_id, added in per_post.items()},
+                    comment_count=F('comment_count') + Case(
+                        *[When(pk=post_id, then=Value(added)) for post_id, added in per_post.items()],
+                        output_field=IntegerField(),
+                    ),
+                    updated_at=timezone.now(),
+                )
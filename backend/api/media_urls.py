@@ -0,0 +1,163 @@
+"""
+Media URLs for serialized images without a storage round trip per file.
+
+Public media lives at a fixed prefix, so its URL is MEDIA_CDN_URL (or
+MEDIA_URL) plus the quoted file name; AzureStorage.url() would build the same
+string through the blob client on every call. When MEDIA_URL_SIGNING_TTL is
+set the container is private and every URL carries a SAS token, so those are
+signed by the backend once and cached until shortly before they expire.
+"Shortly" includes API_CACHE_TIMEOUT: a URL can reach a client from a
+response cached that long after it was handed out.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.encoding import filepath_to_uri
+
+from .models import Post
+
+
+# Characters filepath_to_uri() leaves as they are.
+_UNQUOTED = re.compile(r"[A-Za-z0-9/._~!*()'-]*")
+
+
+class StorageURLs:
+    """Ask the storage backend for every URL (the behaviour of FieldFile.url)."""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def url(self, name):
+        return self.storage.url(name)
+
+
+class PublicURLs:
+    """Prefix + quoted name, the way FileSystemStorage and public Azure containers build it."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url if base_url.endswith('/') else f'{base_url}/'
+
+    def url(self, name):
+        # What urljoin() would return for a storage name, without parsing both;
+        # generated names (digests, variants) need no quoting at all.
+        if not _UNQUOTED.fullmatch(name):
+            name = filepath_to_uri(name)
+        return self.base_url + name.lstrip('/')
+
+
+class SignedURLCache:
+    """
+    Signed URLs by name, reused while they stay valid for at least `margin`
+    seconds. Bounded: when full, expired entries go first, then the least
+    recently used one.
+    """
+
+    def __init__(self, storage, ttl, margin=None, max_entries=10000, clock=time.monotonic):
+        self.storage = storage
+        self.ttl = ttl
+        # A URL handed out must still work by the time the client fetches it.
+        self.margin = margin if margin is not None else min(300, ttl // 10)
+        self.max_entries = max_entries
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def url(self, name):
+        now = self.clock()
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is not None and entry[1] - self.margin > now:
+                self.entries.move_to_end(name)
+                return entry[0]
+        # Signing can be slow (a user delegation key round trip); not under the lock.
+        url = self.storage.url(name)
+        with self.lock:
+            self.entries[name] = (url, now + self.ttl)
+            self.entries.move_to_end(name)
+            if len(self.entries) > self.max_entries:
+                self.evict(now)
+        return url
+
+    def evict(self, now):
+        expired = [name for name, (_, expires_at) in self.entries.items() if expires_at - self.margin <= now]
+        for name in expired:
+            del self.entries[name]
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+_override = None
+
+
+@lru_cache(maxsize=None)
+def _configured_resolver():
+    storage = Post._meta.get_field('image').storage
+    ttl = settings.MEDIA_URL_SIGNING_TTL
+    if ttl:
+        # Cached response bodies keep their URLs for up to API_CACHE_TIMEOUT.
+        margin = settings.API_CACHE_TIMEOUT + min(300, ttl // 10)
+        if margin >= ttl:
+            raise ImproperlyConfigured(
+                f"MEDIA_URL_SIGNING_TTL ({ttl}s) must be longer than API_CACHE_TIMEOUT plus {margin - settings.API_CACHE_TIMEOUT}s, "
+                "or cached responses serve expired media URLs."
+            )
+        return SignedURLCache(storage, ttl, margin=margin, max_entries=settings.MEDIA_URL_CACHE_SIZE)
+    base_url = settings.MEDIA_CDN_URL or settings.MEDIA_URL
+    if not base_url:
+        return StorageURLs(storage)
+    return PublicURLs(base_url)
+
+
+def get_resolver():
+    return _override if _override is not None else _configured_resolver()
+
+
+@receiver(setting_changed)
+def reset_resolver(setting, **kwargs):
+    if setting in ('MEDIA_URL', 'MEDIA_CDN_URL', 'MEDIA_URL_SIGNING_TTL', 'MEDIA_URL_CACHE_SIZE', 'STORAGES', 'API_CACHE_TIMEOUT'):
+        _configured_resolver.cache_clear()
+
+
+@contextmanager
+def override_resolver(resolver):
+    """Resolve every URL with `resolver` inside the block (benchmarks, tests)."""
+    global _override
+    previous, _override = _override, resolver
+    try:
+        yield resolver
+    finally:
+        _override = previous
+
+
+def media_url(name):
+    return get_resolver().url(name)
+
+
+def absolute_media_urls(request=None):
+    """
+    A function turning storage names into media URLs, made absolute against
+    `request` like request.build_absolute_uri() would, but with the scheme and
+    host looked up once per page instead of once per URL.
+    """
+    resolve = get_resolver().url
+    if request is None:
+        return resolve
+    host = request.build_absolute_uri('/')[:-1]
+
+    def url(name):
+        url = resolve(name)
+        if not url.startswith('/'):
+            return url
+        if url.startswith('//') or '/./' in url or '/../' in url:
+            return request.build_absolute_uri(url)
+        return host + url
+
+    return url
@@ -0,0 +1,147 @@
+import hashlib
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from .db_router import aclose_route, close_route, open_route
+
+
+_IN_LIST = re.compile(r'\bIN \((?:%s, )*%s\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """Short hash of a query with IN-lists of any length folded together."""
+    normalized = _WHITESPACE.sub(' ', _IN_LIST.sub('IN (...)', sql)).strip()
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:8]
+
+
+class QueryRecorder:
+    """
+    Record every query run on any database connection while active.
+
+        with QueryRecorder() as recorder:
+            client.get('/api/posts/')
+        recorder.count, recorder.total_time, recorder.duplicates
+    """
+
+    def __init__(self):
+        self.queries = []
+        self._stack = None
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def total_time(self):
+        return sum(duration for _, duration in self.queries)
+
+    @property
+    def duplicates(self):
+        """Fingerprints seen more than once, mapped to how often they ran."""
+        counts = Counter(fingerprint(sql) for sql, _ in self.queries)
+        return {key: count for key, count in counts.items() if count > 1}
+
+
+class QueryInstrumentationMiddleware:
+    """
+    In DEBUG, report per-request query stats as response headers:
+
+        X-Query-Count       number of queries
+        X-Query-Time-Ms     total time spent in the database
+        X-Query-Duplicates  fingerprint*count for every repeated query shape
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.DEBUG:
+            return self.get_response(request)
+
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        return self.report(recorder, response)
+
+    async def __acall__(self, request):
+        if not settings.DEBUG:
+            return await self.get_response(request)
+
+        # Connections are per thread: hook the ones of the thread the
+        # request's ORM calls run in (sync_to_async keeps them on one).
+        recorder = QueryRecorder()
+        await sync_to_async(recorder.__enter__)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(recorder.__exit__)(None, None, None)
+        return self.report(recorder, response)
+
+    @staticmethod
+    def report(recorder, response):
+        response['X-Query-Count'] = str(recorder.count)
+        response['X-Query-Time-Ms'] = f"{recorder.total_time * 1000:.2f}"
+        duplicates = recorder.duplicates
+        if duplicates:
+            response['X-Query-Duplicates'] = ', '.join(
+                f"{key}*{count}" for key, count in sorted(duplicates.items(), key=lambda item: -item[1])
+            )
+        return response
+
+
+class ReplicaMiddleware:
+    """Scope the database routing of api/db_router.py to the request."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        token = open_route(request)
+        try:
+            return self.get_response(request)
+        finally:
+            close_route(token)
+
+    async def __acall__(self, request):
+        token = open_route(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            await aclose_route(token)
@@ -0,0 +1,69 @@
+# Generated by Django 5.2 on 2026-10-18 08:49
+
+import re
+from collections import Counter
+
+import django.db.models.deletion
+from django.db import migrations, models
+from unidecode import unidecode
+
+
+# The tokenizer of api/search.py as it was when this migration was written,
+# so later changes to it do not change what the migration builds.
+FIELD_WEIGHTS = {'title': 3, 'category': 2, 'user': 2, 'content': 1}
+MAX_TERM_LENGTH = 64
+STOPWORDS = frozenset("""
+    ale bo by byc czy dla do go i ich im jak jako je jego jej jest juz ja
+    ktora ktore ktory lub ma mi na nad nie nim o od po pod przez sa se sie ta
+    tak tam te tego tej ten to tu ty tym w we z za ze
+    a an and are as at be by for from in is it of on or the to with
+""".split())
+TOKEN = re.compile(r'[a-z0-9]+')
+
+
+def build_terms(title, content, category, username):
+    weights = Counter()
+    for field, text in (('title', title), ('content', content), ('category', category), ('user', username)):
+        for token in TOKEN.findall(unidecode(text or '').lower()):
+            if len(token) > 1 and token not in STOPWORDS:
+                weights[token[:MAX_TERM_LENGTH]] += FIELD_WEIGHTS[field]
+    return weights
+
+
+def build_search_index(apps, schema_editor):
+    Post = apps.get_model('api', 'Post')
+    SearchTerm = apps.get_model('api', 'SearchTerm')
+    rows = []
+    for post in Post.objects.select_related('user', 'category').iterator(chunk_size=1000):
+        category = post.category.name if post.category_id else ''
+        for term, weight in build_terms(post.title, post.content, category, post.user.username).items():
+            rows.append(SearchTerm(post_id=post.id, term=term, weight=weight))
+        if len(rows) >= 5000:
+            SearchTerm.objects.bulk_create(rows)
+            rows = []
+    SearchTerm.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_post_comment_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('weight', models.PositiveIntegerField(default=1)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='api.post')),
+            ],
+            options={
+                'db_table': 'post_search_terms',
+                'indexes': [models.Index(fields=['term'], name='post_search_term_idx', opclasses=['varchar_pattern_ops'])],
+                'constraints': [models.UniqueConstraint(fields=('post', 'term'), name='post_search_terms_unique')],
+            },
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
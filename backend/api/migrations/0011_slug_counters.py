@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 08:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_post_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlugCounter',
+            fields=[
+                ('base', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('next', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'post_slug_counters',
+            },
+        ),
+    ]
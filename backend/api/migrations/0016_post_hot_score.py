@@ -0,0 +1,60 @@
+# Generated by Django 5.2 on 2026-10-18 10:04
+
+import math
+import time
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_hot_score(apps, schema_editor):
+    # api.hot.recompute, on the historical models.
+    Post = apps.get_model('api', 'Post')
+    Comment = apps.get_model('api', 'Comment')
+    epoch = int(time.time())
+    rate = math.log(2) / (settings.HOT_HALF_LIFE_HOURS * 3600)
+
+    def score(weight, created_at):
+        return weight * math.exp(min(rate * (created_at.timestamp() - epoch), 700))
+
+    scores = {
+        pk: score(settings.HOT_POST_WEIGHT, created_at)
+        for pk, created_at in Post.objects.values_list('pk', 'created_at').iterator()
+    }
+    for post_id, created_at in Comment.objects.values_list('post_id', 'created_at').iterator():
+        if post_id in scores:
+            scores[post_id] += score(settings.HOT_COMMENT_WEIGHT, created_at)
+    Post.objects.bulk_update(
+        [Post(pk=pk, hot_score=value, hot_epoch=epoch) for pk, value in scores.items()],
+        ['hot_score', 'hot_epoch'], batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_post_view_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='hot_epoch',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='hot_score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-hot_epoch', '-hot_score', '-id'], name='posts_hot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['category', '-hot_epoch', '-hot_score', '-id'], name='posts_cat_hot_idx'),
+        ),
+        migrations.RunPython(backfill_hot_score, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,17 @@
-from django.db import models
+import re
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import DEFERRED
 from django.contrib.auth.models import User
+from django.utils import timezone
 from django.utils.text import slugify
 from unidecode import unidecode
-from django.db.models import Count
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+from . import hot
+from .search import build_terms
+from .text import EXCERPT_LENGTH, derive
 
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -13,6 +22,96 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+SLUG_MAX_LENGTH = 50
+# Miejsce na sufiks "-<n>" w slugu
+SLUG_BASE_LENGTH = SLUG_MAX_LENGTH - 10
+SLUG_RETRIES = 5
+
+
+def slug_base(title):
+    base = slugify(unidecode(title))[:SLUG_BASE_LENGTH].strip('-')
+    return base or 'post'
+
+
+def format_slug(base, index):
+    """The first post with a base slug keeps it bare, the next ones get -1, -2, ..."""
+    return base if index == 0 else f"{base}-{index}"
+
+
+class SlugCounterManager(models.Manager):
+    def reserve(self, base, count=1):
+        """
+        Reserve `count` consecutive suffix indexes for `base` and return the
+        first one. Costs the same two statements however many posts already
+        share the base; the row lock serializes concurrent reservations.
+        """
+        with transaction.atomic():
+            if not self.filter(base=base).update(next=F('next') + count):
+                start = self.scan(base)
+                try:
+                    with transaction.atomic():
+                        self.create(base=base, next=start + count)
+                    return start
+                except IntegrityError:
+                    # Someone else created the counter in the meantime.
+                    self.filter(base=base).update(next=F('next') + count)
+            return self.get(base=base).next - count
+
+    def scan(self, base):
+        """Next free index according to the posts table (one query)."""
+        pattern = rf'^{re.escape(base)}(-[0-9]+)?$'
+        taken = -1
+        for slug in Post.objects.filter(slug__regex=pattern).values_list('slug', flat=True):
+            suffix = slug[len(base) + 1:]
+            taken = max(taken, int(suffix) if suffix else 0)
+        return taken + 1
+
+    def resync(self, base):
+        """Move the counter past slugs that were set explicitly or imported."""
+        start = self.scan(base)
+        with transaction.atomic():
+            if not self.filter(base=base, next__lt=start).update(next=start):
+                self.get_or_create(base=base, defaults={'next': start})
+
+
+class SlugCounter(models.Model):
+    """Per base slug allocation counter, so Post.save never probes for a free suffix."""
+    base = models.CharField(max_length=SLUG_MAX_LENGTH, primary_key=True)
+    next = models.PositiveIntegerField(default=0)
+
+    objects = SlugCounterManager()
+
+    class Meta:
+        db_table = 'post_slug_counters'
+
+    def __str__(self):
+        return f"{self.base} -> {self.next}"
+
+
+POST_IMAGE_PLACEHOLDER = 'post/placeholder.webp'
+
+
+class PostManager(models.Manager):
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        Fill in missing slugs with one reservation per distinct base slug, and
+        the columns derived from the content.
+        """
+        objs = list(objs)
+        by_base = {}
+        for post in objs:
+            post.derive_from_content()
+            if not post.hot_epoch:
+                hot.initialize(post)
+            if not post.slug:
+                by_base.setdefault(slug_base(post.title), []).append(post)
+        for base, posts in by_base.items():
+            start = SlugCounter.objects.reserve(base, len(posts))
+            for offset, post in enumerate(posts):
+                post.slug = format_slug(base, start + offset)
+        return super().bulk_create(objs, *args, **kwargs)
+
+
 class Post(models.Model):
     user = models.ForeignKey(
         User,
@@ -29,29 +128,105 @@ class Post(models.Model):
     title = models.CharField(max_length=255)
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
-    image = models.FileField(upload_to='post/', null=True, blank=True, default='post/placeholder.webp')
-    slug = models.SlugField(unique=True,blank=True) #unique=True,
+    # Zmienia się też przy dodaniu/usunięciu komentarza (comment_count), służy jako Last-Modified
+    updated_at = models.DateTimeField(auto_now=True)
+    image = models.FileField(upload_to='post/', null=True, blank=True, default=POST_IMAGE_PLACEHOLDER)
+    # WebP warianty obrazka z api/images.py: {"source": <image.name>, "sizes": {"320w": <name>, ..., "thumb": <name>}}
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    slug = models.SlugField(max_length=SLUG_MAX_LENGTH, unique=True,blank=True) #unique=True,
+    # Denormalized licznik komentarzy, utrzymywany przez Comment.save/delete
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    # Wyliczane z content w save() (api/text.py), listy nie czytają content
+    excerpt = models.CharField(max_length=EXCERPT_LENGTH, blank=True, default='', editable=False)
+    word_count = models.PositiveIntegerField(default=0, editable=False)
+    reading_time = models.PositiveSmallIntegerField(default=0, editable=False, help_text="Minutes")
+    search_text = models.TextField(blank=True, default='', editable=False)
+    # Wyświetlenia szczegółów posta, dopisywane partiami przez api/view_counts.py
+    view_count = models.PositiveBigIntegerField(default=0, editable=False)
+    # Ranking kanału "gorące" (api/hot.py): suma wag posta i komentarzy względem hot_epoch
+    hot_score = models.FloatField(default=0, editable=False)
+    hot_epoch = models.BigIntegerField(default=0, editable=False)
+
+    objects = PostManager()
 
     class Meta:
         db_table = 'posts'
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='posts_created_id_idx'),
+            models.Index(fields=['category', '-created_at', '-id'], name='posts_cat_created_id_idx'),
+            models.Index(fields=['-hot_epoch', '-hot_score', '-id'], name='posts_hot_idx'),
+            models.Index(fields=['category', '-hot_epoch', '-hot_score', '-id'], name='posts_cat_hot_idx'),
+        ]
 
     def __str__(self):
         return self.title
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Nazwa obrazka z bazy, do liczenia referencji MediaBlob przy zmianie
+        instance._stored_image = instance.__dict__.get('image', DEFERRED)
+        return instance
     
+    DERIVED_FIELDS = ('excerpt', 'word_count', 'reading_time', 'search_text')
+
+    def derive_from_content(self):
+        for name, value in derive(self.content).items():
+            setattr(self, name, value)
+
     #Obsługa slugów
     def save(self, *args, **kwargs):
-        if not self.slug:
-            base_slug = slugify(unidecode(self.title))
-            slug = base_slug
-            counter = 1
+        if self._state.adding and not self.hot_epoch:
+            hot.initialize(self)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and 'content' not in self.get_deferred_fields():
+            self.derive_from_content()
+        elif update_fields is not None and 'content' in update_fields:
+            self.derive_from_content()
+            kwargs['update_fields'] = {*update_fields, *self.DERIVED_FIELDS}
 
-            while Post.objects.filter(slug=slug).exists():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
+        allocate = not self.slug
+        base = slug_base(self.title) if allocate else None
 
-            self.slug = slug
+        for attempt in range(SLUG_RETRIES):
+            if allocate:
+                self.slug = format_slug(base, SlugCounter.objects.reserve(base))
+            try:
+                self._save_with_index(*args, **kwargs)
+                return
+            except IntegrityError:
+                # Only a clash on a slug we picked ourselves is worth a retry,
+                # e.g. with a post whose slug was set by hand.
+                if not allocate or attempt == SLUG_RETRIES - 1 or not Post.objects.filter(slug=self.slug).exists():
+                    raise
+                SlugCounter.objects.resync(base)
 
-        super().save(*args, **kwargs)
+    def _save_with_index(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        track_image = update_fields is None or 'image' in update_fields
+        with transaction.atomic():
+            old_image = self._previous_image() if track_image else None
+            super().save(*args, **kwargs)
+            if update_fields is None or set(update_fields) & SearchTerm.SOURCE_FIELDS:
+                SearchTerm.objects.reindex([self])
+            if track_image:
+                self._update_media_refs(old_image)
+
+    def _previous_image(self):
+        if self._state.adding:
+            return None
+        stored = getattr(self, '_stored_image', DEFERRED)
+        if stored is DEFERRED:
+            stored = Post.objects.filter(pk=self.pk).values_list('image', flat=True).first()
+        return stored
+
+    def _update_media_refs(self, old):
+        new = self.image.name or ''
+        old = old or ''
+        if new != old:
+            MediaBlob.objects.retain(new)
+            MediaBlob.objects.release(old)
+        self._stored_image = new
 
 class Comment(models.Model):
     post = models.ForeignKey(
@@ -69,7 +244,166 @@ class Comment(models.Model):
 
     class Meta:
         db_table = 'comments'
+        indexes = [
+            models.Index(fields=['post', '-created_at', '-id'], name='comments_post_created_id_idx'),
+        ]
 
     def __str__(self):
         return f"Comment by {self.user} on {self.post}"
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                hot.add_activity(
+                    {self.post_id: settings.HOT_COMMENT_WEIGHT},
+                    # The same term remove_activity takes out again.
+                    at=self.created_at.timestamp(),
+                    comment_count=F('comment_count') + 1,
+                    updated_at=timezone.now()
+                )
+
+    def remove_activity(self):
+        """
+        Take a deleted comment out of its post's comment_count and hot score.
+        Called by the post_delete signal, so cascades (a deleted user) count too.
+        """
+        hot.add_activity(
+            {self.post_id: -settings.HOT_COMMENT_WEIGHT},
+            at=self.created_at.timestamp(),
+            comment_count=Greatest(F('comment_count') - 1, 0),
+            updated_at=timezone.now()
+        )
+
+
+
+class SearchTermManager(models.Manager):
+    def reindex(self, posts):
+        """Replace the index rows of `posts` (load user and category with them)."""
+        posts = list(posts)
+        rows = [
+            SearchTerm(post=post, term=term, weight=weight)
+            for post in posts
+            for term, weight in build_terms(
+                post.title,
+                post.search_text,
+                post.category.name if post.category_id else '',
+                post.user.username,
+            ).items()
+        ]
+        self.filter(post__in=posts).delete()
+        self.bulk_create(rows, batch_size=1000)
+
+
+class SearchTerm(models.Model):
+    """Inverted full-text index of posts: one row per (post, normalized term)."""
+    SOURCE_FIELDS = {'title', 'content', 'category', 'user'}
+
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='search_terms'
+    )
+    term = models.CharField(max_length=64)
+    weight = models.PositiveIntegerField(default=1)
+
+    objects = SearchTermManager()
+
+    class Meta:
+        db_table = 'post_search_terms'
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'term'], name='post_search_terms_unique'),
+        ]
+        indexes = [
+            # varchar_pattern_ops lets PostgreSQL use the index for prefix LIKE,
+            # other backends ignore opclasses and build a plain index.
+            models.Index(fields=['term'], name='post_search_term_idx', opclasses=['varchar_pattern_ops']),
+        ]
+
+    def __str__(self):
+        return f"{self.term} ({self.weight}) in {self.post_id}"
+
+
+class MediaBlobManager(models.Manager):
+    def touch(self, digest):
+        """Name of the stored blob with `digest` (marked as just seen), or None."""
+        if not self.filter(digest=digest).update(last_seen_at=timezone.now()):
+            return None
+        return self.filter(digest=digest).values_list('name', flat=True).first()
+
+    def retain(self, name):
+        if name and name != POST_IMAGE_PLACEHOLDER:
+            self.filter(name=name).update(ref_count=F('ref_count') + 1, last_seen_at=timezone.now())
+
+    def release(self, name):
+        if name and name != POST_IMAGE_PLACEHOLDER:
+            self.filter(name=name, ref_count__gt=0).update(ref_count=F('ref_count') - 1, last_seen_at=timezone.now())
+
+
+class MediaBlob(models.Model):
+    """
+    Index of content-addressed post media (api/uploads.py): one stored file
+    per distinct content, shared by every post that uploaded it.
+
+    ref_count is kept by Post.save and the post_delete signal;
+    last_seen_at moves on every upload that hits the blob, so garbage
+    collection (gc_media) leaves blobs alone that an in-flight request is
+    about to reference.
+    """
+    digest = models.CharField(max_length=64, primary_key=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    content_type = models.CharField(max_length=100)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_seen_at = models.DateTimeField(default=timezone.now)
+
+    objects = MediaBlobManager()
+
+    class Meta:
+        db_table = 'media_blobs'
+        indexes = [
+            models.Index(fields=['ref_count', 'last_seen_at'], name='media_blobs_gc_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} refs)"
+
+
+class Task(models.Model):
+    """
+    A queued background job (api/tasks.py): the registered function `name`
+    called with `args`/`kwargs` by `manage.py run_tasks`.
+
+    `key` is the idempotency key: while a task with the key exists, enqueueing
+    another one is a no-op. `locked_until` is the lease of the worker running
+    it; a task still running past its lease is taken over by another worker.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    name = models.CharField(max_length=100)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    key = models.CharField(max_length=255, unique=True, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=1)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'tasks'
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='tasks_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
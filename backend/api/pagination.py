@@ -0,0 +1,184 @@
+import base64
+import json
+from collections import OrderedDict
+from datetime import datetime
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on (created_at, id), newest first.
+
+    Every page is fetched with a WHERE on the last seen (created_at, id) pair
+    instead of an OFFSET, so page N costs the same as page 1 as long as the
+    ordering is backed by an index. Cursors are opaque base64 tokens.
+
+    A filter backend may replace the ordering for a request by implementing
+    get_keyset_ordering(request, queryset, view), the same way DRF's
+    CursorPagination defers to an ordering filter. The ordering must end in
+    a unique field.
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.page_queryset(queryset, request, view)))
+
+    def page_queryset(self, queryset, request, view=None):
+        """
+        The lazy queryset for the requested page. Split from paginate_queryset
+        so async views can evaluate it with the async ORM and pass the rows to
+        set_page().
+        """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.keys = self.get_ordering(request, queryset, view)
+
+        cursor = self.decode_cursor(request, queryset)
+        self.reverse = cursor is not None and cursor['reverse']
+        self.has_cursor = cursor is not None
+
+        if cursor is not None:
+            queryset = queryset.filter(self.after(cursor['values'], self.reverse))
+
+        if self.reverse:
+            queryset = queryset.order_by(*(self.flip(key) for key in self.keys))
+        else:
+            queryset = queryset.order_by(*self.keys)
+
+        # One extra row tells us whether there is anything past this page.
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results):
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if self.reverse:
+            results.reverse()
+            self.has_previous = has_more
+            self.has_next = True
+        else:
+            self.has_previous = self.has_cursor
+            self.has_next = has_more
+
+        self.page = results
+        return results
+
+    def get_ordering(self, request, queryset, view):
+        for backend in getattr(view, 'filter_backends', []):
+            if hasattr(backend, 'get_keyset_ordering'):
+                ordering = backend().get_keyset_ordering(request, queryset, view)
+                if ordering:
+                    return tuple(ordering)
+        return self.ordering
+
+    @staticmethod
+    def flip(key):
+        return key[1:] if key.startswith('-') else f'-{key}'
+
+    def after(self, values, reverse):
+        """
+        Rows strictly past `values` in the page direction:
+        (a < x) OR (a = x AND b < y) OR (a = x AND b = y AND c < z) ...
+        """
+        condition = Q()
+        equal = {}
+        for key, value in zip(self.keys, values):
+            descending = key.startswith('-')
+            name = key.lstrip('-')
+            lookup = 'lt' if descending != reverse else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def decode_cursor(self, request, queryset):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            padded = encoded + '=' * (-len(encoded) % 4)
+            data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+            values = data['v']
+            if not isinstance(values, list) or len(values) != len(self.keys):
+                raise ValueError
+            return {
+                'values': [self.to_python(queryset, key, value) for key, value in zip(self.keys, values)],
+                'reverse': bool(data.get('r', False)),
+            }
+        except (TypeError, ValueError, KeyError, UnicodeEncodeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def to_python(queryset, key, value):
+        try:
+            field = queryset.model._meta.get_field(key.lstrip('-'))
+        except FieldDoesNotExist:
+            # Annotations (e.g. search_rank) are plain JSON numbers.
+            if not isinstance(value, (int, float)):
+                raise ValueError(value)
+            return value
+        return field.to_python(value)
+
+    def encode_cursor(self, instance, reverse):
+        values = []
+        for key in self.keys:
+            name = key.lstrip('-')
+            # Model instances, or .values() rows of the fast serializers.
+            value = instance[name] if isinstance(instance, dict) else getattr(instance, name)
+            values.append(value.isoformat() if isinstance(value, datetime) else value)
+        data = {'v': values}
+        if reverse:
+            data['r'] = 1
+        raw = json.dumps(data, separators=(',', ':')).encode('ascii')
+        encoded = base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
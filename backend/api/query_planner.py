@@ -0,0 +1,196 @@
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+class QueryPlan:
+    """
+    The select_related / prefetch_related / only() calls a serializer needs.
+
+    `only` is None when the serializer reads something we cannot see through
+    (a SerializerMethodField, a property, source='*'), in which case no columns
+    are deferred and only the joins are applied.
+    """
+
+    def __init__(self):
+        self.select = set()
+        self.prefetch = {}
+        self.only = set()
+
+    def disable_only(self):
+        self.only = None
+
+    def add_only(self, path):
+        if self.only is not None:
+            self.only.add(path)
+
+    def apply(self, queryset, defer=True):
+        if self.select:
+            queryset = queryset.select_related(*sorted(self.select))
+        if self.prefetch:
+            queryset = queryset.prefetch_related(*self.prefetch.values())
+        if defer and self.only is not None:
+            # Keyset pagination reads the ordering columns of the last row.
+            queryset = queryset.only(*sorted(self.only | _ordering_columns(queryset)))
+        return queryset
+
+
+def _resolve(model, attrs):
+    """
+    Walk `attrs` through the model relations.
+
+    Returns (path, model_field, to_many) for the last attribute, or None when
+    some attribute is not a model field.
+    """
+    path = []
+    field = None
+    to_many = False
+    for attr in attrs:
+        if model is None:
+            return None
+        try:
+            field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            return None
+        path.append(field.name)
+        if field.is_relation:
+            to_many = to_many or field.many_to_many or field.one_to_many
+            model = field.related_model
+        else:
+            model = None
+    return '__'.join(path), field, to_many
+
+
+def _ordering_columns(queryset):
+    columns = set()
+    for key in queryset.query.order_by:
+        name = key.lstrip('-') if isinstance(key, str) else None
+        if name and '__' not in name and _resolve(queryset.model, [name]) is not None:
+            columns.add(name)
+    return columns
+
+
+def _join(prefix, path):
+    return f"{prefix}__{path}" if prefix else path
+
+
+def _plan_serializer(plan, serializer, model, prefix='', fieldset=None):
+    plan.add_only(_join(prefix, model._meta.pk.name))
+    # Model columns a serializer reads outside its fields (to_representation).
+    for path in getattr(getattr(serializer, 'Meta', None), 'plan_only', ()):
+        plan.add_only(_join(prefix, path))
+
+    for name, field in serializer.fields.items():
+        if field.write_only or (fieldset is not None and name not in fieldset):
+            continue
+        if isinstance(field, serializers.SerializerMethodField) or field.source == '*':
+            plan.disable_only()
+            continue
+
+        resolved = _resolve(model, field.source_attrs)
+        if resolved is None:
+            plan.disable_only()
+            continue
+        path, model_field, to_many = resolved
+        full_path = _join(prefix, path)
+
+        if to_many:
+            plan.prefetch[full_path] = _plan_to_many(field, model_field, full_path)
+            continue
+
+        # Forward relations on the way to the field are joined in.
+        parent = full_path.rpartition('__')[0]
+        if parent:
+            plan.select.add(parent)
+            plan.add_only(parent)
+
+        if isinstance(field, serializers.BaseSerializer):
+            plan.select.add(full_path)
+            plan.add_only(full_path)
+            _plan_serializer(plan, field, model_field.related_model, full_path)
+        elif isinstance(field, serializers.RelatedField):
+            plan.add_only(full_path)
+            if not field.use_pk_only_optimization():
+                plan.select.add(full_path)
+                # Without a slug_field any attribute of the related row may be
+                # read, and only() loads a joined model in full when none of
+                # its columns are listed.
+                slug_field = getattr(field, 'slug_field', None)
+                if slug_field:
+                    plan.add_only(_join(full_path, slug_field))
+        else:
+            plan.add_only(full_path)
+
+
+def _plan_to_many(field, model_field, path):
+    """Build the Prefetch for a many=True field, planning the inner queryset."""
+    related_model = model_field.related_model
+    if isinstance(field, serializers.ListSerializer):
+        child = field.child
+        if isinstance(child, serializers.BaseSerializer):
+            inner = QueryPlan()
+            _plan_serializer(inner, child, related_model)
+            # The reverse FK column is needed to attach rows to their parent.
+            remote = getattr(model_field, 'field', None)
+            if remote is not None and inner.only is not None:
+                inner.only.add(remote.name)
+            return Prefetch(path, queryset=inner.apply(related_model._default_manager.all()))
+    return Prefetch(path)
+
+
+@lru_cache(maxsize=None)
+def _plan_for_class(serializer_class, model, fieldset=None):
+    plan = QueryPlan()
+    _plan_serializer(plan, serializer_class(), model, fieldset=fieldset)
+    return plan
+
+
+@lru_cache(maxsize=None)
+def _field_names(serializer_class):
+    return tuple(serializer_class().fields)
+
+
+def plan_for(serializer, model, fieldset=None):
+    """
+    Return the QueryPlan for a serializer class or instance.
+
+    Plans for classes are cached, per `fieldset` (the top level field names to
+    plan, None for all of them); instances are planned on every call since
+    their fields may depend on the request.
+    """
+    if isinstance(serializer, type):
+        if fieldset is not None:
+            # Only known names, so the cache is bounded whatever the client sends.
+            fieldset = frozenset(name for name in _field_names(serializer) if name in fieldset)
+        return _plan_for_class(serializer, model, fieldset)
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    plan = QueryPlan()
+    _plan_serializer(plan, serializer, model, fieldset=fieldset)
+    return plan
+
+
+def plan_for_request(serializer_class, model, request):
+    """plan_for() narrowed to the fields a sparse fieldset request selects."""
+    sparse = getattr(serializer_class, 'sparse_fieldset', None)
+    fieldset = sparse(request, _field_names(serializer_class)) if sparse is not None else None
+    return plan_for(serializer_class, model, fieldset)
+
+
+class QueryPlanMixin:
+    """
+    Apply the serializer's QueryPlan to the view queryset.
+
+    Hooked into filter_queryset so it also covers views that build their own
+    get_queryset. Columns are only deferred for safe methods, so model saves
+    on update never run against a partially loaded instance. Serializers with
+    sparse fieldsets (?fields= / ?omit=) are planned for the selected fields.
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        plan = plan_for_request(self.get_serializer_class(), queryset.model, self.request)
+        return plan.apply(queryset, defer=self.request.method in SAFE_METHODS)
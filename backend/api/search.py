@@ -0,0 +1,52 @@
+import re
+from collections import Counter
+
+from unidecode import unidecode
+
+
+# Which parts of a post are indexed and how much a hit in each one counts.
+FIELD_WEIGHTS = {
+    'title': 3,
+    'category': 2,
+    'user': 2,
+    'content': 1,
+}
+
+MAX_TERM_LENGTH = 64
+
+# Najczęstsze polskie słowa, które nic nie wnoszą do wyszukiwania
+STOPWORDS = frozenset("""
+    ale bo by byc czy dla do go i ich im jak jako je jego jej jest juz ja
+    ktora ktore ktory lub ma mi na nad nie nim o od po pod przez sa se sie ta
+    tak tam te tego tej ten to tu ty tym w we z za ze
+    a an and are as at be by for from in is it of on or the to with
+""".split())
+
+_TOKEN = re.compile(r'[a-z0-9]+')
+
+
+def normalize(text):
+    """Fold diacritics the same way slugs do (unidecode) and lowercase."""
+    return unidecode(text or '').lower()
+
+
+def tokenize(text):
+    return [
+        token[:MAX_TERM_LENGTH]
+        for token in _TOKEN.findall(normalize(text))
+        if len(token) > 1 and token not in STOPWORDS
+    ]
+
+
+def build_terms(title, content, category, username):
+    """Map every indexed term of a post to its summed field weight."""
+    weights = Counter()
+    for field, text in (('title', title), ('content', content), ('category', category), ('user', username)):
+        for token in tokenize(text):
+            weights[token] += FIELD_WEIGHTS[field]
+    return weights
+
+
+def query_terms(query):
+    """Distinct terms of a search query, in the order they were typed."""
+    return list(dict.fromkeys(tokenize(query)))
@@ -1,6 +1,11 @@
 from django.contrib.auth.models import User
+from django.utils.functional import cached_property
 from rest_framework import serializers
-from .models import Post, Category, Comment
+from rest_framework.permissions import SAFE_METHODS
+from .images import THUMBNAIL, variant_names
+from .media_urls import absolute_media_urls
+from .models import POST_IMAGE_PLACEHOLDER, Post, Category, Comment
+from .uploads import StoredUpload
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -13,40 +18,123 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
 
-class PostSerializer(serializers.ModelSerializer):
-    comment_count = serializers.SerializerMethodField()
+def _query_names(request, param):
+    names = {
+        name.strip()
+        for value in request.GET.getlist(param)
+        for name in value.split(',')
+        if name.strip()
+    }
+    return names or None
+
+
+class SparseFieldsMixin:
+    """
+    ?fields=title,image keeps only the listed fields of a read response and
+    ?omit=content drops some. QueryPlanMixin plans the same selection, so the
+    columns behind dropped fields are deferred and never read.
+    """
+
+    @classmethod
+    def sparse_fieldset(cls, request, names):
+        """The field names a request selects out of `names`, None when it selects all."""
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+        fields, omit = _query_names(request, 'fields'), _query_names(request, 'omit')
+        if fields is None and omit is None:
+            return None
+        return frozenset(name for name in names if (fields is None or name in fields) and name not in (omit or ()))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        selected = self.sparse_fieldset(request, fields)
+        if selected is None:
+            return fields
+        for param in ('fields', 'omit'):
+            unknown = sorted((_query_names(request, param) or set()) - fields.keys())
+            if unknown:
+                raise serializers.ValidationError({param: [f"Unknown field(s): {', '.join(unknown)}."]})
+        return {name: field for name, field in fields.items() if name in selected}
+
+
+class MediaFileField(serializers.FileField):
+    """FileField whose URL comes from api/media_urls.py instead of the storage backend."""
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        return self.url_for(value.name)
+
+    def url_for(self, name):
+        return self.media_urls(name)
+
+    @cached_property
+    def media_urls(self):
+        return absolute_media_urls(self.context.get('request'))
+
+
+class PostSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    image = MediaFileField(required=False, allow_null=True)
+    comment_count = serializers.IntegerField(read_only=True)
+    view_count = serializers.IntegerField(read_only=True)
     category = serializers.SlugRelatedField(
         queryset=Category.objects.all(),
         slug_field='name'  # <-- tutaj zamiast ID, pokaże nazwę kategorii
     )
     class Meta:
         model = Post
-        fields = ['id', 'user', 'title', 'content', 'created_at', 'category','image','comment_count','slug']
+        fields = [
+            'id', 'user', 'title', 'content', 'created_at', 'category', 'image', 'comment_count', 'slug',
+            'excerpt', 'word_count', 'reading_time', 'view_count',
+        ]
         read_only_fields = ['id', 'user', 'created_at', 'slug']
+        # Columns read by to_representation itself, loaded by the query planner.
+        plan_only = ['image_variants']
     
-    def get_comment_count(self, obj):
-        return obj.comments.count()
-    
+    def validate_image(self, value):
+        # Already streamed to storage by StreamingImageUploadHandler; keep the name only.
+        if isinstance(value, StoredUpload):
+            return value.storage_name
+        return value
+
     def get_category(self,obj):
         return obj.category.name 
     
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        if not data.get("image"):
-            data["image"] = "https://storagewykop.blob.core.windows.net/media/post/placeholder.webp"
+        if "image" not in data:
+            return data
+        if not data["image"]:
+            data["image"] = self.fields["image"].url_for(POST_IMAGE_PLACEHOLDER)
+        data["image"] = self.image_map(instance, data["image"])
         return data
 
+    def image_map(self, instance, original):
+        # Zamiast jednego URL: oryginał, miniaturka i srcset z wariantów WebP (api/images.py)
+        field = self.fields['image']
+        urls = {
+            size: field.url_for(name)
+            for size, name in variant_names(instance).items()
+        }
+        thumbnail = urls.pop(THUMBNAIL, original)
+        return {'original': original, 'thumbnail': thumbnail, 'srcset': urls}
+
+class PostListSerializer(PostSerializer):
+    """Post lists: the stored excerpt instead of the body, so content is never read."""
+
+    class Meta(PostSerializer.Meta):
+        fields = [name for name in PostSerializer.Meta.fields if name != 'content']
+
+
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = ['id', 'name']
 
-class CommentSerializer(serializers.ModelSerializer):
-    user = serializers.SerializerMethodField()
+class CommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    user = serializers.CharField(source='user.username', read_only=True)
     class Meta:
         model = Comment
         fields = ['id', 'post', 'user', 'content', 'created_at']
-        read_only_fields = ['id', 'user', 'created_at']
-    
-    def get_user(self, obj):
-        return obj.user.username
\ No newline at end of file
+        read_only_fields = ['id', 'user', 'created_at']
\ No newline at end of file
@@ -0,0 +1,113 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import images
+from .authentication import forget_user_on_commit
+from .cache import bump_on_commit
+from .models import Category, Comment, MediaBlob, Post, SearchTerm
+from .tasks import task
+
+
+# Resources used as cache version keys by the views in api/views.py:
+#   posts             every post list (feed, search, by category)
+#   post:<slug>       one post detail
+#   comments:<id>     comments of one post
+#   categories        category list
+
+
+@receiver([post_save, post_delete], sender=Post)
+def invalidate_post(sender, instance, **kwargs):
+    bump_on_commit('posts', f'post:{instance.slug}', f'comments:{instance.pk}')
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def invalidate_comment(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Post):
+        # Cascade from a deleted post, which has already bumped everything.
+        return
+    # comment_count is shown on the post lists and the post detail.
+    resources = ['posts', f'comments:{instance.post_id}']
+    if Comment.post.is_cached(instance):
+        slug = instance.post.slug
+    else:
+        slug = Post.objects.filter(pk=instance.post_id).values_list('slug', flat=True).first()
+    if slug:
+        resources.append(f'post:{slug}')
+    bump_on_commit(*resources)
+
+
+@receiver(post_delete, sender=Comment)
+def remove_comment_activity(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Post):
+        # The post goes with it.
+        return
+    instance.remove_activity()
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category(sender, instance, **kwargs):
+    # Post lists show the category name.
+    bump_on_commit('categories', 'posts')
+
+
+@receiver([post_save, post_delete], sender=get_user_model())
+def invalidate_user(sender, instance, **kwargs):
+    # Fields cached by CachedJWTAuthentication.
+    forget_user_on_commit(instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def process_post_image(sender, instance, **kwargs):
+    images.schedule(instance)
+
+
+@receiver(post_delete, sender=Post)
+def release_post_media(sender, instance, **kwargs):
+    MediaBlob.objects.release(instance.image.name)
+
+
+# Names copied into the search index of every post that refers to them:
+# model -> (its indexed field, the Post field pointing at it).
+INDEXED_NAMES = {
+    Category: ('name', 'category_id'),
+    get_user_model(): ('username', 'user_id'),
+}
+REINDEX_BATCH_SIZE = 1000
+
+
+@task()
+def reindex_posts(field, pk):
+    """Rebuild the search index of the posts whose `field` (user_id, category_id) is `pk`."""
+    queryset = Post.objects.filter(**{field: pk}).select_related('user', 'category').defer('content').order_by('id')
+    last_id = 0
+    while True:
+        batch = list(queryset.filter(id__gt=last_id)[:REINDEX_BATCH_SIZE])
+        if not batch:
+            break
+        with transaction.atomic():
+            SearchTerm.objects.reindex(batch)
+            # Search results cached since the rename still rank by the old name.
+            bump_on_commit('posts')
+        last_id = batch[-1].id
+
+
+@receiver(pre_save, sender=Category)
+@receiver(pre_save, sender=get_user_model())
+def detect_rename(sender, instance, raw=False, update_fields=None, **kwargs):
+    field, _ = INDEXED_NAMES[sender]
+    instance._renamed = False
+    # Saves of other fields (e.g. last_login on every login) cost no query.
+    if raw or instance.pk is None or (update_fields is not None and field not in update_fields):
+        return
+    previous = sender._default_manager.filter(pk=instance.pk).values_list(field, flat=True).first()
+    instance._renamed = previous is not None and previous != getattr(instance, field)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=get_user_model())
+def reindex_renamed(sender, instance, **kwargs):
+    if getattr(instance, '_renamed', False):
+        instance._renamed = False
+        reindex_posts.enqueue(INDEXED_NAMES[sender][1], instance.pk)
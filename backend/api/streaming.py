@@ -0,0 +1,90 @@
+"""
+Streamed, unpaginated JSON for clients that want a whole result set.
+
+`?format=json-stream` on a list endpoint selects StreamingJSONRenderer; the
+view then skips pagination and answers with a StreamingHttpResponse that
+reads the queryset with .iterator(chunk_size=API_STREAM_CHUNK_SIZE) and
+writes one chunk of the JSON array at a time. Only one chunk of rows, dicts
+and encoded bytes is alive at any point, however large the result is. The
+bytes are the same as JSONRenderer would produce for the whole list.
+"""
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+
+
+class StreamingJSONRenderer(JSONRenderer):
+    """
+    Selected with ?format=json-stream. Streamed lists never reach render();
+    it only renders the regular responses of that request (errors).
+    """
+    format = 'json-stream'
+
+
+def iter_json_array(chunks):
+    """Encode an iterable of lists of rows as one JSON array, chunk by chunk."""
+    renderer = JSONRenderer()
+    yield b'['
+    first = True
+    for chunk in chunks:
+        if not chunk:
+            continue
+        # render() of a list is '[' + items joined by ',' + ']'.
+        body = renderer.render(chunk)[1:-1]
+        yield body if first else b',' + body
+        first = False
+    yield b']'
+
+
+def iter_chunks(iterator, size):
+    chunk = []
+    for row in iterator:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class StreamingListMixin:
+    """
+    Adds the json-stream response mode to a list view. Whole tables are only
+    for staff (admin tools, data sync); everyone else keeps the paginated API.
+    """
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, StreamingJSONRenderer]
+    stream_permission_classes = [IsAdminUser]
+
+    def is_streaming(self):
+        return isinstance(getattr(self.request, 'accepted_renderer', None), StreamingJSONRenderer)
+
+    def get_permissions(self):
+        permissions = super().get_permissions()
+        if self.is_streaming():
+            permissions += [permission() for permission in self.stream_permission_classes]
+        return permissions
+
+    def list(self, request, *args, **kwargs):
+        if not self.is_streaming():
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        # The order the pages would come in, without the LIMIT.
+        if self.paginator is not None and hasattr(self.paginator, 'get_ordering'):
+            queryset = queryset.order_by(*self.paginator.get_ordering(request, queryset, self))
+
+        size = settings.API_STREAM_CHUNK_SIZE
+        fast = self.get_fast_serializer() if hasattr(self, 'get_fast_serializer') else None
+        if fast is not None:
+            rows = fast.values(queryset).iterator(chunk_size=size)
+            serialize = fast.serialize
+        else:
+            rows = queryset.iterator(chunk_size=size)
+            context = self.get_serializer_context()
+            serializer_class = self.get_serializer_class()
+            def serialize(chunk):
+                return serializer_class(chunk, many=True, context=context).data
+
+        chunks = (serialize(chunk) for chunk in iter_chunks(rows, size))
+        return StreamingHttpResponse(iter_json_array(chunks), content_type='application/json')
@@ -0,0 +1,197 @@
+"""
+Background tasks: work a request causes but does not have to wait for.
+
+A task is a function registered with @task and queued with its `enqueue`
+attribute; arguments must be JSON-serializable (ids, not model instances).
+enqueue() inserts a row into the `tasks` table in the caller's transaction,
+so a task exists exactly when the write that queued it committed. Workers
+(`manage.py run_tasks`, any number of processes, each with a thread pool)
+claim due rows with a conditional UPDATE and run them.
+
+A task that raises is retried TASKS_MAX_ATTEMPTS times in all (or its own
+max_attempts), each time after an exponential, jittered backoff starting at
+TASKS_RETRY_DELAY seconds, then marked failed with its last error. A worker
+that dies mid-task leaves the row running until its lease (TASKS_LEASE_SECONDS)
+runs out and another worker takes it over (which counts as another attempt),
+so tasks run at least once and must be idempotent.
+
+`key` makes enqueueing idempotent: a task with the key of one that is queued,
+running or done (within TASKS_RETENTION_HOURS, after which finished rows are
+purged) is not queued again; that of a failed one is queued afresh.
+
+With TASKS_EAGER (tests), enqueue() still records the task, and runs it in
+the calling thread right after the transaction commits.
+"""
+import logging
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Task
+
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+def task(name=None, max_attempts=None):
+    """
+    Register a function as a task; `func.enqueue(*args, key=None, delay=None,
+    **kwargs)` queues a call of it. Tasks are found by `name` (the function's
+    dotted path by default), so renaming one strands its queued rows.
+    """
+    def register(func):
+        task_name = name or f'{func.__module__}.{func.__qualname__}'
+        if task_name in _registry:
+            raise ValueError(f"Task {task_name!r} is already registered.")
+        _registry[task_name] = (func, max_attempts)
+
+        def enqueue_call(*args, key=None, delay=None, **kwargs):
+            return enqueue(task_name, args, kwargs, key=key, delay=delay)
+
+        func.task_name = task_name
+        func.enqueue = enqueue_call
+        return func
+    return register
+
+
+def enqueue(name, args=(), kwargs=None, key=None, delay=None):
+    """Queue a call of task `name`; returns its Task (an existing one for a known `key`)."""
+    if name not in _registry:
+        raise LookupError(f"Unknown task {name!r}.")
+    fields = {
+        'name': name,
+        'args': list(args),
+        'kwargs': kwargs or {},
+        'status': Task.QUEUED,
+        'attempts': 0,
+        'max_attempts': _registry[name][1] or settings.TASKS_MAX_ATTEMPTS,
+        'run_at': timezone.now() + timedelta(seconds=delay or 0),
+        'locked_until': None,
+        'last_error': '',
+        'finished_at': None,
+    }
+    if key is None:
+        queued = Task.objects.create(**fields)
+    else:
+        queued = _enqueue_once(key, fields)
+        if queued is None:
+            return Task.objects.get(key=key)
+    if settings.TASKS_EAGER:
+        pk = queued.pk
+        transaction.on_commit(lambda: run(pk))
+    return queued
+
+
+def _enqueue_once(key, fields):
+    """Insert the task with `key`, or requeue it if it failed; None when it is already there."""
+    try:
+        with transaction.atomic():
+            return Task.objects.create(key=key, **fields)
+    except IntegrityError:
+        pass
+    if Task.objects.filter(key=key, status=Task.FAILED).update(**fields):
+        return Task.objects.get(key=key)
+    return None
+
+
+def backoff(attempts):
+    """Seconds to wait before the next run of a task that failed `attempts` times."""
+    delay = min(settings.TASKS_RETRY_DELAY * 2 ** (attempts - 1), settings.TASKS_RETRY_MAX_DELAY)
+    # Jitter spreads out the retries of tasks that failed together (e.g. storage was down).
+    return random.uniform(delay / 2, delay)
+
+
+def due():
+    now = timezone.now()
+    return Task.objects.filter(
+        Q(status=Task.QUEUED, run_at__lte=now)
+        | Q(status=Task.RUNNING, locked_until__lt=now, attempts__lt=F('max_attempts'))
+    )
+
+
+def expire():
+    """
+    Fail the tasks whose last attempt outlived its lease: a task that kills or
+    hangs its worker (out of memory, a crash in native code) never raises, so
+    execute() cannot count it out. Returns how many were failed.
+    """
+    return Task.objects.filter(
+        status=Task.RUNNING, locked_until__lt=timezone.now(), attempts__gte=F('max_attempts'),
+    ).update(
+        status=Task.FAILED, locked_until=None, finished_at=timezone.now(),
+        last_error="Lease expired: the worker died or hung running it.",
+    )
+
+
+def claim(limit):
+    """Take up to `limit` due tasks for this worker; returns them with their lease set."""
+    expire()
+    claimed = []
+    candidates = due().order_by('run_at').values_list('pk', 'status', 'locked_until')[:limit * 2]
+    for pk, status, locked_until in candidates:
+        lease = timezone.now() + timedelta(seconds=settings.TASKS_LEASE_SECONDS)
+        # Matching the status and lease read above makes this a compare-and-set:
+        # of the workers racing for a row, exactly one updates it.
+        if Task.objects.filter(pk=pk, status=status, locked_until=locked_until).update(
+            status=Task.RUNNING, locked_until=lease, attempts=F('attempts') + 1,
+        ):
+            claimed.append(Task.objects.get(pk=pk))
+            if len(claimed) >= limit:
+                break
+    return claimed
+
+
+def execute(claimed):
+    """Run a claimed task and record the outcome; returns True when it succeeded."""
+    func = _registry.get(claimed.name, (None,))[0]
+    try:
+        if func is None:
+            raise LookupError(f"Unknown task {claimed.name!r}.")
+        func(*claimed.args, **claimed.kwargs)
+    except Exception as error:
+        logger.exception("Task %s (%s) failed, attempt %s of %s",
+                         claimed.pk, claimed.name, claimed.attempts, claimed.max_attempts)
+        if claimed.attempts >= claimed.max_attempts:
+            outcome = {'status': Task.FAILED, 'finished_at': timezone.now()}
+        else:
+            outcome = {'status': Task.QUEUED, 'run_at': timezone.now() + timedelta(seconds=backoff(claimed.attempts))}
+        outcome['last_error'] = f'{type(error).__name__}: {error}'
+        succeeded = False
+    else:
+        outcome = {'status': Task.DONE, 'finished_at': timezone.now(), 'last_error': ''}
+        succeeded = True
+    # Only while the lease is still ours; past it, another worker owns the row.
+    Task.objects.filter(pk=claimed.pk, locked_until=claimed.locked_until).update(locked_until=None, **outcome)
+    return succeeded
+
+
+def run(pk):
+    """Claim and run one task now, if it is due (TASKS_EAGER)."""
+    now = timezone.now()
+    lease = now + timedelta(seconds=settings.TASKS_LEASE_SECONDS)
+    if Task.objects.filter(pk=pk, status=Task.QUEUED, run_at__lte=now).update(
+        status=Task.RUNNING, locked_until=lease, attempts=F('attempts') + 1,
+    ):
+        return execute(Task.objects.get(pk=pk))
+    return None
+
+
+def run_in_worker(claimed):
+    try:
+        return execute(claimed)
+    finally:
+        # Worker threads get their own connections; do not leak them.
+        close_old_connections()
+
+
+def purge(hours=None):
+    """Delete tasks that finished (done or failed) more than `hours` ago; returns how many."""
+    cutoff = timezone.now() - timedelta(hours=settings.TASKS_RETENTION_HOURS if hours is None else hours)
+    deleted, _ = Task.objects.filter(status__in=[Task.DONE, Task.FAILED], finished_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,165 @@
+import tempfile
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.handlers import base
+from django.core.handlers.asgi import ASGIHandler
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .authentication import CachedJWTAuthentication
+from .middleware import QueryRecorder, fingerprint
+from .models import Post, Category, Comment
+
+
+# Queries allowed per route, with the request authenticated by a real JWT
+# (so the auth lookup is part of the budget where it applies). Routes with
+# conditional GET support spend one extra small query on their validators.
+QUERY_BUDGETS = {
+    'post-list-create': 1,
+    'post-detail': 2,
+    'posts-by-category': 1,
+    'post-comments': 2,
+    'category-list-create': 2,
+    'me': 1,
+}
+
+SEED_SIZES = [1, 10, 40]
+
+
+class QueryBudgetTestCase(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='budgetuser', password='budgetpass123')
+        self.category = Category.objects.create(name='Technology')
+        self.post = None
+
+    def seed(self, size):
+        """Grow the data set to `size` posts, each by its own user and with comments."""
+        for i in range(Post.objects.count(), size):
+            user = User.objects.create(username=f'seed{i}')
+            category = Category.objects.create(name=f'Seed {i}')
+            post = Post.objects.create(
+                title=f'Post {i}',
+                content='Content ' * 50,
+                user=user,
+                category=self.category if i % 2 else category
+            )
+            Comment.objects.create(content='Comment', user=user, post=post)
+            if self.post is None:
+                self.post = post
+            else:
+                Comment.objects.create(content='Reply', user=user, post=self.post)
+
+    def routes(self):
+        return {
+            'post-list-create': reverse('post-list-create'),
+            'post-detail': reverse('post-detail', kwargs={'slug': self.post.slug}),
+            'posts-by-category': reverse('posts-by-category', kwargs={'category_name': self.category.name}),
+            'post-comments': reverse('post-comments', kwargs={'post_id': self.post.id}),
+            'category-list-create': reverse('category-list-create'),
+            'me': reverse('me'),
+        }
+
+    def test_every_route_stays_within_budget(self):
+        token = RefreshToken.for_user(self.user).access_token
+        for size in SEED_SIZES:
+            self.seed(size)
+            for name, url in self.routes().items():
+                anonymous = name != 'me'
+                with self.subTest(route=name, size=size):
+                    if anonymous:
+                        self.client.credentials()
+                    else:
+                        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+                    with QueryRecorder() as recorder:
+                        response = self.client.get(url)
+                    self.assertEqual(response.status_code, status.HTTP_200_OK)
+                    self.assertLessEqual(
+                        recorder.count, QUERY_BUDGETS[name],
+                        [sql for sql, _ in recorder.queries]
+                    )
+                    self.assertEqual(recorder.duplicates, {})
+
+    def test_budget_covers_every_api_route(self):
+        self.seed(1)
+        self.assertEqual(set(self.routes()), set(QUERY_BUDGETS))
+
+
+class SharedCacheQueryBudgetTestCase(APITestCase):
+    """With an `api` cache all workers share and that is not a table, an authenticated read needs no user row."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(CACHES={'api': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': directory.name,
+        }}))
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='budgetuser', password='budgetpass123')
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_me_reads_no_user_row(self):
+        self.client.get(reverse('me'))
+        with QueryRecorder() as recorder:
+            response = self.client.get(reverse('me'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['username'], 'budgetuser')
+        self.assertEqual(recorder.count, 0, [sql for sql, _ in recorder.queries])
+
+    def test_database_cache_leaves_the_user_cache_off(self):
+        with override_settings(CACHES={'api': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'api_cache',
+        }}):
+            self.assertFalse(CachedJWTAuthentication().cacheable)
+        self.assertTrue(CachedJWTAuthentication().cacheable)
+
+
+class QueryInstrumentationMiddlewareTestCase(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        Category.objects.create(name='Technology')
+
+    @override_settings(DEBUG=True)
+    def test_headers_in_debug(self):
+        response = self.client.get('/api/posts/')
+        self.assertEqual(response['X-Query-Count'], '1')
+        self.assertIn('X-Query-Time-Ms', response)
+        self.assertNotIn('X-Query-Duplicates', response)
+
+    @override_settings(DEBUG=True)
+    async def test_headers_under_asgi(self):
+        response = await self.async_client.get('/api/async/posts/')
+        self.assertEqual(response['X-Query-Count'], '1')
+
+    @override_settings(DEBUG=True)
+    def test_middleware_chain_stays_async(self):
+        # In DEBUG, Django logs every middleware it has to run in a thread for an async handler.
+        with mock.patch.object(base.logger, 'debug') as debug:
+            ASGIHandler()
+        self.assertEqual(debug.call_args_list, [])
+
+    def test_no_headers_without_debug(self):
+        response = self.client.get('/api/categories/')
+        self.assertNotIn('X-Query-Count', response)
+
+    def test_recorder_reports_duplicate_fingerprints(self):
+        with QueryRecorder() as recorder:
+            for name in ['a', 'b', 'c']:
+                Category.objects.filter(name=name).exists()
+            list(Category.objects.filter(id__in=[1, 2, 3]))
+            list(Category.objects.filter(id__in=[4]))
+        self.assertEqual(recorder.count, 5)
+        self.assertEqual(sorted(recorder.duplicates.values()), [2, 3])
+        self.assertEqual(
+            fingerprint('SELECT 1 WHERE id IN (%s, %s)'),
+            fingerprint('SELECT 1 WHERE id IN (%s)')
+        )
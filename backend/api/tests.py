@@ -1,11 +1,37 @@
-from django.test import TestCase
+from django.test import TestCase, LiveServerTestCase, RequestFactory, TransactionTestCase, override_settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, connection, transaction
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework.test import APITestCase, APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework import status
+from django.core.files.storage import FileSystemStorage
 from django.core.files.uploadedfile import SimpleUploadedFile
-from .models import Post, Category, Comment
+from django.core.management import call_command
+from io import BytesIO, StringIO
+from PIL import Image
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+from .models import Post, Category, Comment, MediaBlob, SearchTerm, SlugCounter, Task
+from . import comment_buffer, db_router, hot, tasks, view_counts
+from .authentication import user_cache_key
+from .db_router import ReplicaRouter, pin_cache_key
+from .media_urls import PublicURLs, SignedURLCache, StorageURLs, get_resolver, media_url, override_resolver
+from .query_planner import plan_for
+from .serializers import PostSerializer, CommentSerializer
+from .text import excerpt, plain_text
+from .uploads import AzureBlockWriter, FileSystemWriter, StreamingImageUploadHandler
+import base64
+import hashlib
 import json
+import threading
+from collections import Counter
 
 
 class UserViewsTestCase(APITestCase):
@@ -79,8 +105,10 @@ class PostViewsTestCase(APITestCase):
         )
 
     def create_test_image(self):
-        test_content = b'fake image content'
-        return SimpleUploadedFile('test.jpg', test_content, content_type='image/jpeg')
+        # Uploads are sniffed for image magic bytes, so this has to be a real JPEG.
+        buffer = BytesIO()
+        Image.new('RGB', (10, 10)).save(buffer, 'JPEG')
+        return SimpleUploadedFile('test.jpg', buffer.getvalue(), content_type='image/jpeg')
 
     def test_post_list_view(self):
         response = self.client.get('/api/posts/')
@@ -397,6 +425,1371 @@ class CommentViewsTestCase(APITestCase):
         self.assertEqual(comments[2]['content'], 'Test comment')
 
 
+class CommentCountTestCase(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.category = Category.objects.create(name='Technology')
+        self.post = Post.objects.create(
+            title='Test Post',
+            content='Test content',
+            user=self.user,
+            category=self.category,
+            slug='test-post'
+        )
+
+    def test_counter_follows_create_and_delete(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(f'/api/posts/{self.post.id}/comments/', {'content': 'First', 'post': self.post.id})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        comment = Comment.objects.create(content='Second', user=self.user, post=self.post)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 2)
+
+        comment.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+
+        response = self.client.get(f'/api/posts/{self.post.slug}/')
+        self.assertEqual(response.data['comment_count'], 1)
+
+    def test_recount_comments_repairs_drift(self):
+        Comment.objects.create(content='Comment', user=self.user, post=self.post)
+        Post.objects.filter(pk=self.post.pk).update(comment_count=7)
+
+        call_command('recount_comments', '--dry-run', stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 7)
+
+        call_command('recount_comments', stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+
+
+class SlugAllocationTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+
+    def create(self, title, **kwargs):
+        return Post.objects.create(title=title, content='Content', user=self.user, **kwargs)
+
+    def test_suffixes_and_polish_titles(self):
+        slugs = [self.create('Zażółć gęślą jaźń').slug for _ in range(3)]
+        self.assertEqual(slugs, ['zazolc-gesla-jazn', 'zazolc-gesla-jazn-1', 'zazolc-gesla-jazn-2'])
+
+    def test_save_cost_does_not_grow_with_collisions(self):
+        self.create('Popular')
+        with CaptureQueriesContext(connection) as second:
+            self.create('Popular')
+        for _ in range(10):
+            self.create('Popular')
+        with CaptureQueriesContext(connection) as later:
+            post = self.create('Popular')
+        self.assertEqual(len(second), len(later))
+        self.assertEqual(post.slug, 'popular-12')
+
+    def test_counter_starts_after_existing_slugs(self):
+        self.create('Legacy', slug='legacy')
+        self.create('Legacy', slug='legacy-4')
+        self.assertEqual(self.create('Legacy').slug, 'legacy-5')
+
+    def test_retries_after_clash_with_explicit_slug(self):
+        self.create('Clash')
+        self.create('Something else', slug='clash-1')
+        self.assertEqual(self.create('Clash').slug, 'clash-2')
+        self.assertEqual(SlugCounter.objects.get(base='clash').next, 3)
+
+    def test_bulk_create_reserves_slugs(self):
+        self.create('Import')
+        posts = Post.objects.bulk_create([
+            Post(title=title, content='Content', user=self.user)
+            for title in ['Import', 'Import', 'Other import']
+        ])
+        self.assertEqual([post.slug for post in posts], ['import-1', 'import-2', 'other-import'])
+        self.assertEqual(self.create('Import').slug, 'import-3')
+
+    def test_long_titles_fit_the_slug_column(self):
+        post = self.create('Bardzo ' * 40)
+        self.assertLessEqual(len(post.slug), 50)
+        self.assertLessEqual(len(self.create('Bardzo ' * 40).slug), 50)
+
+
+class KeysetPaginationTestCase(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.category = Category.objects.create(name='Technology')
+        self.posts = [
+            Post.objects.create(
+                title=f'Post {i}',
+                content='Content',
+                user=self.user,
+                category=self.category
+            )
+            for i in range(5)
+        ]
+        # Same timestamp for every row, so only the id breaks the ties.
+        Post.objects.update(created_at=self.posts[0].created_at)
+
+    def collect(self, url):
+        titles = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            titles.extend(post['title'] for post in response.data['results'])
+            last = response.data
+            url = response.data['next']
+        return titles, last
+
+    def test_walks_all_pages_without_duplicates(self):
+        titles, last = self.collect('/api/posts/?page_size=2')
+        self.assertEqual(titles, [f'Post {i}' for i in reversed(range(5))])
+
+        response = self.client.get(last['previous'])
+        self.assertEqual(
+            [post['title'] for post in response.data['results']],
+            ['Post 2', 'Post 1']
+        )
+
+    def test_first_page_has_no_previous(self):
+        response = self.client.get('/api/posts/?page_size=2')
+        self.assertIsNone(response.data['previous'])
+        self.assertIsNotNone(response.data['next'])
+
+    def test_posts_by_category_paginated(self):
+        titles, _ = self.collect(f'/api/posts/category/{self.category.name}/?page_size=2')
+        self.assertEqual(len(titles), 5)
+
+    def test_comments_paginated(self):
+        post = self.posts[0]
+        for i in range(3):
+            Comment.objects.create(content=f'Comment {i}', user=self.user, post=post)
+        response = self.client.get(f'/api/posts/{post.id}/comments/?page_size=2')
+        self.assertEqual(
+            [comment['content'] for comment in response.data['results']],
+            ['Comment 2', 'Comment 1']
+        )
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.data['results'][0]['content'], 'Comment 0')
+        self.assertIsNone(response.data['next'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/posts/?cursor=garbage')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class QueryPlanTestCase(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.post = None
+        self.add_rows(1)
+
+    def add_rows(self, count):
+        start = Post.objects.count()
+        for i in range(start, start + count):
+            user = User.objects.create(username=f'user{i}')
+            category = Category.objects.create(name=f'Category {i}')
+            post = Post.objects.create(title=f'Post {i}', content='Content', user=user, category=category)
+            Comment.objects.create(content='Comment', user=user, post=post)
+            if self.post is None:
+                self.post = post
+            else:
+                Comment.objects.create(content='Comment', user=user, post=self.post)
+
+    def test_plan_for_serializers(self):
+        post_plan = plan_for(PostSerializer, Post)
+        self.assertEqual(post_plan.select, {'category'})
+        self.assertIn('category__name', post_plan.only)
+        self.assertIn('user', post_plan.only)
+
+        comment_plan = plan_for(CommentSerializer, Comment)
+        self.assertEqual(comment_plan.select, {'user'})
+        self.assertIn('user__username', comment_plan.only)
+
+    def test_list_queries_do_not_grow_with_page(self):
+        urls = [
+            '/api/posts/',
+            '/api/posts/category/Category 0/',
+            lambda: f'/api/posts/{self.post.id}/comments/',
+            '/api/categories/',
+        ]
+        def count_queries(url):
+            url = url() if callable(url) else url
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(queries)
+
+        before = [count_queries(url) for url in urls]
+        self.add_rows(10)
+        after = [count_queries(url) for url in urls]
+        self.assertEqual(before, after)
+        self.assertLessEqual(max(after), 2)
+
+
+class SparseFieldsetTestCase(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.category = Category.objects.create(name='Technology')
+        for i in range(3):
+            self.post = Post.objects.create(title=f'Post {i}', content='Long body ' * 500, user=self.user, category=self.category)
+        Comment.objects.create(content='Comment', user=self.user, post=self.post)
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return response, ' '.join(query['sql'] for query in queries)
+
+    def test_fields_trim_the_output_and_the_columns(self):
+        response, sql = self.get('/api/posts/?fields=title,category,image,comment_count,slug')
+        self.assertEqual(len(response.data['results']), 3)
+        for post in response.data['results']:
+            self.assertEqual(set(post), {'title', 'category', 'image', 'comment_count', 'slug'})
+            self.assertIn('thumbnail', post['image'])
+        self.assertNotIn('"content"', sql)
+        self.assertIn('"title"', sql)
+
+    def test_omit(self):
+        response, sql = self.get(f'/api/posts/{self.post.slug}/?omit=content,image')
+        self.assertNotIn('content', response.data)
+        self.assertNotIn('image', response.data)
+        self.assertEqual(response.data['title'], 'Post 2')
+        self.assertNotIn('"content"', sql)
+
+        response, sql = self.get(f'/api/posts/{self.post.id}/comments/?omit=content')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'post', 'user', 'created_at'})
+        self.assertNotIn('"api_comment"."content"', sql)
+
+    def test_pagination_still_works(self):
+        with self.assertNumQueries(1):
+            response, _ = self.get('/api/posts/?fields=title&page_size=2')
+        self.assertEqual([post['title'] for post in response.data['results']], ['Post 2', 'Post 1'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([post['title'] for post in response.data['results']], ['Post 0'])
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get('/api/posts/?fields=title,password')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'fields': ['Unknown field(s): password.']})
+        self.assertEqual(self.client.get('/api/async/posts/?omit=nope').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_async_views_match(self):
+        for url in ['/posts/?fields=title,slug', f'/posts/{self.post.slug}/?omit=content']:
+            self.assertEqual(self.client.get(f'/api{url}').content, self.client.get(f'/api/async{url}').content)
+
+    def test_writes_return_every_field(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post('/api/posts/?fields=title', {'title': 'New', 'content': 'C', 'category': 'Technology'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn('content', response.data)
+
+
+class DerivedPostTextTestCase(APITestCase):
+
+    MARKDOWN = (
+        "# Nagłówek\n\nPierwszy **akapit** z [linkiem](https://example.com) i `kodem`.\n\n"
+        "- punkt jeden\n- punkt dwa\n\n![obrazek](https://example.com/a.png)\n\n```python\nsnake_case = 1\n```\n"
+    )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.category = Category.objects.create(name='Technology')
+
+    def test_plain_text(self):
+        self.assertEqual(
+            plain_text(self.MARKDOWN),
+            'Nagłówek Pierwszy akapit z linkiem i kodem. punkt jeden punkt dwa obrazek snake_case = 1',
+        )
+        self.assertEqual(excerpt('slowo ' * 100, 20), 'slowo slowo slowo…')
+        self.assertEqual(excerpt('krótki tekst'), 'krótki tekst')
+
+    def test_save_derives_the_columns(self):
+        post = Post.objects.create(title='T', content=self.MARKDOWN, user=self.user, category=self.category)
+        self.assertEqual(post.word_count, 14)
+        self.assertEqual(post.reading_time, 1)
+        self.assertTrue(post.excerpt.startswith('Nagłówek Pierwszy akapit'))
+        self.assertIn('naglowek pierwszy', post.search_text)
+
+        post.content = 'slowo ' * 450
+        post.save(update_fields=['content'])
+        post.refresh_from_db()
+        self.assertEqual((post.word_count, post.reading_time), (450, 3))
+        self.assertTrue(post.excerpt.endswith('…'))
+
+        Post.objects.bulk_create([Post(title='B', content='raz dwa', user=self.user, category=self.category)])
+        self.assertEqual(Post.objects.get(title='B').word_count, 2)
+
+    def test_lists_never_read_content(self):
+        Post.objects.create(title='T', content=self.MARKDOWN, user=self.user, category=self.category)
+        for url in ['/api/posts/', '/api/posts/category/Technology/', '/api/async/posts/']:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            post = response.data['results'][0] if hasattr(response, 'data') else json.loads(response.content)['results'][0]
+            self.assertNotIn('content', post)
+            self.assertEqual(post['reading_time'], 1)
+            self.assertNotIn('"posts"."content"', ' '.join(query['sql'] for query in queries))
+
+        response = self.client.get(f"/api/posts/{Post.objects.get().slug}/")
+        self.assertEqual(response.data['content'], self.MARKDOWN)
+        self.assertEqual(response.data['word_count'], 14)
+
+    def test_search_uses_the_plain_text(self):
+        Post.objects.create(title='T', content=self.MARKDOWN, user=self.user, category=self.category)
+        self.assertEqual(len(self.client.get('/api/posts/?search=akapit').data['results']), 1)
+        self.assertEqual(len(self.client.get('/api/posts/?search=example').data['results']), 0)
+
+    def test_backfill_command(self):
+        posts = [
+            Post.objects.create(title=f'T{i}', content=f'Tekst numer {i}', user=self.user, category=self.category)
+            for i in range(5)
+        ]
+        Post.objects.update(excerpt='', word_count=0, reading_time=0, search_text='')
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('backfill_post_text', '--batch-size', '2', stdout=out)
+        self.assertIn('Derived text stored for 5 posts.', out.getvalue())
+        self.assertEqual(Post.objects.get(pk=posts[3].pk).excerpt, 'Tekst numer 3')
+        self.assertEqual(set(Post.objects.values_list('word_count', flat=True)), {3})
+
+        out = StringIO()
+        call_command('backfill_post_text', stdout=out)
+        self.assertIn('Derived text stored for 0 posts.', out.getvalue())
+
+
+class FastSerializerParityTestCase(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.category = Category.objects.create(name='Technology')
+        self.posts = []
+        for i in range(5):
+            post = Post.objects.create(
+                title=f'Rower {i}', content=f'**Treść** numer {i}', user=self.user,
+                category=self.category if i % 2 else None,
+            )
+            self.posts.append(post)
+            Comment.objects.create(content=f'Komentarz {i}', user=self.user, post=self.posts[0])
+        # One with variants, one with an image whose variants are not built yet.
+        Post.objects.filter(pk=self.posts[1].pk).update(image='post/ab/abc.jpg', image_variants={
+            'source': 'post/ab/abc.jpg',
+            'sizes': {'320w': 'post/variants/abc-320w.webp', 'thumb': 'post/variants/abc-thumb.webp'},
+        })
+        Post.objects.filter(pk=self.posts[2].pk).update(image='post/zdjęcie (1).png')
+
+    def assertSameBytes(self, url):
+        responses = []
+        for fast in (False, True):
+            with self.settings(API_FAST_SERIALIZERS=fast, MEDIA_URL='/media/'):
+                responses.append(self.client.get(url))
+        self.assertEqual(responses[0].status_code, responses[1].status_code, url)
+        self.assertEqual(responses[0].content, responses[1].content, url)
+        return responses[1]
+
+    def test_post_lists(self):
+        for url in [
+            '/api/posts/', '/api/posts/?page_size=2', '/api/posts/?search=rower&page_size=2',
+            '/api/posts/?fields=title,image', '/api/posts/?omit=image,excerpt',
+            '/api/posts/?fields=nope', '/api/posts/category/Technology/',
+            '/api/async/posts/', '/api/async/posts/?search=rower', '/api/async/posts/category/Technology/?fields=slug',
+        ]:
+            self.assertSameBytes(url)
+
+    def test_following_cursors(self):
+        for url in ['/api/posts/?page_size=2', '/api/posts/?search=rower&page_size=2']:
+            while url:
+                url = self.assertSameBytes(url).data['next']
+
+    def test_comment_lists(self):
+        for url in [
+            f'/api/posts/{self.posts[0].id}/comments/?page_size=3',
+            f'/api/posts/{self.posts[0].id}/comments/?omit=content',
+            f'/api/async/posts/{self.posts[0].id}/comments/',
+        ]:
+            self.assertSameBytes(url)
+
+    def test_fast_path_builds_no_model_instances(self):
+        with mock.patch.object(Post, 'from_db', side_effect=AssertionError):
+            self.assertEqual(self.client.get('/api/posts/').status_code, status.HTTP_200_OK)
+
+    def test_benchmark_reports_the_speedup(self):
+        out = StringIO()
+        call_command('benchmark_serialization', '--compare', 'serializers', '--rows', '20', '--repeat', '2', stdout=out, stderr=StringIO())
+        report = json.loads(out.getvalue())
+        self.assertTrue(report['identical_output'])
+        self.assertGreater(report['speedup'], 0)
+
+
+class StreamingListTestCase(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = User.objects.create_user(username='admin', password='adminpass123', is_staff=True)
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.category = Category.objects.create(name='Technology')
+        posts = [
+            Post(title=f'Rower {i}', content=f'Treść {i}', user=self.user, category=self.category if i % 2 else None)
+            for i in range(25)
+        ]
+        Post.objects.bulk_create(posts)
+        self.post = Post.objects.first()
+        Comment.objects.bulk_create([Comment(content=f'C{i}', user=self.user, post=self.post) for i in range(7)])
+        self.client.force_authenticate(user=self.admin)
+
+    def paginated(self, url):
+        """Every result of `url` by following the cursors."""
+        results = []
+        url = f'{url}{"&" if "?" in url else "?"}page_size=100'
+        while url:
+            data = self.client.get(url).data
+            results.extend(data['results'])
+            url = data['next']
+        return results
+
+    def stream(self, url):
+        response = self.client.get(f'{url}{"&" if "?" in url else "?"}format=json-stream')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        return b''.join(response.streaming_content)
+
+    def test_streams_the_same_rows_as_the_pages(self):
+        for url in ['/api/posts/', '/api/posts/?search=rower&fields=id,title', '/api/posts/category/Technology/',
+                    f'/api/posts/{self.post.id}/comments/']:
+            body = self.stream(url)
+            self.assertEqual(json.loads(body), json.loads(json.dumps(self.paginated(url))), url)
+
+    def test_reads_in_chunks(self):
+        for fast in (True, False):
+            with self.settings(API_STREAM_CHUNK_SIZE=10, API_FAST_SERIALIZERS=fast):
+                with CaptureQueriesContext(connection) as queries:
+                    body = self.stream('/api/posts/')
+            self.assertEqual(len(json.loads(body)), 25)
+            # SQLite has no server-side cursors: one fetch per chunk shows up as one query.
+            self.assertEqual(len([q for q in queries if 'FROM "posts"' in q['sql']]), 1)
+        with self.settings(API_STREAM_CHUNK_SIZE=10):
+            with mock.patch('api.streaming.JSONRenderer.render', side_effect=lambda data, *a, **k: json.dumps(data).encode()) as render:
+                self.stream('/api/posts/')
+        self.assertEqual([len(call.args[0]) for call in render.call_args_list], [10, 10, 5])
+
+    def test_empty_result(self):
+        self.assertEqual(self.stream('/api/posts/?search=nothingmatches'), b'[]')
+
+    def test_only_staff_can_stream(self):
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self.client.get('/api/posts/?format=json-stream').status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.get('/api/posts/?format=json-stream').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.client.get('/api/posts/').status_code, status.HTTP_200_OK)
+
+
+class FullTextSearchTestCase(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.category = Category.objects.create(name='Zwierzęta')
+        self.title_hit = Post.objects.create(
+            title='Żółw pobił rekord prędkości', content='Nikt się nie spodziewał.',
+            user=self.user, category=self.category
+        )
+        self.content_hit = Post.objects.create(
+            title='Wiadomości z Łodzi', content='W zoo zamieszkał nowy żółw.',
+            user=self.user, category=self.category
+        )
+        self.other = Post.objects.create(
+            title='Nowy procesor', content='Szybszy niż poprzedni.', user=self.user
+        )
+
+    def search(self, query):
+        response = self.client.get('/api/posts/', {'search': query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [post['id'] for post in response.data['results']]
+
+    def test_diacritics_are_folded(self):
+        self.assertEqual(self.search('żółw'), self.search('ZOLW'))
+        self.assertEqual(self.search('lodz'), [self.content_hit.id])
+
+    def test_ranked_by_field_weight(self):
+        self.assertEqual(self.search('żółw'), [self.title_hit.id, self.content_hit.id])
+
+    def test_all_terms_must_match_and_prefixes_work(self):
+        self.assertEqual(self.search('żółw rekord'), [self.title_hit.id])
+        self.assertEqual(self.search('proces'), [self.other.id])
+        self.assertEqual(self.search('zwierz'), [self.content_hit.id, self.title_hit.id])
+        self.assertEqual(self.search('!!!'), [])
+
+    def test_index_follows_save_and_delete(self):
+        self.other.title = 'Nowa karta graficzna'
+        self.other.save()
+        self.assertEqual(self.search('procesor'), [])
+        self.assertEqual(self.search('graficzna'), [self.other.id])
+
+        self.other.delete()
+        self.assertFalse(SearchTerm.objects.filter(post_id=self.other.id).exists())
+
+    def test_ranked_results_paginate(self):
+        for i in range(4):
+            Post.objects.create(title=f'Żółw numer {i}', content='Treść', user=self.user)
+        ids = []
+        url = '/api/posts/?search=zolw&page_size=2'
+        while url:
+            response = self.client.get(url)
+            ids += [post['id'] for post in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(len(ids), 6)
+        self.assertEqual(len(set(ids)), 6)
+        self.assertEqual(ids[-1], self.content_hit.id)
+
+    def test_index_follows_renamed_users_and_categories(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Gady'
+            self.category.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.username = 'herpetolog'
+            self.user.save()
+        self.assertEqual(self.search('zwierzeta'), [])
+        self.assertCountEqual(self.search('gady'), [self.title_hit.id, self.content_hit.id])
+        self.assertEqual(self.search('testuser'), [])
+        self.assertEqual(len(self.search('herpetolog')), 3)
+        self.assertEqual(Task.objects.filter(name='api.signals.reindex_posts', status=Task.DONE).count(), 2)
+
+    def test_saves_without_a_rename_queue_no_reindex(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save(update_fields=['last_login'])
+            self.user.save()
+            self.category.save()
+        self.assertFalse(Task.objects.filter(name='api.signals.reindex_posts').exists())
+
+    def test_rebuild_search_index(self):
+        SearchTerm.objects.all().delete()
+        call_command('rebuild_search_index', '--batch-size', '2', stdout=StringIO())
+        self.assertEqual(self.search('zolw'), [self.title_hit.id, self.content_hit.id])
+
+
+class ConditionalGetTestCase(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.category = Category.objects.create(name='Technology')
+        self.post = Post.objects.create(title='Test Post', content='Test content', user=self.user, category=self.category)
+        self.urls = [
+            f'/api/posts/{self.post.slug}/',
+            f'/api/posts/{self.post.id}/comments/',
+            '/api/categories/',
+        ]
+
+    def test_matching_etag_returns_304_with_one_query(self):
+        for url in self.urls:
+            etag = self.client.get(url)['ETag']
+            with self.assertNumQueries(1):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response['ETag'], etag)
+            self.assertEqual(response.content, b'')
+
+    def test_if_modified_since(self):
+        response = self.client.get(self.urls[0])
+        response = self.client.get(self.urls[0], HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_writes_change_validators(self):
+        etags = [self.client.get(url)['ETag'] for url in self.urls]
+        Comment.objects.create(content='New comment', user=self.user, post=self.post)
+        Category.objects.create(name='Sports')
+        for url, etag in zip(self.urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_missing_post_is_still_404(self):
+        response = self.client.get('/api/posts/missing/', HTTP_IF_NONE_MATCH='"abc"')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+def api_cache_settings(backend='django.core.cache.backends.locmem.LocMemCache', location='api-tests'):
+    return {
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'api': {'BACKEND': backend, 'LOCATION': location},
+    }
+
+
+@override_settings(CACHES=api_cache_settings())
+class ResponseCacheTestCase(APITestCase):
+
+    def setUp(self):
+        caches['api'].clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.category = Category.objects.create(name='Technology')
+        self.post = Post.objects.create(title='Test Post', content='Test content', user=self.user, category=self.category)
+        self.other = Post.objects.create(title='Other Post', content='Other content', user=self.user, category=self.category)
+        self.urls = {
+            'list': '/api/posts/',
+            'by-category': f'/api/posts/category/{self.category.name}/',
+            'detail': f'/api/posts/{self.post.slug}/',
+            'other-detail': f'/api/posts/{self.other.slug}/',
+            'comments': f'/api/posts/{self.post.id}/comments/',
+            'other-comments': f'/api/posts/{self.other.id}/comments/',
+            'categories': '/api/categories/',
+        }
+
+    def cache_state(self):
+        return {name: self.client.get(url)['X-Cache'] for name, url in self.urls.items()}
+
+    def test_second_anonymous_get_is_served_from_cache(self):
+        self.client.get(self.urls['list'])
+        with self.assertNumQueries(0):
+            response = self.client.get(self.urls['list'])
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_comment_write_invalidates_only_its_post(self):
+        self.cache_state()
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(content='New comment', user=self.user, post=self.post)
+        self.assertEqual(self.cache_state(), {
+            'list': 'MISS',
+            'by-category': 'MISS',
+            'detail': 'MISS',
+            'other-detail': 'HIT',
+            'comments': 'MISS',
+            'other-comments': 'HIT',
+            'categories': 'HIT',
+        })
+        self.assertEqual(self.client.get(self.urls['detail']).data['comment_count'], 1)
+
+    def test_category_write_invalidates_categories(self):
+        self.cache_state()
+        self.client.force_authenticate(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/categories/', {'name': 'Sports'})
+        self.client.force_authenticate(user=None)
+        state = self.cache_state()
+        self.assertEqual(state['categories'], 'MISS')
+        self.assertEqual(state['other-comments'], 'HIT')
+
+    def test_category_rename_invalidates_post_details(self):
+        self.client.get(self.urls['detail'])
+        self.client.get(f'/api/async/posts/{self.post.slug}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Tech'
+            self.category.save()
+        for url in [self.urls['detail'], f'/api/async/posts/{self.post.slug}/']:
+            response = self.client.get(url)
+            self.assertEqual(response['X-Cache'], 'MISS')
+            self.assertEqual(response.data['category'], 'Tech')
+
+    def test_authenticated_requests_bypass_cache(self):
+        self.client.force_authenticate(user=self.user)
+        self.client.get(self.urls['list'])
+        response = self.client.get(self.urls['list'])
+        self.assertNotIn('X-Cache', response)
+
+    def test_file_based_backend(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with self.settings(CACHES=api_cache_settings('django.core.cache.backends.filebased.FileBasedCache', directory)):
+                self.assertEqual(self.client.get(self.urls['categories'])['X-Cache'], 'MISS')
+                self.assertEqual(self.client.get(self.urls['categories'])['X-Cache'], 'HIT')
+
+
+def use_shared_cache(test):
+    """Point the api cache at files in a fresh directory, a backend worker processes share."""
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    test.enterContext(test.settings(CACHES=api_cache_settings('django.core.cache.backends.filebased.FileBasedCache', directory.name)))
+
+
+class CachedJWTAuthenticationTestCase(APITestCase):
+
+    def setUp(self):
+        use_shared_cache(self)
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.category = Category.objects.create(name='Technology')
+        self.authenticate(self.user)
+
+    def authenticate(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+
+    def test_authenticated_reads_skip_the_users_table(self):
+        self.assertEqual(self.client.get('/api/me/').status_code, status.HTTP_200_OK)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/me/')
+            self.client.get('/api/async/me/')
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(response.data, {'id': self.user.id, 'username': 'testuser', 'is_staff': False, 'is_superuser': False})
+
+    def test_saving_the_user_drops_the_cached_fields(self):
+        self.client.get('/api/me/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_staff = True
+            self.user.save()
+        self.assertTrue(self.client.get('/api/me/').data['is_staff'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get('/api/me/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_per_process_cache_is_not_used(self):
+        with self.settings(CACHES=api_cache_settings()):
+            self.client.get('/api/me/')
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get('/api/me/')
+            self.assertEqual(len(queries), 1)
+            self.assertIsNone(caches['api'].get(user_cache_key(self.user.id)))
+
+    def test_deleted_user_is_rejected(self):
+        self.client.get('/api/me/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertEqual(self.client.get('/api/me/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_cached_user_can_write(self):
+        self.client.get('/api/me/')
+        response = self.client.post('/api/posts/', {'title': 'T', 'content': 'C', 'category': self.category.name})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        post = Post.objects.get()
+        self.assertEqual(post.user, self.user)
+        # Other columns are deferred, never blanked.
+        response = self.client.patch(f'/api/posts/{post.slug}/', {'title': 'T2'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('testpass123'))
+
+
+class SeedAndBenchmarkCommandTestCase(APITestCase):
+
+    def test_seed_data(self):
+        call_command(
+            'seed_data', '--users', '5', '--categories', '3', '--posts', '40',
+            '--comments', '120', '--batch-size', '7', '--seed', '1', stdout=StringIO()
+        )
+        self.assertEqual(User.objects.count(), 5)
+        self.assertEqual(Category.objects.count(), 3)
+        self.assertEqual(Post.objects.count(), 40)
+        self.assertEqual(Comment.objects.count(), 120)
+        self.assertEqual(Post.objects.values('slug').distinct().count(), 40)
+        self.assertEqual(sum(Post.objects.values_list('comment_count', flat=True)), 120)
+        # Hot scores and updated_at follow the comments, as if each had been saved.
+        seeded = dict(Post.objects.values_list('pk', 'hot_score'))
+        hot.recompute(at=hot.current_epoch())
+        for pk, hot_score in Post.objects.values_list('pk', 'hot_score'):
+            self.assertAlmostEqual(seeded[pk], hot_score, places=3)
+        for post in Post.objects.filter(comment_count__gt=0):
+            self.assertGreaterEqual(post.updated_at, post.comments.latest('created_at').created_at)
+
+        out = StringIO()
+        call_command('recount_comments', '--dry-run', stdout=out)
+        self.assertIn('All comment counters are correct', out.getvalue())
+
+    def test_benchmark_api_reports_json(self):
+        call_command('seed_data', '--users', '2', '--posts', '5', '--comments', '10', stdout=StringIO())
+        out = StringIO()
+        call_command('benchmark_api', '--requests', '3', '--warmup', '0', stdout=out, stderr=StringIO())
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['meta']['rows']['posts'], 5)
+        for name in ['post-list', 'post-detail', 'posts-by-category', 'post-comments', 'category-list', 'me']:
+            self.assertEqual(report['results'][name]['status'], [200])
+            self.assertIsNotNone(report['results'][name]['cold']['p99_ms'])
+            self.assertIsNotNone(report['results'][name]['warm']['p99_ms'])
+
+    def test_benchmark_api_times_cold_requests_as_misses(self):
+        call_command('seed_data', '--users', '2', '--posts', '5', '--comments', '10', stdout=StringIO())
+        with self.settings(CACHES=api_cache_settings()):
+            # The second run starts on a cache the first one filled.
+            for _ in range(2):
+                out = StringIO()
+                call_command(
+                    'benchmark_api', '--requests', '3', '--warmup', '1', '--only', 'post-list', 'post-detail',
+                    stdout=out, stderr=StringIO(),
+                )
+        results = json.loads(out.getvalue())['results']
+        for name in ['post-list', 'post-detail']:
+            # Cold requests build the response from the database, warm ones come from the cache.
+            self.assertGreater(results[name]['cold']['queries_per_request'], 0)
+            self.assertLess(results[name]['warm']['queries_per_request'], results[name]['cold']['queries_per_request'])
+
+
+class LoadTestCommandTestCase(LiveServerTestCase):
+
+    def test_replays_frontend_mix_without_errors(self):
+        user = User.objects.create_user(username='loaduser', password='loadpass123')
+        category = Category.objects.create(name='Technology')
+        post = Post.objects.create(title='Load Post', content='Content', user=user, category=category)
+        Comment.objects.create(content='Comment', user=user, post=post)
+
+        out = StringIO()
+        call_command(
+            'loadtest', '--url', self.live_server_url, '--concurrency', '1,2',
+            '--duration', '0.5', '--username', 'loaduser', '--password', 'loadpass123',
+            '--seed', '1', stdout=out
+        )
+        self.assertIn('c=2', out.getvalue())
+        self.assertEqual(out.getvalue().count('errors=0.00%'), 2)
+
+    def test_async_prefix_reports_rps_per_worker(self):
+        user = User.objects.create_user(username='loaduser', password='loadpass123')
+        post = Post.objects.create(title='Load Post', content='Content', user=user, category=Category.objects.create(name='Tech'))
+        Comment.objects.create(content='Comment', user=user, post=post)
+
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command(
+                'loadtest', '--url', self.live_server_url, '--concurrency', '2', '--duration', '0.5',
+                '--username', 'loaduser', '--password', 'loadpass123', '--prefix', '/api/async/',
+                '--workers', '2', '--output', output.name, stdout=StringIO()
+            )
+            report = json.load(open(output.name))
+        self.assertEqual(report['prefix'], '/api/async')
+        level = report['levels'][0]
+        self.assertEqual(level['error_rate'], 0.0)
+        self.assertEqual(level['rps_per_worker'], round(level['throughput_rps'] / 2, 2))
+
+
+class AsyncReadPathTestCase(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.category = Category.objects.create(name='Technology')
+        for i in range(3):
+            post = Post.objects.create(title=f'Async Post {i}', content='Content', user=self.user, category=self.category)
+            Comment.objects.create(content=f'Comment {i}', user=self.user, post=post)
+        self.post = post
+        self.paths = [
+            '/posts/',
+            '/posts/?page_size=2',
+            '/posts/?search=async',
+            f'/posts/{self.post.slug}/',
+            f'/posts/category/{self.category.name}/',
+            f'/posts/{self.post.id}/comments/',
+            '/categories/',
+        ]
+
+    def assertSameResponse(self, path, **extra):
+        sync = self.client.get(f'/api{path}', **extra)
+        response = self.client.get(f'/api/async{path}', **extra)
+        self.assertEqual(response.status_code, sync.status_code, path)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        # Pagination links point at their own prefix.
+        self.assertEqual(response.content.decode().replace('/api/async/', '/api/'), sync.content.decode(), path)
+        return response
+
+    def test_anonymous_responses_match_sync_views(self):
+        for path in self.paths:
+            self.assertSameResponse(path)
+
+    def test_authenticated_responses_match_sync_views(self):
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        for path in self.paths + ['/me/']:
+            self.assertSameResponse(path)
+
+    def test_errors_match_sync_views(self):
+        self.assertSameResponse('/me/')
+        self.assertSameResponse('/posts/missing/')
+        self.assertSameResponse('/posts/?cursor=garbage')
+        self.assertSameResponse('/posts/', HTTP_AUTHORIZATION='Bearer not-a-token')
+        self.assertEqual(self.client.get('/api/async/me/')['WWW-Authenticate'], 'Bearer realm="api"')
+        self.assertEqual(self.client.post('/api/async/posts/').status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    def test_next_cursor_walks_the_async_list(self):
+        response = self.client.get('/api/async/posts/?page_size=2')
+        second = self.client.get(json.loads(response.content)['next'])
+        self.assertEqual([post['title'] for post in json.loads(second.content)['results']], ['Async Post 0'])
+
+    def test_conditional_get(self):
+        url = f'/api/async/posts/{self.post.slug}/'
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    @override_settings(CACHES=api_cache_settings())
+    def test_anonymous_gets_are_cached(self):
+        caches['api'].clear()
+        self.assertEqual(self.client.get('/api/async/posts/')['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/async/posts/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(len(json.loads(response.content)['results']), 3)
+
+
+def local_storage_settings(location):
+    return {
+        'default': {
+            'BACKEND': 'django.core.files.storage.FileSystemStorage',
+            'OPTIONS': {'location': location, 'base_url': '/media/'},
+        },
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    }
+
+
+class ImagePipelineTestCase(APITestCase):
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        storage = self.settings(STORAGES=local_storage_settings(self.media.name), MEDIA_URL='/media/')
+        storage.enable()
+        self.addCleanup(storage.disable)
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.category = Category.objects.create(name='Technology')
+
+    def upload(self, name='photo.png', size=(1000, 500), mode='RGB', fmt='PNG'):
+        buffer = BytesIO()
+        Image.new(mode, size, 'red').save(buffer, fmt)
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type=f'image/{fmt.lower()}')
+
+    def create_post(self, image):
+        self.client.force_authenticate(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/posts/', {
+                'title': 'Photo', 'content': 'Content', 'category': self.category.name, 'image': image
+            })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        return Post.objects.get(id=response.data['id'])
+
+    def test_upload_gets_webp_variants_and_thumbnail(self):
+        post = self.create_post(self.upload())
+        self.assertEqual(post.image_variants['source'], post.image.name)
+        self.assertEqual(set(post.image_variants['sizes']), {'320w', '640w', 'thumb'})
+
+        storage = post.image.storage
+        with storage.open(post.image_variants['sizes']['640w']) as handle, Image.open(handle) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (640, 320)))
+        with storage.open(post.image_variants['sizes']['thumb']) as handle, Image.open(handle) as image:
+            self.assertEqual(image.size, (200, 200))
+
+        data = self.client.get(f'/api/posts/{post.slug}/').data['image']
+        self.assertEqual(data['original'], f'http://testserver/media/{post.image.name}')
+        self.assertEqual(set(data['srcset']), {'320w', '640w'})
+        self.assertTrue(data['srcset']['320w'].endswith('.webp'))
+        self.assertTrue(data['thumbnail'].endswith('-thumb.webp'))
+
+    def test_processing_is_queued_once_per_image(self):
+        post = self.create_post(self.upload())
+        with self.captureOnCommitCallbacks(execute=True):
+            post.title = 'Renamed'
+            post.save()
+        task = Task.objects.get()
+        self.assertEqual((task.name, task.args, task.status), ('api.images.process_post_image', [post.id], Task.DONE))
+        self.assertEqual(task.key, f'post-image:{post.id}:{post.image.name}')
+
+    def test_small_image_keeps_its_width(self):
+        post = self.create_post(self.upload(size=(100, 80), mode='P', fmt='GIF', name='small.gif'))
+        self.assertEqual(set(post.image_variants['sizes']), {'100w', 'thumb'})
+
+    def test_broken_upload_falls_back_to_original(self):
+        with self.assertLogs('api.images', 'WARNING'):
+            post = self.create_post(SimpleUploadedFile('broken.jpg', b'\xff\xd8\xff\xe0 truncated', content_type='image/jpeg'))
+        self.assertEqual(post.image_variants, {'source': post.image.name, 'sizes': {}})
+        data = self.client.get(f'/api/posts/{post.slug}/').data['image']
+        self.assertEqual(data['thumbnail'], data['original'])
+        self.assertEqual(data['srcset'], {})
+
+    def test_placeholder_is_not_processed(self):
+        post = Post.objects.create(title='Plain', content='Content', user=self.user, category=self.category)
+        self.assertEqual(post.image_variants, {})
+        data = self.client.get(f'/api/posts/{post.slug}/').data['image']
+        self.assertEqual(data['srcset'], {})
+
+    def test_list_reads_variants_without_extra_queries(self):
+        for _ in range(3):
+            self.create_post(self.upload())
+        self.client.force_authenticate(user=None)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/posts/')
+        self.assertEqual([len(post['image']['srcset']) for post in response.data['results']], [2, 2, 2])
+
+    def test_process_images_command_backfills(self):
+        post = self.create_post(self.upload())
+        Post.objects.filter(id=post.id).update(image_variants={})
+        out = StringIO()
+        call_command('process_images', stdout=out)
+        self.assertIn('Built variants for 1 post image(s).', out.getvalue())
+        post.refresh_from_db()
+        self.assertIn('thumb', post.image_variants['sizes'])
+
+
+class StreamingUploadTestCase(APITestCase):
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        storage = self.settings(STORAGES=local_storage_settings(self.media.name), MEDIA_URL='/media/')
+        storage.enable()
+        self.addCleanup(storage.disable)
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.category = Category.objects.create(name='Technology')
+        self.client.force_authenticate(user=self.user)
+
+    def png(self, size=(600, 600)):
+        buffer = BytesIO()
+        # Noise does not compress, so the file spans several upload chunks.
+        Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3)).save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def stored_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.media.name)
+            for root, _, names in os.walk(self.media.name) for name in names
+        )
+
+    def create(self, content, name='photo.png', content_type='image/png', **data):
+        data = {'title': 'Photo', 'content': 'Content', 'category': self.category.name, **data}
+        data['image'] = SimpleUploadedFile(name, content, content_type=content_type)
+        return self.client.post('/api/posts/', data)
+
+    def test_image_is_streamed_to_storage_in_chunks(self):
+        content = self.png()
+        self.assertGreater(len(content), 3 * StreamingImageUploadHandler.chunk_size)
+        writes = []
+        original = FileSystemWriter.write
+        with mock.patch.object(FileSystemWriter, 'write', lambda writer, chunk: writes.append(len(chunk)) or original(writer, chunk)):
+            with self.settings(FILE_UPLOAD_HANDLERS=[]):
+                response = self.create(content)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertLessEqual(max(writes), StreamingImageUploadHandler.chunk_size)
+        self.assertEqual(sum(writes), len(content))
+
+        post = Post.objects.get()
+        digest = hashlib.sha256(content).hexdigest()
+        self.assertEqual(post.image.name, f'post/{digest[:2]}/{digest}.png')
+        with post.image.open('rb') as handle:
+            self.assertEqual(handle.read(), content)
+
+    def test_same_name_different_content_gets_its_own_file(self):
+        self.create(self.png((20, 20)))
+        self.create(self.png((20, 20)))
+        names = [post.image.name for post in Post.objects.order_by('id')]
+        self.assertNotEqual(names[0], names[1])
+        self.assertEqual(len(self.stored_files()), 2)
+
+    def test_declared_content_type_is_checked_before_writing(self):
+        with mock.patch.object(FileSystemWriter, '__init__') as open_writer:
+            response = self.create(b'%PDF-1.4', name='doc.pdf', content_type='application/pdf')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('image', response.data)
+        open_writer.assert_not_called()
+        self.assertFalse(Post.objects.exists())
+
+    def test_content_is_sniffed(self):
+        response = self.create(b'<?php echo 1; ?>' * 10, name='shell.png')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('image', response.data)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_size_limit(self):
+        with self.settings(POST_IMAGE_MAX_UPLOAD_SIZE=2 * StreamingImageUploadHandler.chunk_size):
+            response = self.create(self.png())
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_declared_length_over_limit_is_rejected_before_parsing(self):
+        with self.settings(POST_IMAGE_MAX_UPLOAD_SIZE=1000, DATA_UPLOAD_MAX_MEMORY_SIZE=1000):
+            with mock.patch.object(FileSystemWriter, '__init__') as open_writer:
+                response = self.create(self.png((100, 100)))
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        open_writer.assert_not_called()
+
+    def test_failed_validation_removes_the_streamed_file(self):
+        response = self.create(self.png((20, 20)), category='Missing')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_update_replaces_image(self):
+        self.create(self.png((20, 20)))
+        post = Post.objects.get()
+        response = self.client.patch(
+            f'/api/posts/{post.slug}/',
+            {'image': SimpleUploadedFile('new.gif', b'GIF89a' + b'\x00' * 20, content_type='image/gif')},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        post.refresh_from_db()
+        self.assertTrue(post.image.name.endswith('.gif'))
+
+    def test_other_users_upload_is_discarded(self):
+        self.create(self.png((20, 20)))
+        post = Post.objects.get()
+        self.client.force_authenticate(user=User.objects.create_user(username='other', password='otherpass123'))
+        response = self.client.patch(
+            f'/api/posts/{post.slug}/',
+            {'image': SimpleUploadedFile('evil.png', self.png((20, 20)), content_type='image/png')},
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.stored_files(), [post.image.name])
+
+
+class AzureBlockWriterTestCase(TestCase):
+    """The Azure writer against a mocked blob service, for a private container."""
+
+    def setUp(self):
+        from storages.backends.azure_storage import AzureStorage
+
+        self.storage = AzureStorage(
+            account_name='konto', account_key=base64.b64encode(b'klucz').decode('ascii'), azure_container='media',
+        )
+        self.blobs = {}
+        client = mock.Mock()
+        client.get_blob_client.side_effect = self.blob
+        self.enterContext(mock.patch.object(AzureStorage, 'client', new_callable=mock.PropertyMock, return_value=client))
+
+    def blob(self, name):
+        if name not in self.blobs:
+            self.blobs[name] = mock.Mock(blob_name=name, url=f'https://konto.blob.core.windows.net/media/{name}')
+        return self.blobs[name]
+
+    def test_copy_source_carries_a_read_sas(self):
+        writer = AzureBlockWriter(self.storage, 'post/.uploads/abc.part')
+        writer.write(b'\x89PNG\r\n\x1a\n' + b'0' * 100)
+        self.assertEqual(writer.commit('post/ab/abcd.png'), 'post/ab/abcd.png')
+
+        staging, target = self.blobs['post/.uploads/abc.part'], self.blobs['post/ab/abcd.png']
+        staging.stage_block.assert_called_once()
+        staging.commit_block_list.assert_called_once()
+        self.assertEqual(staging.commit_block_list.call_args.kwargs['content_settings'].content_type, 'image/png')
+        source = target.start_copy_from_url.call_args.args[0]
+        self.assertTrue(source.startswith(f'{staging.url}?'))
+        query = dict(pair.split('=', 1) for pair in source.partition('?')[2].split('&'))
+        self.assertEqual(query['sp'], 'r')
+        self.assertIn('sig', query)
+        staging.delete_blob.assert_called_once()
+
+    def test_failed_copy_still_deletes_the_staging_blob(self):
+        writer = AzureBlockWriter(self.storage, 'post/.uploads/abc.part')
+        writer.write(b'GIF89a')
+        self.blob('post/ab/abcd.gif').start_copy_from_url.side_effect = RuntimeError('403')
+        with self.assertRaises(RuntimeError):
+            writer.commit('post/ab/abcd.gif')
+        self.blobs['post/.uploads/abc.part'].delete_blob.assert_called_once()
+
+
+class ContentAddressedMediaTestCase(APITestCase):
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        storage = self.settings(STORAGES=local_storage_settings(self.media.name), MEDIA_URL='/media/')
+        storage.enable()
+        self.addCleanup(storage.disable)
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.category = Category.objects.create(name='Technology')
+        self.client.force_authenticate(user=self.user)
+        buffer = BytesIO()
+        Image.new('RGB', (40, 40), 'blue').save(buffer, 'PNG')
+        self.meme = buffer.getvalue()
+
+    def create(self, content=None, name='meme.png'):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/posts/', {
+                'title': 'Meme', 'content': 'Content', 'category': self.category.name,
+                'image': SimpleUploadedFile(name, content or self.meme, content_type='image/png'),
+            })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        return Post.objects.get(id=response.data['id'])
+
+    def gc(self, *args):
+        out = StringIO()
+        call_command('gc_media', '--grace', '0', *args, stdout=out)
+        return out.getvalue()
+
+    def test_duplicate_upload_skips_the_storage_write(self):
+        first = self.create()
+        with mock.patch.object(FileSystemWriter, 'commit') as commit:
+            second = self.create(name='repost.png')
+        commit.assert_not_called()
+        self.assertEqual(second.image.name, first.image.name)
+        blob = MediaBlob.objects.get()
+        self.assertEqual((blob.name, blob.ref_count, blob.size), (first.image.name, 2, len(self.meme)))
+        # Variants are shared too.
+        self.assertEqual(second.image_variants, first.image_variants)
+        self.assertFalse(os.listdir(os.path.join(self.media.name, 'post', '.uploads')))
+
+    def test_reference_counting(self):
+        first = self.create()
+        second = self.create()
+        first.delete()
+        self.assertEqual(MediaBlob.objects.get().ref_count, 1)
+
+        second.image = 'post/other.png'
+        second.save()
+        self.assertEqual(MediaBlob.objects.get().ref_count, 0)
+
+        self.user.delete()
+        self.assertEqual(MediaBlob.objects.get().ref_count, 0)
+
+    def test_update_moves_the_reference(self):
+        post = self.create()
+        old = post.image.name
+        response = self.client.patch(f'/api/posts/{post.slug}/', {
+            'image': SimpleUploadedFile('new.gif', b'GIF89a' + b'\x00' * 20, content_type='image/gif')
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(MediaBlob.objects.get(name=old).ref_count, 0)
+        self.assertEqual(MediaBlob.objects.exclude(name=old).get().ref_count, 1)
+
+    def test_gc_removes_unreferenced_blobs_and_their_variants(self):
+        kept = self.create()
+        dropped_files = []
+        for color in ['green', 'yellow']:
+            dropped = self.create(self.png_bytes(color))
+            dropped_files += [dropped.image.name, *dropped.image_variants['sizes'].values()]
+            dropped.delete()
+        storage = kept.image.storage
+
+        self.assertIn('Would delete 2 unreferenced blob(s)', self.gc('--dry-run'))
+        self.assertTrue(all(storage.exists(name) for name in dropped_files))
+
+        with mock.patch.object(FileSystemStorage, 'listdir', autospec=True, side_effect=FileSystemStorage.listdir) as listdir:
+            self.assertIn('Deleted 2 unreferenced blob(s)', self.gc())
+        # One listing of the variants for the whole run.
+        self.assertEqual([call.args[1] for call in listdir.call_args_list].count('post/variants/'), 1)
+        self.assertFalse(any(storage.exists(name) for name in dropped_files))
+        self.assertTrue(storage.exists(kept.image.name))
+        self.assertEqual(list(MediaBlob.objects.values_list('name', flat=True)), [kept.image.name])
+
+    def test_gc_respects_grace_period_and_repairs_counters(self):
+        post = self.create()
+        self.create(self.png_bytes('green')).delete()
+        MediaBlob.objects.filter(name=post.image.name).update(ref_count=0)
+
+        out = StringIO()
+        call_command('gc_media', stdout=out)
+        self.assertIn('Deleted 0 unreferenced blob(s)', out.getvalue())
+
+        self.assertIn('Deleted 1 unreferenced blob(s)', self.gc())
+        self.assertTrue(post.image.storage.exists(post.image.name))
+        self.assertEqual(MediaBlob.objects.get().ref_count, 1)
+
+    def png_bytes(self, color):
+        buffer = BytesIO()
+        Image.new('RGB', (40, 40), color).save(buffer, 'PNG')
+        return buffer.getvalue()
+
+
+class MediaURLTestCase(TestCase):
+
+    class FakeClock:
+        now = 0.0
+
+        def __call__(self):
+            return self.now
+
+    class CountingStorage:
+        def __init__(self):
+            self.calls = 0
+
+        def url(self, name):
+            self.calls += 1
+            return f'https://example.blob.core.windows.net/media/{name}?sig={self.calls}'
+
+    def test_public_urls_match_the_storage_backend(self):
+        storage = FileSystemStorage(location='/nonexistent', base_url='/media/')
+        resolver = PublicURLs('/media/')
+        for name in ['post/ab/abcdef.jpg', 'post/zdjęcie kota.png', 'post/a&b#1?.webp', 'post/(1)!.gif']:
+            self.assertEqual(resolver.url(name), storage.url(name))
+        self.assertEqual(PublicURLs('https://cdn.example.com/media').url('post/x.jpg'), 'https://cdn.example.com/media/post/x.jpg')
+
+    def test_serializer_uses_the_configured_cdn(self):
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        post = Post.objects.create(
+            user=user, title='T', content='C', category=Category.objects.create(name='Tech'),
+            image='post/ab/abc.jpg', image_variants={'source': 'post/ab/abc.jpg', 'sizes': {'thumb': 'post/variants/abc-thumb.webp'}},
+        )
+        with self.settings(MEDIA_CDN_URL='https://cdn.example.com/media/'):
+            image = PostSerializer(post).data['image']
+        self.assertEqual(image['original'], 'https://cdn.example.com/media/post/ab/abc.jpg')
+        self.assertEqual(image['thumbnail'], 'https://cdn.example.com/media/post/variants/abc-thumb.webp')
+
+    def test_signed_urls_are_reused_until_close_to_expiry(self):
+        clock, storage = self.FakeClock(), self.CountingStorage()
+        resolver = SignedURLCache(storage, ttl=600, margin=60, clock=clock)
+        first = resolver.url('post/a.jpg')
+        clock.now = 539
+        self.assertEqual(resolver.url('post/a.jpg'), first)
+        self.assertEqual(storage.calls, 1)
+        clock.now = 540
+        self.assertNotEqual(resolver.url('post/a.jpg'), first)
+        self.assertEqual(storage.calls, 2)
+
+    @override_settings(MEDIA_URL_SIGNING_TTL=3600, API_CACHE_TIMEOUT=300)
+    def test_signed_urls_outlive_cached_responses(self):
+        clock, storage = self.FakeClock(), self.CountingStorage()
+        signed_at = {}
+
+        def sign(name):
+            url = self.CountingStorage.url(storage, name)
+            signed_at[url] = clock.now
+            return url
+
+        storage.url = sign
+        resolver = get_resolver()
+        resolver.clock, resolver.storage = clock, storage
+        for now in range(0, 3 * 3600, 50):
+            clock.now = now
+            url = resolver.url('post/a.jpg')
+            # A response cached now serves this URL for API_CACHE_TIMEOUT more,
+            # and its last client still needs a minute to fetch the image.
+            self.assertGreaterEqual(signed_at[url] + 3600, now + 300 + 60, now)
+        self.assertEqual(storage.calls, 4)
+
+    @override_settings(MEDIA_URL_SIGNING_TTL=300, API_CACHE_TIMEOUT=300)
+    def test_signing_ttl_must_outlast_the_response_cache(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_resolver()
+
+    def test_signed_url_cache_is_bounded(self):
+        clock, storage = self.FakeClock(), self.CountingStorage()
+        resolver = SignedURLCache(storage, ttl=600, margin=60, max_entries=2, clock=clock)
+        resolver.url('old')
+        clock.now = 100
+        resolver.url('a')
+        resolver.url('old')  # recently used again
+        resolver.url('b')
+        self.assertEqual(list(resolver.entries), ['old', 'b'])
+
+        clock.now = 590  # 'old' (signed at 0) is about to expire, 'b' is not
+        resolver.url('c')
+        self.assertEqual(list(resolver.entries), ['b', 'c'])
+
+    def test_override_resolver(self):
+        storage = self.CountingStorage()
+        with override_resolver(StorageURLs(storage)):
+            self.assertEqual(media_url('post/a.jpg'), 'https://example.blob.core.windows.net/media/post/a.jpg?sig=1')
+        self.assertNotIsInstance(get_resolver(), StorageURLs)
+
+    def test_benchmark_serialization_reports_json(self):
+        out = StringIO()
+        call_command('benchmark_serialization', '--rows', '20', '--repeat', '2', stdout=out, stderr=StringIO())
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['meta']['urls_per_run'], 100)
+        self.assertTrue(report['identical_output'])
+        self.assertIsNotNone(report['results']['after']['p95_ms'])
+
+
 class IntegrationTestCase(APITestCase):
 
 
@@ -483,3 +1876,619 @@ class EdgeCaseTestCase(APITestCase):
         }
         response = self.client.post('/api/posts/', post_data)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ReplicaRouterTestCase(TransactionTestCase):
+    """Two SQLite databases that never replicate, so every response shows where it was read from."""
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        use_shared_cache(self)
+        # Per test rather than per class: the flush after each test has to see
+        # the replica's tables, which the router hides from migrate and flush.
+        self.enterContext(self.settings(DATABASE_REPLICAS=['replica'], DATABASE_ROUTERS=['api.db_router.ReplicaRouter']))
+        self.users = {name: User.objects.create_user(username=name, password='pass12345') for name in ['writer', 'reader']}
+        User.objects.using('replica').bulk_create(self.users.values())
+        for db in ['default', 'replica']:
+            Category.objects.using(db).create(name=f'Na {db}')
+        self.client = APIClient()
+
+    def authenticate(self, name):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.users[name]).access_token}')
+
+    def categories(self, url='/api/categories/'):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(category['name'] for category in response.json())
+
+    def test_reads_go_to_the_replica(self):
+        self.assertEqual(self.categories(), ['Na replica'])
+        self.authenticate('reader')
+        self.assertEqual(self.categories(), ['Na replica'])
+        self.assertEqual(self.categories('/api/async/categories/'), ['Na replica'])
+
+    def test_writes_go_to_the_primary(self):
+        self.authenticate('writer')
+        response = self.client.post('/api/categories/', {'name': 'Nowa'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(Category.objects.using('default').filter(name='Nowa').exists())
+        self.assertFalse(Category.objects.using('replica').filter(name='Nowa').exists())
+
+    def test_writer_is_pinned_to_the_primary(self):
+        self.authenticate('writer')
+        self.client.post('/api/categories/', {'name': 'Nowa'})
+        self.assertEqual(self.categories(), ['Na default', 'Nowa'])
+        self.assertEqual(self.categories('/api/async/categories/'), ['Na default', 'Nowa'])
+
+        # Only the user who wrote reads from the primary.
+        self.authenticate('reader')
+        self.assertEqual(self.categories(), ['Na replica'])
+
+        # Once the pin expires, so does the stickiness.
+        caches['api'].delete(pin_cache_key(self.users['writer'].id))
+        self.authenticate('writer')
+        self.assertEqual(self.categories(), ['Na replica'])
+
+    def test_pin_reaches_other_workers(self):
+        self.authenticate('writer')
+        self.client.post('/api/categories/', {'name': 'Nowa'})
+        # Another worker process: its own cache instance on the same backend.
+        other = caches.create_connection('api')
+        self.assertTrue(other.get(pin_cache_key(self.users['writer'].id)))
+        with mock.patch('api.db_router.get_cache', return_value=other), \
+                mock.patch('api.authentication.get_cache', return_value=other):
+            self.assertEqual(self.categories(), ['Na default', 'Nowa'])
+
+    def test_per_process_cache_disables_the_replicas(self):
+        with self.settings(CACHES=api_cache_settings()):
+            self.assertEqual(self.categories(), ['Na default'])
+
+    def test_pin_lasts_replica_pin_seconds(self):
+        self.authenticate('writer')
+        with mock.patch.object(caches['api'], 'set', wraps=caches['api'].set) as cache_set:
+            self.client.post('/api/categories/', {'name': 'Nowa'})
+        cache_set.assert_any_call(pin_cache_key(self.users['writer'].id), True, 10)
+
+    def test_reads_outside_requests_and_in_transactions_use_the_primary(self):
+        self.assertEqual(Category.objects.all().db, 'default')
+        self.authenticate('reader')
+        with transaction.atomic():
+            self.assertEqual(self.categories(), ['Na default'])
+
+
+class CommentBufferTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.posts = [Post.objects.create(title=f'Post {i}', content='Treść', user=self.user) for i in range(2)]
+        self.client.force_authenticate(user=self.user)
+        self.addCleanup(comment_buffer.shutdown)
+
+    def buffered(self, size, durability, window=None):
+        return self.settings(
+            COMMENT_WRITE_MODE='buffered', COMMENT_BUFFER_SIZE=size,
+            COMMENT_BUFFER_WINDOW=window, COMMENT_BUFFER_DURABILITY=durability,
+        )
+
+    def comment(self, post, content='Komentarz'):
+        return self.client.post(f'/api/posts/{post.id}/comments/', {'content': content, 'post': post.id})
+
+    def test_commit_mode_answers_like_direct_mode(self):
+        with self.buffered(1, 'commit'):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.comment(self.posts[0])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        comment = Comment.objects.get()
+        self.assertEqual(response.data, CommentSerializer(comment).data)
+        self.posts[0].refresh_from_db()
+        self.assertEqual(self.posts[0].comment_count, 1)
+
+    def test_flushes_one_batch_when_full(self):
+        with self.buffered(3, 'enqueue'):
+            for post in [self.posts[0], self.posts[1]]:
+                response = self.comment(post)
+                self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+                self.assertIsNone(response.data['id'])
+            self.assertFalse(Comment.objects.exists())
+            with mock.patch('api.comment_buffer.bump_on_commit') as bump, \
+                    CaptureQueriesContext(connection) as queries:
+                self.comment(self.posts[0])
+        self.assertEqual(Comment.objects.count(), 3)
+        writes = [q['sql'] for q in queries if q['sql'].startswith(('INSERT', 'UPDATE'))]
+        self.assertEqual(len(writes), 2, writes)
+        counts = dict(Post.objects.values_list('id', 'comment_count'))
+        self.assertEqual(counts, {self.posts[0].id: 2, self.posts[1].id: 1})
+        bump.assert_called_once_with(
+            'posts', f'comments:{self.posts[0].id}', f'comments:{self.posts[1].id}',
+            f'post:{self.posts[0].slug}', f'post:{self.posts[1].slug}',
+        )
+
+    def test_shutdown_flushes_queued_comments(self):
+        with self.buffered(50, 'enqueue'):
+            self.comment(self.posts[0])
+            self.comment(self.posts[1])
+            self.assertEqual(comment_buffer.shutdown(), 2)
+        self.assertEqual(Comment.objects.count(), 2)
+
+    def test_invalid_comment_is_rejected_before_queueing(self):
+        with self.buffered(1, 'commit'):
+            response = self.comment(self.posts[0], content='')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(comment_buffer.get_buffer().pending, [])
+            response = self.client.post('/api/posts/999/comments/', {'content': 'x', 'post': self.posts[0].id})
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_commit_mode_without_a_window_writes_right_away(self):
+        with self.buffered(50, 'commit', window=0):
+            response = self.comment(self.posts[0])
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertIsNone(comment_buffer.get_buffer().thread)
+        self.assertEqual(response.data['id'], Comment.objects.get().id)
+
+    def test_timed_out_comment_is_withdrawn(self):
+        with self.buffered(50, 'commit', window=60), \
+                mock.patch.object(comment_buffer.CommentBuffer, 'start'), \
+                mock.patch.object(comment_buffer, 'COMMIT_TIMEOUT', 0.01):
+            response = self.comment(self.posts[0])
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(comment_buffer.get_buffer().pending, [])
+
+            # Already being written: accepted, and written once.
+            with mock.patch.object(comment_buffer.CommentBuffer, 'withdraw', return_value=False):
+                response = self.comment(self.posts[0])
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            self.assertEqual(comment_buffer.get_buffer().flush(), 1)
+        self.assertEqual(Comment.objects.count(), 1)
+
+    def test_comments_of_a_deleted_post_are_dropped(self):
+        with self.buffered(50, 'enqueue'):
+            self.comment(self.posts[0])
+            self.comment(self.posts[1])
+            self.posts[1].delete()
+            comment_buffer.get_buffer().flush()
+        self.assertEqual(list(Comment.objects.values_list('post_id', flat=True)), [self.posts[0].id])
+
+
+class CommentBufferWindowTestCase(TransactionTestCase):
+
+    def test_background_flush_after_the_window(self):
+        use_shared_cache(self)
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        post = Post.objects.create(title='Post', content='Treść', user=user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+        with self.settings(COMMENT_WRITE_MODE='buffered', COMMENT_BUFFER_SIZE=100,
+                           COMMENT_BUFFER_WINDOW=0.01, COMMENT_BUFFER_DURABILITY='commit',
+                           DATABASE_ROUTERS=['api.db_router.ReplicaRouter']), \
+                mock.patch.object(ReplicaRouter, 'db_for_write', return_value='default'):
+            response = client.post(f'/api/posts/{post.id}/comments/', {'content': 'Komentarz', 'post': post.id})
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(response.data['id'], Comment.objects.get().id)
+            self.assertIsNotNone(comment_buffer.get_buffer().thread)
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        # Written by the buffer's thread (no db_for_write in the request), yet
+        # the commenter reads from the primary next.
+        self.assertTrue(caches['api'].get(pin_cache_key(user.id)))
+
+
+class ViewCountTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.post = Post.objects.create(title='Popularny post', content='Treść', user=self.user)
+        view_counts.shutdown()
+        self.addCleanup(view_counts.shutdown)
+
+    def test_views_are_written_in_one_batch(self):
+        other = Post.objects.create(title='Drugi', content='Treść', user=self.user)
+        for url in [f'/api/posts/{self.post.slug}/'] * 3 + [f'/api/posts/{other.slug}/', f'/api/async/posts/{self.post.slug}/']:
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.view_count, 0)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(view_counts.get_counter().flush(), 5)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(dict(Post.objects.values_list('slug', 'view_count')), {self.post.slug: 4, other.slug: 1})
+        self.assertEqual(self.client.get(f'/api/posts/{self.post.slug}/').data['view_count'], 4)
+
+    def test_only_successful_gets_count(self):
+        etag = self.client.get(f'/api/posts/{self.post.slug}/')['ETag']
+        self.assertEqual(self.client.get(f'/api/posts/{self.post.slug}/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.client.head(f'/api/posts/{self.post.slug}/')
+        self.client.get('/api/posts/missing/')
+        self.assertEqual(view_counts.get_counter().flush(), 2)
+
+    def test_disabled(self):
+        with self.settings(VIEW_COUNTS_ENABLED=False):
+            self.client.get(f'/api/posts/{self.post.slug}/')
+        self.assertEqual(view_counts.get_counter().flush(), 0)
+
+    def test_sharded_counter_under_threads(self):
+        counter = view_counts.ShardedCounter(shards=4)
+
+        def count():
+            for _ in range(1000):
+                counter.add('a')
+                counter.add('b', 2)
+
+        threads = [threading.Thread(target=count) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        drained = [counter.drain()[0]]
+        for thread in threads:
+            thread.join()
+        drained.append(counter.drain()[0])
+        self.assertEqual(sum(drained, Counter()), Counter({'a': 8000, 'b': 16000}))
+
+    def test_threads_spread_over_the_shards(self):
+        counter = view_counts.ShardedCounter(shards=4)
+        threads = [threading.Thread(target=counter.add, args=('a',)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+        self.assertEqual([shard.counts['a'] for shard in counter.shards], [2, 2, 2, 2])
+
+    def test_failed_flush_keeps_the_counts(self):
+        with tempfile.TemporaryDirectory() as spool_dir:
+            counter = view_counts.ViewCounter(shards=2, spool_dir=spool_dir)
+            counter.hit(self.post.slug)
+            with mock.patch('api.view_counts.Post.objects.filter', side_effect=DatabaseError):
+                with self.assertRaises(DatabaseError):
+                    counter.flush()
+            counter.hit(self.post.slug)
+            self.assertEqual(counter.flush(), 2)
+            self.assertEqual(os.listdir(spool_dir), [name for name in os.listdir(spool_dir) if name.endswith('.log')])
+            counter.shutdown()
+            self.assertEqual(os.listdir(spool_dir), [])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.view_count, 2)
+
+    def test_spool_of_a_dead_process_is_recovered(self):
+        with tempfile.TemporaryDirectory() as spool_dir:
+            crashed = view_counts.ViewCounter(shards=2, spool_dir=spool_dir)
+            for _ in range(3):
+                crashed.hit(self.post.slug)
+            crashed.counter.drain()
+            crashed.hit(self.post.slug)
+            # Pretend the process that wrote these files died without flushing.
+            dead = next(pid for pid in range(2 ** 22, 2 ** 22 + 1000) if not view_counts._alive(pid))
+            for name in os.listdir(spool_dir):
+                os.rename(os.path.join(spool_dir, name), os.path.join(spool_dir, name.replace(f'-{os.getpid()}-', f'-{dead}-')))
+            with open(os.path.join(spool_dir, f'views-{dead}-9.log'), 'w') as handle:
+                handle.write(f'{self.post.slug}\t1\n{self.post.slug}')
+
+            view_counts.ViewCounter(shards=2, spool_dir=spool_dir).shutdown()
+            self.assertEqual(os.listdir(spool_dir), [])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.view_count, 5)
+
+    def test_spool_files_of_other_owners_are_left_alone(self):
+        with tempfile.TemporaryDirectory() as spool_dir:
+            # A live counter: a process that got a dead one's pid looks like this.
+            alive = view_counts.ViewCounter(shards=1, spool_dir=spool_dir)
+            alive.hit(self.post.slug)
+            dead = next(pid for pid in range(2 ** 22, 2 ** 22 + 1000) if not view_counts._alive(pid))
+            remote = os.path.join(spool_dir, f'views-{"0" * 12}-{dead}-{"0" * 8}-0.log')
+            with open(remote, 'w') as handle:
+                handle.write(f'{self.post.slug}\t1\n')
+
+            other = view_counts.ViewCounter(shards=1, spool_dir=spool_dir)
+            other.hit(self.post.slug)
+            self.assertEqual(other.shutdown(), 1)
+            self.assertEqual(sorted(os.listdir(spool_dir)), sorted([
+                os.path.basename(remote), f'{alive.counter.owner}-0.log',
+            ]))
+            self.assertEqual(alive.shutdown(), 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.view_count, 2)
+
+
+class HotFeedTestCase(APITestCase):
+    HOUR = 3600
+    START = 1_800_000_000
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.category = Category.objects.create(name='Technology')
+        self.client.force_authenticate(user=self.user)
+        hot.forget_epoch()
+        self.addCleanup(hot.forget_epoch)
+        self.clock = self.START
+        for target, now in [('api.hot.time.time', lambda: self.clock),
+                            ('django.utils.timezone.now', lambda: datetime.fromtimestamp(self.clock, dt_timezone.utc))]:
+            patcher = mock.patch(target, side_effect=now)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.events = {}
+
+    def post(self, title, hours, category=None):
+        self.clock = self.START + hours * self.HOUR
+        post = Post.objects.create(title=title, content='Treść', user=self.user, category=category)
+        self.events[post.id] = [self.clock]
+        return post
+
+    def comment(self, post, hours):
+        self.clock = self.START + hours * self.HOUR
+        Comment.objects.create(post=post, user=self.user, content='Komentarz')
+        self.events[post.id].append(self.clock)
+
+    def expected(self, now, ids=None):
+        """Brute force: every event decayed to `now`."""
+        def decayed(post_id):
+            return sum(2 ** ((at - now) / (12 * self.HOUR)) for at in self.events[post_id])
+        return sorted(ids or self.events, key=lambda post_id: (-decayed(post_id), -post_id))
+
+    def feed(self, url='/api/posts/?ordering=hot&page_size=100'):
+        return [row['id'] for row in self.client.get(url).data['results']]
+
+    def build(self):
+        old = self.post('Stary, ale gorący', 0)
+        for hours in [1, 2, 3, 4]:
+            self.comment(old, hours)
+        fresh = self.post('Świeży', 20, category=self.category)
+        quiet = self.post('Cichy', 10, category=self.category)
+        self.comment(quiet, 21)
+        return old, fresh, quiet
+
+    def test_feed_ranks_by_decayed_activity(self):
+        self.build()
+        self.assertEqual(self.feed(), self.expected(self.clock))
+        # The default feed is still newest first.
+        self.assertEqual(self.feed('/api/posts/?page_size=100'), sorted(self.events, key=lambda pk: -self.events[pk][0]))
+
+    def test_comments_update_the_score_without_extra_queries(self):
+        old, fresh, quiet = self.build()
+        self.clock += self.HOUR
+        with CaptureQueriesContext(connection) as queries:
+            Comment.objects.create(post=fresh, user=self.user, content='Komentarz')
+        self.events[fresh.id].append(self.clock)
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('UPDATE')]), 1)
+        self.assertEqual(self.feed(), self.expected(self.clock))
+
+    def test_buffered_comments_update_the_score(self):
+        old, fresh, quiet = self.build()
+        self.clock += self.HOUR
+        with self.settings(COMMENT_WRITE_MODE='buffered', COMMENT_BUFFER_SIZE=3,
+                           COMMENT_BUFFER_WINDOW=None, COMMENT_BUFFER_DURABILITY='commit'):
+            self.addCleanup(comment_buffer.shutdown)
+            for post in [quiet, quiet, fresh]:
+                comment_buffer.get_buffer().add(
+                    Comment(post=post, user=self.user, content='Komentarz'))
+                self.events[post.id].append(self.clock)
+        self.assertEqual(self.feed(), self.expected(self.clock))
+
+    def test_deleted_comments_stop_counting(self):
+        old, fresh, quiet = self.build()
+        spammer = User.objects.create_user(username='spammer', password='testpass123')
+        self.clock = self.START + 22 * self.HOUR
+        for _ in range(5):
+            Comment.objects.create(post=quiet, user=spammer, content='Spam')
+        self.clock = self.START + 23 * self.HOUR
+        self.assertEqual(self.feed()[0], quiet.id)
+
+        # One by one, and in the cascade of a deleted user.
+        Comment.objects.filter(post=old).order_by('created_at').first().delete()
+        self.events[old.id].pop(1)
+        spammer.delete()
+        self.assertEqual(self.feed(), self.expected(self.clock))
+        counts = dict(Post.objects.values_list('id', 'comment_count'))
+        self.assertEqual(counts, {old.id: 3, fresh.id: 0, quiet.id: 1})
+
+    def test_rebase_keeps_the_order_and_shrinks_the_scores(self):
+        self.build()
+        before = self.feed()
+        largest = Post.objects.order_by('-hot_score').values_list('hot_score', flat=True).first()
+        self.clock = self.START + 100 * self.HOUR
+        self.assertEqual(hot.rebase(), 3)
+        self.assertEqual(set(Post.objects.values_list('hot_epoch', flat=True)), {self.clock})
+        self.assertLess(Post.objects.order_by('-hot_score').values_list('hot_score', flat=True).first(), largest / 100)
+        self.assertEqual(self.feed(), before)
+
+    def test_comment_with_a_stale_epoch_lands_on_the_rebased_score(self):
+        old, fresh, quiet = self.build()
+        stale = hot.current_epoch()
+        self.clock = self.START + 30 * self.HOUR
+        hot.rebase()
+        # Another process rebased; this one still has the old epoch cached.
+        hot._epoch.update(value=stale)
+        self.comment(fresh, 31)
+        self.assertEqual(hot.current_epoch(), self.START + 30 * self.HOUR)
+        self.assertEqual(self.feed(), self.expected(self.clock))
+        self.assertEqual(Comment.objects.filter(post=fresh).count(), Post.objects.get(pk=fresh.pk).comment_count)
+
+    def test_post_that_missed_a_rebase_sinks(self):
+        old, fresh, quiet = self.build()
+        stale = hot.current_epoch()
+        self.clock = self.START + 30 * self.HOUR
+        hot.rebase()
+        hot._epoch.update(value=stale)
+        late = self.post('Spóźniony', 30)
+        self.assertEqual(self.feed()[-1], late.id)
+        self.assertEqual(hot.sweep(self.clock), 1)
+        self.assertEqual(self.feed(), self.expected(self.clock))
+
+    def test_command_sweeps_posts_created_during_the_rebase(self):
+        old, fresh, quiet = self.build()
+        stale = hot.current_epoch()
+        self.clock = self.START + 30 * self.HOUR
+
+        def meanwhile(seconds):
+            # Another process, with the epoch from before the rebase cached.
+            self.assertEqual(seconds, 65)
+            hot._epoch.update(value=stale)
+            self.post('Spóźniony', 30)
+
+        out = StringIO()
+        with mock.patch('api.management.commands.rebase_hot_scores.time.sleep', side_effect=meanwhile):
+            call_command('rebase_hot_scores', stdout=out)
+        self.assertIn('Moved 1 post(s) created during the rebase.', out.getvalue())
+        self.assertEqual(set(Post.objects.values_list('hot_epoch', flat=True)), {self.clock})
+        self.assertEqual(self.feed(), self.expected(self.clock))
+
+    def test_recompute_matches_the_incremental_scores(self):
+        self.build()
+        incremental = self.feed()
+        self.clock += 5 * self.HOUR
+        self.assertEqual(hot.recompute(), 3)
+        self.assertEqual(self.feed(), incremental)
+        with mock.patch('api.management.commands.rebase_hot_scores.time.sleep'):
+            call_command('rebase_hot_scores', stdout=StringIO())
+        self.assertEqual(self.feed(), incremental)
+
+    def test_keyset_pages_and_other_endpoints(self):
+        old, fresh, quiet = self.build()
+        for hours in range(5):
+            self.post(f'Post {hours}', 22 + hours)
+        pages, url = [], '/api/posts/?ordering=hot&page_size=2'
+        while url:
+            data = self.client.get(url).data
+            pages.extend(row['id'] for row in data['results'])
+            url = data['next']
+        self.assertEqual(pages, self.expected(self.clock))
+        category_feed = self.expected(self.clock, [fresh.id, quiet.id])
+        self.assertEqual(self.feed('/api/posts/category/Technology/?ordering=hot'), category_feed)
+        self.assertEqual(self.feed('/api/async/posts/category/Technology/?ordering=hot'), category_feed)
+        self.assertEqual(self.feed('/api/async/posts/?ordering=hot&page_size=100'), self.expected(self.clock))
+
+
+class TaskQueueTestCase(APITestCase):
+
+    def setUp(self):
+        registry = mock.patch.dict(tasks._registry)
+        registry.start()
+        self.addCleanup(registry.stop)
+        self.calls = []
+        self.failures = 0
+
+        @tasks.task('tests.record', max_attempts=3)
+        def record(value, suffix=''):
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError('storage unavailable')
+            self.calls.append(f'{value}{suffix}')
+
+        self.record = record
+
+    def run_due(self):
+        return [tasks.execute(task) for task in tasks.claim(10)]
+
+    def test_eager_mode_runs_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            task = self.record.enqueue('a', suffix='!')
+            self.assertEqual(self.calls, [])
+        self.assertEqual(self.calls, ['a!'])
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts, task.last_error), (Task.DONE, 1, ''))
+        self.assertIsNotNone(task.finished_at)
+
+    def test_idempotency_key(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.record.enqueue('a', key='once')
+            second = self.record.enqueue('b', key='once')
+        self.assertEqual(first.pk, second.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.record.enqueue('c', key='once')
+        self.assertEqual(self.calls, ['a'])
+        self.assertEqual(Task.objects.count(), 1)
+
+        # A failed task's key can be queued again.
+        Task.objects.update(status=Task.FAILED, attempts=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.record.enqueue('d', key='once')
+        self.assertEqual(self.calls, ['a', 'd'])
+        self.assertEqual(Task.objects.get().attempts, 1)
+
+    @override_settings(TASKS_EAGER=False, TASKS_RETRY_DELAY=10, TASKS_RETRY_MAX_DELAY=15)
+    def test_retries_with_backoff_then_fails(self):
+        self.failures = 3
+        task = self.record.enqueue('a')
+        self.assertEqual(self.calls, [])
+        delays = []
+        for attempt in range(1, 4):
+            started = timezone.now()
+            with self.assertLogs('api.tasks', 'ERROR'):
+                self.assertEqual(self.run_due(), [False])
+            task.refresh_from_db()
+            self.assertEqual((task.attempts, task.last_error), (attempt, 'ConnectionError: storage unavailable'))
+            if task.status == Task.QUEUED:
+                delays.append((task.run_at - started).total_seconds())
+                # Not due before its backoff has passed.
+                self.assertEqual(self.run_due(), [])
+                Task.objects.update(run_at=timezone.now())
+        self.assertEqual(task.status, Task.FAILED)
+        self.assertTrue(5 <= delays[0] <= 10.5, delays)
+        self.assertTrue(7.5 <= delays[1] <= 15.5, delays)
+        self.assertEqual(self.calls, [])
+
+        self.assertEqual(tasks.purge(hours=1), 0)
+        self.assertEqual(tasks.purge(hours=0), 1)
+
+    @override_settings(TASKS_EAGER=False)
+    def test_expired_lease_is_taken_over(self):
+        self.record.enqueue('a')
+        [stale] = tasks.claim(10)
+        self.assertEqual(tasks.claim(10), [])
+        Task.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        [current] = tasks.claim(10)
+        self.assertEqual((current.pk, current.attempts), (stale.pk, 2))
+
+        # The first worker finishing late does not overwrite the second one's claim.
+        self.failures = 1
+        with self.assertLogs('api.tasks', 'ERROR'):
+            self.assertFalse(tasks.execute(stale))
+        self.assertEqual(Task.objects.get().status, Task.RUNNING)
+        self.assertTrue(tasks.execute(current))
+        self.assertEqual(Task.objects.get().status, Task.DONE)
+
+    @override_settings(TASKS_EAGER=False)
+    def test_task_that_outlives_its_last_lease_fails(self):
+        self.record.enqueue('a')
+        for attempt in range(3):
+            self.assertEqual(len(tasks.claim(10)), 1)
+            # The worker died without recording anything.
+            Task.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(tasks.claim(10), [])
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.attempts), (Task.FAILED, 3))
+        self.assertIn('Lease expired', task.last_error)
+        self.assertEqual(self.calls, [])
+
+    def test_unknown_task(self):
+        with self.assertRaises(LookupError):
+            tasks.enqueue('tests.missing')
+        Task.objects.create(name='tests.renamed', max_attempts=1)
+        with override_settings(TASKS_EAGER=False), self.assertLogs('api.tasks', 'ERROR'):
+            self.assertEqual(self.run_due(), [False])
+        self.assertEqual(Task.objects.get().last_error, "LookupError: Unknown task 'tests.renamed'.")
+
+
+@override_settings(TASKS_EAGER=False)
+class TaskWorkerTestCase(TransactionTestCase):
+
+    def test_run_tasks_command(self):
+        seen = []
+        registry = mock.patch.dict(tasks._registry)
+        registry.start()
+        self.addCleanup(registry.stop)
+
+        @tasks.task('tests.worker', max_attempts=1)
+        def work(value):
+            if value == 'bad':
+                raise ValueError(value)
+            seen.append((value, threading.current_thread().name))
+
+        for value in ['a', 'b', 'c', 'bad']:
+            work.enqueue(value)
+        work.enqueue('later', delay=3600)
+        out = StringIO()
+        with self.assertLogs('api.tasks', 'ERROR'):
+            call_command('run_tasks', '--once', '--workers', '2', stdout=out)
+        self.assertIn('Ran 4 task(s), 1 failed.', out.getvalue())
+        self.assertEqual(sorted(value for value, _ in seen), ['a', 'b', 'c'])
+        self.assertTrue(all(name.startswith('task-worker') for _, name in seen))
+        self.assertEqual(
+            Counter(Task.objects.values_list('status', flat=True)),
+            {Task.DONE: 3, Task.FAILED: 1, Task.QUEUED: 1},
+        )
@@ -0,0 +1,77 @@
+"""
+Plain-text forms of post bodies, computed when a post is saved.
+
+Post.content is Markdown (rendered by PostContent.jsx with remark-gfm). The
+list endpoints show an excerpt, word count and reading time instead of the
+body, and the search index reads the normalized text, so none of them has to
+load or parse the content column again.
+"""
+import math
+import re
+
+from .search import normalize
+
+
+EXCERPT_LENGTH = 280
+WORDS_PER_MINUTE = 200
+
+_FENCE = re.compile(r'^\s*(```|~~~).*$', re.MULTILINE)
+_IMAGE = re.compile(r'!\[([^\]]*)\]\([^)]*\)')
+_LINK = re.compile(r'\[([^\]]+)\]\([^)]*\)')
+_REFERENCE = re.compile(r'^\s*\[[^\]]+\]:\s+\S+.*$', re.MULTILINE)
+_AUTOLINK = re.compile(r'<(https?://[^>]+)>')
+_HTML = re.compile(r'<[^>]+>')
+_LINE_MARKUP = re.compile(r'^\s*(#{1,6}\s+|>\s?|[-*+]\s+\[[ xX]\]\s+|[-*+]\s+|\d+[.)]\s+)', re.MULTILINE)
+_RULE = re.compile(r'^\s*([-*_]\s*){3,}$', re.MULTILINE)
+_TABLE_RULE = re.compile(r'^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$', re.MULTILINE)
+_EMPHASIS = re.compile(r'\*{1,3}|~~|`+|(?<!\w)_{1,3}|_{1,3}(?!\w)')
+_SPACE = re.compile(r'\s+')
+_WORD = re.compile(r'\w+')
+
+
+def plain_text(markdown):
+    """Markdown without its markup, whitespace collapsed."""
+    text = markdown or ''
+    text = _FENCE.sub('', text)
+    text = _REFERENCE.sub('', text)
+    text = _IMAGE.sub(r'\1', text)
+    text = _LINK.sub(r'\1', text)
+    text = _AUTOLINK.sub(r'\1', text)
+    text = _HTML.sub(' ', text)
+    text = _RULE.sub('', text)
+    text = _TABLE_RULE.sub('', text)
+    text = _LINE_MARKUP.sub('', text)
+    text = _EMPHASIS.sub('', text)
+    text = text.replace('|', ' ')
+    return _SPACE.sub(' ', text).strip()
+
+
+def excerpt(text, length=EXCERPT_LENGTH):
+    """The start of `text`, cut at a word boundary when it is longer than `length`."""
+    if len(text) <= length:
+        return text
+    cut = text[:length - 1]
+    if not text[length - 1].isspace() and ' ' in cut:
+        cut = cut.rsplit(' ', 1)[0]
+    return cut.rstrip(' .,;:-') + '…'
+
+
+def word_count(text):
+    return len(_WORD.findall(text))
+
+
+def reading_time(words):
+    """Minutes, rounded up; an empty post reads in no time."""
+    return math.ceil(words / WORDS_PER_MINUTE) if words else 0
+
+
+def derive(markdown):
+    """The stored columns Post.save derives from its content."""
+    text = plain_text(markdown)
+    words = word_count(text)
+    return {
+        'excerpt': excerpt(text),
+        'word_count': words,
+        'reading_time': reading_time(words),
+        'search_text': normalize(text),
+    }
@@ -0,0 +1,332 @@
+"""
+Streaming uploads of post images.
+
+The default upload handlers buffer every file in memory or a temp file and
+the storage backend then reads it all again to upload it. The handler below
+opens a writer on the target storage as soon as the `image` part starts and
+forwards each chunk to it, so an upload only ever holds one chunk (one block
+for Azure). The declared content type is checked before any byte is written,
+the magic bytes on the first chunk, and the size on every chunk.
+
+Files are content addressed: see StreamingImageUploadHandler and
+api.models.MediaBlob, and gc_media for cleaning up unreferenced ones.
+"""
+import base64
+import hashlib
+import os
+import uuid
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
+
+from .models import MediaBlob, Post
+
+
+# Magic bytes of the image formats we accept, by content type.
+SIGNATURES = {
+    'image/jpeg': [b'\xff\xd8\xff'],
+    'image/png': [b'\x89PNG\r\n\x1a\n'],
+    'image/gif': [b'GIF87a', b'GIF89a'],
+    'image/webp': [b'RIFF'],
+}
+
+EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+}
+
+# In-flight uploads live here until they are committed under their digest.
+STAGING_DIR = 'post/.uploads/'
+
+
+def sniff(head):
+    for content_type, signatures in SIGNATURES.items():
+        if any(head.startswith(signature) for signature in signatures):
+            if content_type == 'image/webp' and head[8:12] != b'WEBP':
+                continue
+            return content_type
+    return None
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Uploaded image is too large.'
+    default_code = 'upload_too_large'
+
+
+class StoredUpload(UploadedFile):
+    """An upload that already lives in storage under `storage_name`."""
+
+    def __init__(self, storage_name, size, content_type, charset=None, content_type_extra=None):
+        super().__init__(None, storage_name, content_type, size, charset, content_type_extra)
+        self.storage_name = storage_name
+
+    def close(self):
+        pass
+
+
+class FileSystemWriter:
+    """Write to a staging file, then rename it to its content name."""
+
+    def __init__(self, storage, staging_name):
+        self.storage = storage
+        self.path = storage.path(staging_name)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, 'xb')
+
+    def write(self, chunk):
+        self.file.write(chunk)
+
+    def commit(self, name):
+        self.file.close()
+        target = self.storage.path(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Same name means same content, so replacing a concurrent twin is fine.
+        os.replace(self.path, target)
+        if self.storage.file_permissions_mode is not None:
+            os.chmod(target, self.storage.file_permissions_mode)
+        return name
+
+    def abort(self):
+        self.file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class AzureBlockWriter:
+    """
+    Stage blocks of at most `block_size` bytes on a staging blob. The block
+    list is only committed for new content, then copied server side to the
+    content name; blocks that are never committed are discarded by Azure.
+    The content name is the digest of bytes not read yet when the first
+    block goes out, so the blocks cannot be staged on it directly.
+    """
+    block_size = 4 * 2 ** 20
+    # Lifetime of the read SAS the copy authenticates its source with.
+    copy_sas_seconds = 300
+
+    def __init__(self, storage, staging_name):
+        self.storage = storage
+        self.staging = storage.client.get_blob_client(storage._get_valid_path(staging_name))
+        self.buffer = bytearray()
+        self.blocks = []
+
+    def stage(self):
+        from azure.storage.blob import BlobBlock
+
+        block_id = base64.b64encode(f'{len(self.blocks):08d}'.encode('ascii')).decode('ascii')
+        self.staging.stage_block(block_id, bytes(self.buffer), timeout=self.storage.timeout)
+        self.blocks.append(BlobBlock(block_id=block_id))
+        self.buffer.clear()
+
+    def write(self, chunk):
+        self.buffer += chunk
+        if len(self.buffer) >= self.block_size:
+            self.stage()
+
+    def source_url(self):
+        """The staging blob's URL with a short read-only SAS; without one a private container refuses the copy."""
+        from azure.storage.blob import BlobSasPermissions, generate_blob_sas
+
+        expiry = self.storage._expire_at(self.copy_sas_seconds)
+        sas_token = generate_blob_sas(
+            self.storage.account_name,
+            self.storage.azure_container,
+            self.staging.blob_name,
+            account_key=self.storage.account_key,
+            user_delegation_key=self.storage.get_user_delegation_key(expiry),
+            permission=BlobSasPermissions(read=True),
+            expiry=expiry,
+        )
+        return f'{self.staging.url}?{sas_token}'
+
+    def commit(self, name):
+        from azure.storage.blob import ContentSettings
+
+        if self.buffer or not self.blocks:
+            self.stage()
+        path = self.storage._get_valid_path(name)
+        content_settings = ContentSettings(**self.storage._get_content_settings_parameters(path))
+        self.staging.commit_block_list(self.blocks, content_settings=content_settings, timeout=self.storage.timeout)
+        try:
+            target = self.storage.client.get_blob_client(path)
+            # Copies inside one account complete synchronously, without the
+            # bytes passing through this process again.
+            target.start_copy_from_url(self.source_url(), requires_sync=True, timeout=self.storage.timeout)
+        finally:
+            self.staging.delete_blob(timeout=self.storage.timeout)
+        return name
+
+    def abort(self):
+        self.buffer.clear()
+
+
+class SpooledWriter:
+    """Fallback for other backends: spool, then a regular storage.save()."""
+
+    def __init__(self, storage, staging_name):
+        from tempfile import SpooledTemporaryFile
+
+        self.storage = storage
+        self.file = SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+
+    def write(self, chunk):
+        self.file.write(chunk)
+
+    def commit(self, name):
+        from django.core.files import File
+
+        try:
+            if self.storage.exists(name):
+                return name
+            self.file.seek(0)
+            return self.storage.save(name, File(self.file, name))
+        finally:
+            self.file.close()
+
+    def abort(self):
+        self.file.close()
+
+
+def open_writer(storage, staging_name):
+    if isinstance(storage, FileSystemStorage):
+        return FileSystemWriter(storage, staging_name)
+    try:
+        from storages.backends.azure_storage import AzureStorage
+    except ImportError:
+        AzureStorage = None
+    if AzureStorage is not None and isinstance(storage, AzureStorage):
+        return AzureBlockWriter(storage, staging_name)
+    return SpooledWriter(storage, staging_name)
+
+
+class StreamingImageUploadHandler(FileUploadHandler):
+    """
+    Takes over the `image` part of Post forms; other parts go on to the
+    default handlers.
+
+    The content is hashed while it streams and stored under its SHA-256
+    (post/ab/abcd....jpg). When the MediaBlob index already has that digest
+    the staged copy is dropped and the upload resolves to the existing file.
+    """
+    chunk_size = 256 * 2 ** 10
+    field_name = 'image'
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.model_field = Post._meta.get_field('image')
+        self.max_size = settings.POST_IMAGE_MAX_UPLOAD_SIZE
+        self.writer = None
+        # (name, last_seen_at) of blobs this request created.
+        self.created = []
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # Reject before reading the body when even the declared length is too
+        # much; the other form fields are capped by DATA_UPLOAD_MAX_MEMORY_SIZE.
+        limit = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+        if limit is not None and content_length > self.max_size + limit:
+            raise UploadTooLarge()
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.writer = None
+        if field_name != self.field_name:
+            return
+        if content_type not in settings.POST_IMAGE_CONTENT_TYPES:
+            raise serializers.ValidationError({self.field_name: [f'Unsupported image type "{content_type}".']})
+        if content_length is not None and content_length > self.max_size:
+            raise UploadTooLarge()
+        self.writer = open_writer(self.model_field.storage, f'{STAGING_DIR}{uuid.uuid4().hex}.part')
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self.sniffed = None
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.writer is None:
+            return raw_data
+        try:
+            if start == 0:
+                self.sniffed = sniff(raw_data[:16])
+                if self.sniffed not in settings.POST_IMAGE_CONTENT_TYPES:
+                    raise serializers.ValidationError({self.field_name: ['The uploaded file is not a supported image.']})
+            self.size += len(raw_data)
+            if self.size > self.max_size:
+                raise UploadTooLarge()
+            self.hasher.update(raw_data)
+            self.writer.write(raw_data)
+        except BaseException:
+            self.abort()
+            raise
+        return None
+
+    def file_complete(self, file_size):
+        if self.writer is None:
+            return None
+        if file_size == 0:
+            self.abort()
+            raise serializers.ValidationError({self.field_name: ['The submitted file is empty.']})
+
+        digest = self.hasher.hexdigest()
+        try:
+            name = MediaBlob.objects.touch(digest)
+            if name is not None:
+                # Duplicate content: nothing is committed to storage.
+                self.abort()
+            else:
+                name = self.model_field.generate_filename(None, f'{digest[:2]}/{digest}{EXTENSIONS[self.sniffed]}')
+                name = self.writer.commit(name)
+                self.writer = None
+                blob, created = MediaBlob.objects.get_or_create(
+                    digest=digest,
+                    defaults={'name': name, 'size': file_size, 'content_type': self.sniffed},
+                )
+                name = blob.name
+                if created:
+                    self.created.append((name, blob.last_seen_at))
+        except BaseException:
+            self.abort()
+            raise
+        return StoredUpload(name, file_size, self.sniffed, self.charset, self.content_type_extra)
+
+    def upload_interrupted(self):
+        self.abort()
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
+
+    def discard(self):
+        """Drop blobs this request created when it did not succeed."""
+        self.abort()
+        for name, last_seen_at in self.created:
+            # Left alone if another upload has hit the blob since.
+            deleted, _ = MediaBlob.objects.filter(name=name, ref_count=0, last_seen_at=last_seen_at).delete()
+            if deleted:
+                self.model_field.storage.delete(name)
+        self.created = []
+
+
+class StreamingUploadMixin:
+    """Stream the post image to storage while the request body is parsed."""
+
+    def initialize_request(self, request, *args, **kwargs):
+        self.upload_handler = StreamingImageUploadHandler(request)
+        request.upload_handlers.insert(0, self.upload_handler)
+        return super().initialize_request(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if response.status_code >= 400:
+            # Nothing references the streamed file (validation or permission
+            # failed after parsing).
+            self.upload_handler.discard()
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -0,0 +1,290 @@
+"""
+Post view counts without a write per view.
+
+Every successful GET of a post detail calls hit(slug), which only increments
+a number in memory. Counts are kept in VIEW_COUNT_SHARDS shards, each with its
+own lock; threads are dealt shards round-robin on their first hit, so
+concurrent requests for the same hot post do not queue on one lock. Every VIEW_COUNT_FLUSH_INTERVAL seconds a
+background thread drains the shards and adds the totals to Post.view_count
+with one UPDATE per VIEW_COUNT_BATCH_SIZE posts; the post's updated_at and the
+response cache are left alone, so a cached detail shows its count from the
+time it was cached.
+
+With VIEW_COUNT_SPOOL_DIR set, every hit is also appended to a per-shard spool
+file (a `slug<TAB>views` line, written through to the OS), and the file is
+rotated together with the drain. Files a dead process did not apply are taken
+over by the next process that starts counting, and those of a failed UPDATE
+by the next flush, so a crash loses no views. A process that dies after the
+UPDATE but before removing its files counts those views twice.
+
+Spool files are named after their owner: the host (hostname and boot id), the
+pid and a random token per counter, so a new process that got a dead one's
+pid never writes to its files. Whether the owner is alive can only be told
+on its own host; files from other hosts sharing the directory are left to a
+process there.
+"""
+import atexit
+import hashlib
+import logging
+import os
+import re
+import secrets
+import socket
+import threading
+from collections import Counter
+from functools import lru_cache
+from itertools import count, islice
+from pathlib import Path
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.db.models import Case, F, PositiveBigIntegerField, Value, When
+from django.dispatch import receiver
+
+from .models import Post
+
+
+logger = logging.getLogger(__name__)
+
+SPOOL_SUFFIX = '.log'
+ROTATED_SUFFIX = '.flushing'
+# views-<node>-<pid>-<token>-...; files from before owners had a node and
+# token (views-<pid>-...) belong to this host.
+SPOOL_OWNER = re.compile(r'^views-(?:(?P<node>[0-9a-f]{12})-)?(?P<pid>\d+)-(?:(?P<token>[0-9a-f]{8})-)?')
+
+
+@lru_cache(maxsize=None)
+def node_id():
+    """This host, as it shows in spool file names."""
+    try:
+        with open('/proc/sys/kernel/random/boot_id', encoding='ascii') as handle:
+            boot = handle.read().strip()
+    except OSError:
+        boot = ''
+    return hashlib.sha1(f'{socket.gethostname()}:{boot}'.encode()).hexdigest()[:12]
+
+
+class Shard:
+    __slots__ = ('lock', 'counts', 'spool', 'path')
+
+    def __init__(self, path=None):
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.path = path
+        self.spool = open(path, 'a', encoding='utf-8', buffering=1) if path else None
+
+
+class ShardedCounter:
+    """A Counter that many threads can add to at once; drain() takes everything counted so far."""
+
+    def __init__(self, shards, spool_dir=None):
+        self.spool_dir = Path(spool_dir) if spool_dir else None
+        self.owner = f'views-{node_id()}-{os.getpid()}-{secrets.token_hex(4)}'
+        self.rotations = count()
+        self.shards = [Shard(self.spool_path(index)) for index in range(shards)]
+        self.local = threading.local()
+        self.assigned = count()
+
+    def spool_path(self, index):
+        if self.spool_dir is None:
+            return None
+        return self.spool_dir / f'{self.owner}-{index}{SPOOL_SUFFIX}'
+
+    def shard(self):
+        """The calling thread's shard."""
+        try:
+            return self.local.shard
+        except AttributeError:
+            # Thread idents are aligned addresses, useless as a modulus.
+            shard = self.local.shard = self.shards[next(self.assigned) % len(self.shards)]
+            return shard
+
+    def add(self, key, amount=1):
+        shard = self.shard()
+        with shard.lock:
+            shard.counts[key] += amount
+            if shard.spool is not None:
+                shard.spool.write(f'{key}\t{amount}\n')
+
+    def drain(self):
+        """(the merged counts, the spool files holding exactly those counts)"""
+        total = Counter()
+        files = []
+        for shard in self.shards:
+            with shard.lock:
+                counts, shard.counts = shard.counts, Counter()
+                if shard.spool is not None and counts:
+                    shard.spool.close()
+                    rotated = shard.path.with_name(f'{shard.path.stem}.{next(self.rotations)}{ROTATED_SUFFIX}')
+                    os.replace(shard.path, rotated)
+                    files.append(rotated)
+                    shard.spool = open(shard.path, 'a', encoding='utf-8', buffering=1)
+            total.update(counts)
+        return total, files
+
+    def restore(self, counts):
+        """Put drained counts back (their spool files are kept by the caller)."""
+        shard = self.shards[0]
+        with shard.lock:
+            shard.counts.update(counts)
+
+    def close(self):
+        for shard in self.shards:
+            with shard.lock:
+                if shard.spool is not None:
+                    shard.spool.close()
+                    shard.spool = None
+                    # Anything counted since the last drain stays for recover().
+                    if not shard.counts:
+                        os.remove(shard.path)
+
+
+def read_spool(path):
+    counts = Counter()
+    with open(path, encoding='utf-8') as handle:
+        for line in handle:
+            key, _, amount = line.rstrip('\n').partition('\t')
+            # A torn last line from a crash has no amount; skip it.
+            if key and amount.isdigit():
+                counts[key] += int(amount)
+    return counts
+
+
+def apply(counts, batch_size=None):
+    """Add `counts` ({slug: views}) to Post.view_count."""
+    batch_size = batch_size or settings.VIEW_COUNT_BATCH_SIZE
+    items = iter(counts.items())
+    while batch := list(islice(items, batch_size)):
+        Post.objects.filter(slug__in=[slug for slug, _ in batch]).update(
+            view_count=F('view_count') + Case(
+                *[When(slug=slug, then=Value(views)) for slug, views in batch],
+                output_field=PositiveBigIntegerField(),
+            ),
+        )
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class ViewCounter:
+
+    def __init__(self, shards, interval=None, spool_dir=None):
+        if spool_dir:
+            Path(spool_dir).mkdir(parents=True, exist_ok=True)
+        self.counter = ShardedCounter(shards, spool_dir)
+        self.interval = interval
+        self.flush_lock = threading.Lock()
+        # Spool files of counts that are back in the counter after a failed flush.
+        self.unapplied = []
+        self.stopped = threading.Event()
+        self.thread = None
+        if spool_dir:
+            self.recover(Path(spool_dir))
+        if interval:
+            self.thread = threading.Thread(target=self.run, name='view-counts', daemon=True)
+            self.thread.start()
+
+    def hit(self, slug):
+        self.counter.add(slug)
+
+    def flush(self):
+        """Write everything counted so far; returns the number of views written."""
+        with self.flush_lock:
+            counts, files = self.counter.drain()
+            files, self.unapplied = self.unapplied + files, []
+            if not counts:
+                return 0
+            try:
+                apply(counts)
+            except Exception:
+                # Keep the counts (in memory and on disk) for the next flush.
+                self.counter.restore(counts)
+                self.unapplied = files
+                raise
+            for path in files:
+                os.remove(path)
+            return sum(counts.values())
+
+    def recover(self, spool_dir):
+        """Take over the spool files left behind by processes that are gone."""
+        for path in sorted(spool_dir.glob('views-*')):
+            owner = SPOOL_OWNER.match(path.name)
+            if owner is None or path.name.startswith(f'{self.counter.owner}-'):
+                continue
+            if (owner['node'] or node_id()) != node_id() or _alive(int(owner['pid'])):
+                continue
+            # Renaming claims the file: another process recovering at the same
+            # time gets FileNotFoundError, and if this one dies the file is ours
+            # to be recovered in turn.
+            claimed = path.with_name(f'{self.counter.owner}-r{next(self.counter.rotations)}{ROTATED_SUFFIX}')
+            try:
+                os.replace(path, claimed)
+            except FileNotFoundError:
+                continue
+            self.counter.restore(read_spool(claimed))
+            self.unapplied.append(claimed)
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Applying recovered view counts failed")
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Flushing view counts failed")
+            finally:
+                # Worker threads get their own connections; do not leak them.
+                close_old_connections()
+
+    def shutdown(self):
+        """Stop the background thread and write what is left."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        try:
+            written = self.flush()
+        except Exception:
+            logger.exception("Flushing view counts on shutdown failed")
+            return 0
+        self.counter.close()
+        return written
+
+
+@lru_cache(maxsize=None)
+def get_counter():
+    counter = ViewCounter(
+        settings.VIEW_COUNT_SHARDS, settings.VIEW_COUNT_FLUSH_INTERVAL, settings.VIEW_COUNT_SPOOL_DIR,
+    )
+    atexit.register(counter.shutdown)
+    return counter
+
+
+def hit(slug):
+    if settings.VIEW_COUNTS_ENABLED:
+        get_counter().hit(slug)
+
+
+def shutdown():
+    """Flush and stop the current counter, if one was started."""
+    if get_counter.cache_info().currsize:
+        counter = get_counter()
+        get_counter.cache_clear()
+        atexit.unregister(counter.shutdown)
+        return counter.shutdown()
+    return 0
+
+
+@receiver(setting_changed)
+def reset_counter(setting, **kwargs):
+    if setting.startswith('VIEW_COUNT'):
+        shutdown()
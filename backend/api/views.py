@@ -1,10 +1,22 @@
 from django.shortcuts import render
 from django.contrib.auth.models import User
-from rest_framework import generics, filters
-from .serializers import UserSerializer, PostSerializer, CategorySerializer, CommentSerializer
+from django.db.models import Count, Max
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from rest_framework import generics, status
+from .serializers import UserSerializer, PostSerializer, PostListSerializer, CategorySerializer, CommentSerializer
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
 from .models import Post, Category, Comment
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from . import comment_buffer, db_router, view_counts
+from .cache import CachedResponseMixin
+from .conditional import ConditionalGetMixin
+from .fast_serializers import FastCommentSerializer, FastListMixin, FastPostListSerializer
+from .filters import FullTextSearchFilter, HotOrderingFilter
+from .pagination import KeysetPagination
+from .streaming import StreamingListMixin
+from .query_planner import QueryPlanMixin
+from .uploads import StreamingUploadMixin
+from rest_framework.permissions import IsAuthenticated, AllowAny, SAFE_METHODS
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
@@ -24,18 +36,27 @@ class MeView(APIView):
         return Response(serializer.data)
 
 # POST VIEWS
-class PostListCreateView(generics.ListCreateAPIView):
+class PostListCreateView(StreamingUploadMixin, CachedResponseMixin, StreamingListMixin, FastListMixin, QueryPlanMixin, generics.ListCreateAPIView):
     queryset = Post.objects.all().order_by('-created_at')
     serializer_class = PostSerializer
+    fast_serializer_class = FastPostListSerializer
+    pagination_class = KeysetPagination
     parser_classes = [MultiPartParser, FormParser]
-    filter_backends = [filters.SearchFilter]
-    search_fields = ['title', 'content','category__name','user__username']
+    filter_backends = [FullTextSearchFilter, HotOrderingFilter]
     permission_classes = [IsAuthenticatedOrReadOnly]  # This handles both cases properly
     
+    def get_serializer_class(self):
+        if self.request.method in SAFE_METHODS:
+            return PostListSerializer
+        return PostSerializer
+
+    def get_cache_resources(self):
+        return ['posts']
+
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
-class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
+class PostDetailView(StreamingUploadMixin, ConditionalGetMixin, CachedResponseMixin, QueryPlanMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Post.objects.all()
     serializer_class = PostSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
@@ -46,6 +67,25 @@ class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
         if self.request.method in ['PUT', 'PATCH', 'DELETE']:
             return [IsAuthenticated()]
         return [AllowAny()]
+
+    def get(self, request, *args, **kwargs):
+        response = super().get(request, *args, **kwargs)
+        # Cache hits and 304s are views too.
+        if request.method == 'GET' and response.status_code in (200, 304):
+            view_counts.hit(self.kwargs['slug'])
+        return response
+
+    def get_cache_resources(self):
+        # The detail shows the category's name.
+        return [f"post:{self.kwargs['slug']}", 'categories']
+
+    def get_validators(self):
+        row = Post.objects.filter(slug=self.kwargs['slug']).values_list(
+            'id', 'updated_at', 'comment_count', 'category__name'
+        ).first()
+        if row is None:
+            return None
+        return row, row[1]
     
     def perform_update(self, serializer):
         # Only allow the owner of the post to update it
@@ -61,30 +101,84 @@ class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
             raise PermissionDenied("You can only delete your own posts or you must be an admin.")
         instance.delete()
 
-class PostsByCategoryView(generics.ListAPIView):
-    serializer_class = PostSerializer
+class PostsByCategoryView(CachedResponseMixin, StreamingListMixin, FastListMixin, QueryPlanMixin, generics.ListAPIView):
+    serializer_class = PostListSerializer
+    fast_serializer_class = FastPostListSerializer
+    pagination_class = KeysetPagination
+    filter_backends = [HotOrderingFilter]
     permission_classes = [AllowAny]  # Add this line to allow unauthenticated access
     
     def get_queryset(self):
         category_name = self.kwargs['category_name']
-        return Post.objects.filter(category__name=category_name)
+        return Post.objects.filter(category__name=category_name).order_by('-created_at')
+
+    def get_cache_resources(self):
+        return ['posts']
 
 # CATEGORY VIEWS
-class CategoryListCreateView(generics.ListCreateAPIView):
+class CategoryListCreateView(ConditionalGetMixin, CachedResponseMixin, QueryPlanMixin, generics.ListCreateAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
 
+    def get_cache_resources(self):
+        return ['categories']
+
+    def get_validators(self):
+        # Categories are only ever added through the API, so count and
+        # highest id identify the list.
+        stats = Category.objects.aggregate(count=Count('id'), last=Max('id'))
+        return (stats['count'], stats['last']), None
+
 # COMMENTS VIEWS
-class PostCommentListCreateView(generics.ListCreateAPIView):
+class PostCommentListCreateView(ConditionalGetMixin, CachedResponseMixin, StreamingListMixin, FastListMixin, QueryPlanMixin, generics.ListCreateAPIView):
     serializer_class = CommentSerializer
+    fast_serializer_class = FastCommentSerializer
+    pagination_class = KeysetPagination
     permission_classes = [IsAuthenticatedOrReadOnly]
     
     def get_queryset(self):
         post_id = self.kwargs['post_id']
         return Comment.objects.filter(post__id=post_id).order_by('-created_at')
+
+    def get_cache_resources(self):
+        return [f"comments:{self.kwargs['post_id']}"]
+
+    def get_validators(self):
+        # Every comment write touches the post's comment_count and updated_at.
+        row = Post.objects.filter(id=self.kwargs['post_id']).values_list('updated_at', 'comment_count').first()
+        if row is None:
+            return None
+        return row, row[0]
     
+    def get_post(self, serializer):
+        # Validation has already loaded the body's `post`, normally the same one as in the URL.
+        post = serializer.validated_data.get('post')
+        if post is not None and post.pk == self.kwargs['post_id']:
+            return post
+        return get_object_or_404(Post, id=self.kwargs['post_id'])
+
+    def create(self, request, *args, **kwargs):
+        if not comment_buffer.is_enabled():
+            return super().create(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        comment = Comment(**serializer.validated_data, user=request.user)
+        comment.post = self.get_post(serializer)
+        buffer = comment_buffer.get_buffer()
+        try:
+            serializer.instance = buffer.submit(comment)
+        except Post.DoesNotExist:
+            raise Http404
+        except TimeoutError:
+            # Taken back out of the queue, so retrying cannot duplicate it.
+            return Response({'detail': "Comment not saved, try again."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        # The buffer's thread may have done the write; pin the commenter all the same.
+        db_router.mark_written()
+        if buffer.durability == comment_buffer.ENQUEUE or serializer.instance.pk is None:
+            # Queued, not written yet: no id or created_at to report.
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     def perform_create(self, serializer):
-        post_id = self.kwargs['post_id']
-        post_instance = Post.objects.get(id=post_id)
-        serializer.save(user=self.request.user, post=post_instance)
\ No newline at end of file
+        serializer.save(user=self.request.user, post=self.get_post(serializer))
\ No newline at end of file
@@ -37,7 +37,7 @@ ALLOWED_HOSTS = ["*"]
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "api.authentication.CachedJWTAuthentication",
         "rest_framework.authentication.SessionAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": [
@@ -50,6 +50,11 @@ SIMPLE_JWT = {
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
 }
 
+# Seconds the user fields read by CachedJWTAuthentication stay in the api cache;
+# saving or deleting the user drops them right away. Only used when that cache
+# is shared by all workers (not locmem), or the drop would miss the others.
+AUTH_USER_CACHE_TIMEOUT = int(os.environ.get('AUTH_USER_CACHE_TIMEOUT', 300))
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -66,6 +71,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.QueryInstrumentationMiddleware',
+    'api.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -107,12 +114,130 @@ DATABASES = {
         )
 }
 
+# Read replicas (api/db_router.py): DATABASE_REPLICA_URLS is a comma-separated
+# list of database URLs, added as replica_1, replica_2, ... The API's read
+# requests use one of them; writes and a user's reads for REPLICA_PIN_SECONDS
+# after a write go to the primary.
+for index, url in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(',')), 1):
+    DATABASES[f'replica_{index}'] = dj_database_url.parse(url.strip(), conn_max_age=600, ssl_require=True)
+
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 10))
+
 if 'test' in sys.argv:
-    DATABASES['default'] = {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': ':memory:'
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': ':memory:'
+        },
+        # A second SQLite database for the router tests; nothing is routed to
+        # it unless a test enables ReplicaRouter with override_settings.
+        'replica': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': ':memory:'
+        },
     }
 
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias.startswith('replica_')]
+DATABASE_ROUTERS = ['api.db_router.ReplicaRouter'] if DATABASE_REPLICAS else []
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# The 'api' alias backs the response cache of the public read endpoints
+# (api/cache.py), the cached user fields of CachedJWTAuthentication and the
+# replica pins of api/db_router.py. Invalidation (a version bump) is only
+# exact when every worker sees the same cache: set REDIS_URL (needs the redis
+# package) in production, or API_CACHE_BACKEND=file to share it between the
+# workers of one host. Without either the cache is per process (locmem), which
+# is only correct with a single worker process (e.g. runserver); the user cache
+# and the read replicas (whose pins live there too) are not used with it.
+
+API_CACHE_TIMEOUT = int(os.environ.get('API_CACHE_TIMEOUT', 300))
+API_CACHE_MAX_ENTRIES = int(os.environ.get('API_CACHE_MAX_ENTRIES', 5000))
+API_CACHE_BACKENDS = {
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_URL'),
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('API_CACHE_DIR', BASE_DIR / '.cache' / 'api'),
+        'OPTIONS': {'MAX_ENTRIES': API_CACHE_MAX_ENTRIES},
+    },
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'api',
+        'OPTIONS': {'MAX_ENTRIES': API_CACHE_MAX_ENTRIES},
+    },
+}
+API_CACHE_BACKEND = os.environ.get('API_CACHE_BACKEND', 'redis' if os.environ.get('REDIS_URL') else 'locmem')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': {
+        **API_CACHE_BACKENDS[API_CACHE_BACKEND],
+        'TIMEOUT': API_CACHE_TIMEOUT,
+    },
+}
+
+if 'test' in sys.argv:
+    # Tests that exercise the response cache switch it on with override_settings.
+    CACHES['api'] = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+
+# List endpoints serialize .values() rows with api/fast_serializers.py instead of DRF serializers.
+API_FAST_SERIALIZERS = os.environ.get('API_FAST_SERIALIZERS', 'true').lower() not in ('0', 'false', 'no')
+# Rows per database fetch and per encoded chunk of ?format=json-stream responses (api/streaming.py).
+API_STREAM_CHUNK_SIZE = int(os.environ.get('API_STREAM_CHUNK_SIZE', 2000))
+
+# New comments (api/comment_buffer.py): 'direct' saves each one in its own
+# transaction, 'buffered' queues validated comments and writes them with one
+# bulk_create per COMMENT_BUFFER_SIZE comments or COMMENT_BUFFER_WINDOW seconds.
+# COMMENT_BUFFER_DURABILITY: 'commit' answers 201 after the batch committed,
+# 'enqueue' answers 202 right away and may lose queued comments on a crash.
+# With a window of 0 a 'commit' request writes the queue right away.
+COMMENT_WRITE_MODE = os.environ.get('COMMENT_WRITE_MODE', 'direct')
+COMMENT_BUFFER_SIZE = int(os.environ.get('COMMENT_BUFFER_SIZE', 50))
+COMMENT_BUFFER_WINDOW = float(os.environ.get('COMMENT_BUFFER_WINDOW', 0.05))
+COMMENT_BUFFER_DURABILITY = os.environ.get('COMMENT_BUFFER_DURABILITY', 'commit')
+
+# Post view counts (api/view_counts.py): counted in memory, added to
+# Post.view_count every VIEW_COUNT_FLUSH_INTERVAL seconds. With a spool
+# directory every view is also appended to a file there, so a crash loses none.
+VIEW_COUNTS_ENABLED = os.environ.get('VIEW_COUNTS_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+VIEW_COUNT_SHARDS = int(os.environ.get('VIEW_COUNT_SHARDS', 16))
+VIEW_COUNT_BATCH_SIZE = int(os.environ.get('VIEW_COUNT_BATCH_SIZE', 500))
+# Tests flush by hand.
+VIEW_COUNT_FLUSH_INTERVAL = None if 'test' in sys.argv else float(os.environ.get('VIEW_COUNT_FLUSH_INTERVAL', 10))
+VIEW_COUNT_SPOOL_DIR = os.environ.get('VIEW_COUNT_SPOOL_DIR') or None
+
+# Hot feed, ?ordering=hot (api/hot.py): a post and each of its comments add
+# their weight to the post's score, halved every HOT_HALF_LIFE_HOURS. Run
+# `manage.py rebase_hot_scores` daily to keep the stored scores small.
+HOT_HALF_LIFE_HOURS = float(os.environ.get('HOT_HALF_LIFE_HOURS', 12))
+HOT_POST_WEIGHT = float(os.environ.get('HOT_POST_WEIGHT', 1))
+HOT_COMMENT_WEIGHT = float(os.environ.get('HOT_COMMENT_WEIGHT', 1))
+# How long a process trusts its copy of the current epoch; rebase_hot_scores
+# waits that long before sweeping up posts created on the old one.
+HOT_EPOCH_CACHE_SECONDS = int(os.environ.get('HOT_EPOCH_CACHE_SECONDS', 60))
+
+# Background tasks (api/tasks.py): queued in the tasks table, run by
+# `manage.py run_tasks` with TASKS_WORKERS threads per process. A failing task
+# is retried after TASKS_RETRY_DELAY seconds, doubling up to
+# TASKS_RETRY_MAX_DELAY, until it has run TASKS_MAX_ATTEMPTS times.
+TASKS_WORKERS = int(os.environ.get('TASKS_WORKERS', 4))
+TASKS_POLL_INTERVAL = float(os.environ.get('TASKS_POLL_INTERVAL', 1))
+TASKS_LEASE_SECONDS = int(os.environ.get('TASKS_LEASE_SECONDS', 300))
+TASKS_MAX_ATTEMPTS = int(os.environ.get('TASKS_MAX_ATTEMPTS', 5))
+TASKS_RETRY_DELAY = float(os.environ.get('TASKS_RETRY_DELAY', 10))
+TASKS_RETRY_MAX_DELAY = float(os.environ.get('TASKS_RETRY_MAX_DELAY', 3600))
+# How long finished tasks (and so their idempotency keys) are kept.
+TASKS_RETENTION_HOURS = float(os.environ.get('TASKS_RETENTION_HOURS', 24))
+# Run tasks in the request thread right after commit, for tests or a
+# development server without a worker.
+TASKS_EAGER = 'test' in sys.argv or os.environ.get('TASKS_EAGER', 'false').lower() in ('1', 'true', 'yes')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -160,6 +285,11 @@ CORS_ALLOW_CREDENTIALS = True
 
 #Azure Storage settings
 load_dotenv()
+# Private container: URLs are signed (SAS) for this many seconds, and cached
+# by api/media_urls.py until shortly before they expire. Must be well above
+# API_CACHE_TIMEOUT, which cached responses add to the life of a URL.
+MEDIA_URL_SIGNING_TTL = int(os.environ.get('MEDIA_URL_SIGNING_TTL', 0)) or None
+MEDIA_URL_CACHE_SIZE = int(os.environ.get('MEDIA_URL_CACHE_SIZE', 10000))
 STORAGES = {
     "default": {
         "BACKEND": "storages.backends.azure_storage.AzureStorage",
@@ -168,6 +298,7 @@ STORAGES = {
             "account_key": os.environ.get("AZURE_ACCOUNT_KEY"),
             "azure_container": "media",
             "overwrite_files": False,    # opcjonalnie: czy nadpisywać pliki o tej samej nazwie
+            "expiration_secs": MEDIA_URL_SIGNING_TTL,
         },
     },
     "staticfiles": {
@@ -175,3 +306,15 @@ STORAGES = {
     },
 }
 MEDIA_URL = f"https://{os.environ.get('AZURE_ACCOUNT_NAME')}.blob.core.windows.net/media/"
+# Public media URLs are built from this prefix without asking the storage backend.
+MEDIA_CDN_URL = os.environ.get('MEDIA_CDN_URL')
+
+# Post images are streamed to storage while the form is parsed (api/uploads.py).
+POST_IMAGE_MAX_UPLOAD_SIZE = int(os.environ.get('POST_IMAGE_MAX_UPLOAD_SIZE', 10 * 2 ** 20))
+POST_IMAGE_CONTENT_TYPES = ['image/jpeg', 'image/png', 'image/gif', 'image/webp']
+
+# Image pipeline (api/images.py): uploaded post images are turned into
+# width-bounded WebP variants plus a thumbnail by a background task.
+IMAGE_VARIANT_WIDTHS = [320, 640, 1280]
+IMAGE_THUMBNAIL_SIZE = (200, 200)
+IMAGE_WEBP_QUALITY = int(os.environ.get('IMAGE_WEBP_QUALITY', 80))
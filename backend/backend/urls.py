@@ -1,6 +1,10 @@
 from django.contrib import admin
 from django.urls import path, include
 from api.views import CreateUserView, PostListCreateView, PostDetailView, CategoryListCreateView, PostCommentListCreateView, MeView, PostsByCategoryView
+from api.async_views import (
+    AsyncMeView, AsyncPostListView, AsyncPostDetailView, AsyncPostsByCategoryView,
+    AsyncCategoryListView, AsyncPostCommentListView,
+)
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 urlpatterns = [
@@ -15,4 +19,11 @@ urlpatterns = [
     path('api/posts/<int:post_id>/comments/', PostCommentListCreateView.as_view(), name='post-comments'),
     path('api/me/', MeView.as_view(), name='me'),
     path('api/posts/category/<str:category_name>/', PostsByCategoryView.as_view(), name='posts-by-category'),
+    # Async read path (served natively under ASGI), same responses as above.
+    path('api/async/posts/', AsyncPostListView.as_view(), name='async-post-list'),
+    path('api/async/posts/<slug:slug>/', AsyncPostDetailView.as_view(), name='async-post-detail'),
+    path('api/async/categories/', AsyncCategoryListView.as_view(), name='async-category-list'),
+    path('api/async/posts/<int:post_id>/comments/', AsyncPostCommentListView.as_view(), name='async-post-comments'),
+    path('api/async/me/', AsyncMeView.as_view(), name='async-me'),
+    path('api/async/posts/category/<str:category_name>/', AsyncPostsByCategoryView.as_view(), name='async-posts-by-category'),
 ]
@@ -5,7 +5,9 @@ import { useAuth } from "../context/AuthContext";
 
 const PostComments = ({ postId }) => {
   const [comments, setComments] = useState([]);
+  const [next, setNext] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [error, setError] = useState("");
   const auth = useAuth();
 
@@ -14,7 +16,8 @@ const PostComments = ({ postId }) => {
     setLoading(true);
     try {
       const response = await api.get(`/api/posts/${postId}/comments/`);
-      setComments(response.data);
+      setComments(response.data.results);
+      setNext(response.data.next);
       setError("");
     } catch (err) {
       console.error("Błąd podczas pobierania komentarzy:", err);
@@ -24,6 +27,21 @@ const PostComments = ({ postId }) => {
     }
   };
 
+  // Funkcja dociągająca starsze komentarze (URL z kursorem z pola `next`)
+  const loadMoreComments = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await api.get(next);
+      setComments((prevComments) => [...prevComments, ...response.data.results]);
+      setNext(response.data.next);
+    } catch (err) {
+      console.error("Błąd podczas pobierania komentarzy:", err);
+      setError("Nie udało się pobrać komentarzy. Spróbuj ponownie później.");
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   // Pobierz komentarze przy montowaniu komponentu
   useEffect(() => {
     fetchComments();
@@ -103,9 +121,18 @@ const PostComments = ({ postId }) => {
         )}
       </div>
 
-      {/* Przycisk ładowania więcej komentarzy - można dodać w przyszłości */}
+      {/* Przyciski ładowania starszych i odświeżania komentarzy */}
       {comments.length > 0 && (
-        <div className="mt-4 text-center">
+        <div className="mt-4 flex justify-center gap-6">
+          {next && (
+            <button
+              onClick={loadMoreComments}
+              disabled={loadingMore}
+              className="text-blue-500 hover:text-blue-700 disabled:text-gray-400"
+            >
+              {loadingMore ? "Ładowanie..." : "Pokaż starsze komentarze"}
+            </button>
+          )}
           <button
             onClick={fetchComments}
             className="text-blue-500 hover:text-blue-700"
@@ -1,12 +1,14 @@
 import { useEffect, useState } from "react";
-import { useLocation } from "react-router-dom";
+import { Link, useLocation } from "react-router-dom";
 import api from "../api";
-import PostCard from "./postCard";
+import PostCard, { POST_CARD_FIELDS } from "./postCard";
 import Skeleton from "./Skeleton";
 
 export default function PostGrid() {
   const [posts, setPosts] = useState([]);
+  const [next, setNext] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const location = useLocation();
 
   useEffect(() => {
@@ -17,15 +19,19 @@ export default function PostGrid() {
         const urlParams = new URLSearchParams(location.search);
         const searchQuery = urlParams.get("s");
 
-        let endpoint = "/api/posts/";
+        const params = { fields: POST_CARD_FIELDS };
         if (searchQuery) {
-          endpoint += `?search=${encodeURIComponent(searchQuery)}`;
+          params.search = searchQuery;
+        }
+        if (urlParams.get("sort") === "hot") {
+          params.ordering = "hot";
         }
 
-        const request = await api.get(endpoint);
+        const request = await api.get("/api/posts/", { params });
 
         if (request.status === 200) {
-          setPosts(request.data);
+          setPosts(request.data.results);
+          setNext(request.data.next);
         } else {
           console.warn("Nieoczekiwany status:", request.status);
         }
@@ -39,11 +45,36 @@ export default function PostGrid() {
     getPosts();
   }, [location.search]);
 
+  // Kolejna strona: `next` to gotowy URL z kursorem, zwrócony przez API
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      const { data } = await api.get(next);
+      setPosts((prevPosts) => [...prevPosts, ...data.results]);
+      setNext(data.next);
+    } catch (error) {
+      console.error("Błąd pobierania kolejnych postów:", error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const urlParams = new URLSearchParams(location.search);
   const searchQuery = urlParams.get("s");
+  const hot = urlParams.get("sort") === "hot";
 
   return (
     <div>
+      {!searchQuery && (
+        <div className="flex gap-4 mt-4 text-sm font-medium">
+          <Link to="/" className={hot ? "text-gray-500" : "text-blue-700"}>
+            Najnowsze
+          </Link>
+          <Link to="/?sort=hot" className={hot ? "text-blue-700" : "text-gray-500"}>
+            Gorące
+          </Link>
+        </div>
+      )}
       {searchQuery && (
         <div className="mb-6 mt-4">
           <h2 className="text-2xl font-semibold mb-2">
@@ -52,7 +83,7 @@ export default function PostGrid() {
           <p className="text-gray-600">
             {loading
               ? "Szukanie..."
-              : `Znaleziono ${posts.length} ${
+              : `Znaleziono ${posts.length}${next ? "+" : ""} ${
                   posts.length !== 1 ? "wyników" : "wynik"
                 }`}
           </p>
@@ -76,6 +107,18 @@ export default function PostGrid() {
               </div>
             )}
       </div>
+
+      {!loading && next && (
+        <div className="mb-10 text-center">
+          <button
+            onClick={loadMore}
+            disabled={loadingMore}
+            className="text-blue-500 hover:text-blue-700 disabled:text-gray-400"
+          >
+            {loadingMore ? "Ładowanie..." : "Pokaż więcej"}
+          </button>
+        </div>
+      )}
     </div>
   );
 }
@@ -1,11 +1,18 @@
 import { Link } from "react-router-dom";
+import { imageSrc, imageSrcSet } from "../lib/images";
+
+// Pola potrzebne karcie; lista postów pobiera tylko je (?fields=), bez treści.
+export const POST_CARD_FIELDS = "id,slug,title,category,image,comment_count,excerpt,reading_time";
 
 export default function PostCard({ post }) {
   return (
     <div className="card bg-base-100 shadow-sm">
       <figure>
         <img
-          src={post.image}
+          src={imageSrc(post.image)}
+          srcSet={imageSrcSet(post.image)}
+          sizes="(min-width: 1024px) 33vw, (min-width: 640px) 50vw, 100vw"
+          loading="lazy"
           alt="Shoes"
           className="h-64 w-full object-cover"
         />
@@ -22,6 +29,10 @@ export default function PostCard({ post }) {
             {post.category}
           </Link>
         )}
+        {post.excerpt && <p className="text-gray-600">{post.excerpt}</p>}
+        {post.reading_time > 0 && (
+          <p className="text-sm text-gray-500">{post.reading_time} min czytania</p>
+        )}
 
         <Link to={`/post/${post.slug}`}>Zobacz więcej</Link>
       </div>
@@ -0,0 +1,7 @@
+// `post.image` z API: { original, thumbnail, srcset: { "320w": url, ... } }
+export const imageSrc = (image) => image?.original ?? image;
+
+export const imageSrcSet = (image) =>
+  Object.entries(image?.srcset ?? {})
+    .map(([width, url]) => `${url} ${width}`)
+    .join(", ") || undefined;
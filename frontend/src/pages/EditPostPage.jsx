@@ -39,7 +39,7 @@ export default function EditPostPage() {
 
         setCategory(data.category);
 
-        setCurrentImage(data.image); // URL obrazka
+        setCurrentImage(data.image?.thumbnail); // URL miniaturki obrazka
       } catch (err) {
         console.error(err);
         setFetchError("Nie udało się wczytać danych posta.");
@@ -5,6 +5,7 @@ import { useAuth } from "../context/AuthContext";
 import LoadingIndicator from "../components/LoadingIndicator";
 import PostComments from "../components/PostComments"; // Dodajemy import komponentu komentarzy
 import PostContent from "../components/PostContent";
+import { imageSrc, imageSrcSet } from "../lib/images";
 
 export default function PostDetail() {
   const { slug } = useParams();
@@ -127,7 +128,9 @@ export default function PostDetail() {
       {post.image && (
         <div className="w-full h-96 bg-gray-300 overflow-hidden">
           <img
-            src={post.image}
+            src={imageSrc(post.image)}
+            srcSet={imageSrcSet(post.image)}
+            sizes="(min-width: 1152px) 1152px, 100vw"
             alt={post.title}
             className="w-full h-full object-cover"
             onError={(e) => {
@@ -155,6 +158,7 @@ export default function PostDetail() {
           <div className="text-sm text-gray-500">
             <p>Dodano: {formattedDate}</p>
             <p>Komentarzy: {post.comment_count}</p>
+            <p>Wyświetleń: {post.view_count}</p>
           </div>
         </div>
 
@@ -1,13 +1,15 @@
 import React, { useEffect, useState } from "react";
 import { useParams, Link } from "react-router-dom";
 import api from "../api";
-import PostCard from "../components/postCard";
+import PostCard, { POST_CARD_FIELDS } from "../components/postCard";
 import Skeleton from "../components/Skeleton";
 
 export default function PostsByCategory() {
   const { categoryName } = useParams();
   const [posts, setPosts] = useState([]);
+  const [next, setNext] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [error, setError] = useState(null);
 
   useEffect(() => {
@@ -16,10 +18,12 @@ export default function PostsByCategory() {
       setError(null);
       try {
         const { data, status } = await api.get(
-          `/api/posts/category/${categoryName}/`
+          `/api/posts/category/${categoryName}/`,
+          { params: { fields: POST_CARD_FIELDS } }
         );
         if (status === 200) {
-          setPosts(data);
+          setPosts(data.results);
+          setNext(data.next);
         } else {
           console.warn("Nieoczekiwany status:", status);
         }
@@ -33,6 +37,19 @@ export default function PostsByCategory() {
     fetchPosts();
   }, [categoryName]);
 
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      const { data } = await api.get(next);
+      setPosts((prevPosts) => [...prevPosts, ...data.results]);
+      setNext(data.next);
+    } catch (err) {
+      console.error("Błąd pobierania kolejnych postów z kategorii:", err);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   return (
     <div className="container mx-auto my-8">
       <header className="mb-6">
@@ -66,6 +83,18 @@ export default function PostsByCategory() {
           ))}
         </div>
       )}
+
+      {!loading && !error && next && (
+        <div className="mt-6 text-center">
+          <button
+            onClick={loadMore}
+            disabled={loadingMore}
+            className="text-blue-500 hover:text-blue-700 disabled:text-gray-400"
+          >
+            {loadingMore ? "Ładowanie..." : "Pokaż więcej"}
+          </button>
+        </div>
+      )}
     </div>
   );
 }